@@ -0,0 +1,55 @@
+# Run from the repository root with: python -m benchmarks.filter_benchmark
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from pine_client.client import build_filter
+
+
+def deep_filter(depth: int) -> Any:
+    filter: Any = {"a": "b"}
+    for i in range(depth):
+        filter = {"$or" if i % 2 else "$and": [{"c": {"$ne": i}}, filter]}
+    return filter
+
+
+def wide_filter(width: int) -> Any:
+    return {
+        "$or": [
+            {
+                "a": {"$contains": f"value{i}"},
+                "b": {"$in": [i, i + 1]},
+                "c": {"$any": {"$alias": "x", "$expr": {"x": {"d": i}}}},
+            }
+            for i in range(width)
+        ]
+    }
+
+
+CASES: Dict[str, Any] = {
+    "deep-25": deep_filter(25),
+    "deep-80": deep_filter(80),
+    "wide-100": wide_filter(100),
+    "wide-1000": wide_filter(1000),
+}
+
+
+def measure(fn: Callable[[], Any], number: int) -> Dict[str, float]:
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"usec": seconds * 1e6, "peak_kib": peak / 1024}
+
+
+def main():
+    for name, filter in CASES.items():
+        result = measure(lambda: "".join(build_filter(filter)), 20)
+        print(
+            f"{name:>10}: {result['usec']:10.1f} us  {result['peak_kib']:8.1f} KiB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
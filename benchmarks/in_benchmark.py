@@ -0,0 +1,39 @@
+# Run from the repository root with: python -m benchmarks.in_benchmark
+import timeit
+import uuid
+from typing import Any, Callable, List
+
+from pine_client.client import build_filter
+from pine_client.utils import escape_value, escape_value_list
+
+
+def per_element(values: List[Any]) -> str:
+    # The path every element used to take before escape_value_list
+    return ", ".join(f"{escape_value(value)}" for value in values)
+
+
+def best(fn: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e3
+
+
+def main():
+    for size in [1_000, 10_000, 100_000]:
+        number = max(1, 100_000 // size)
+        cases = {
+            "ids": list(range(size)),
+            "uuids": [uuid.uuid4().hex for _ in range(size)],
+            "names": [f"device name {i}/é" for i in range(size)],
+        }
+        for name, values in cases.items():
+            filter = {"id": {"$in": values}}
+            old = best(lambda: per_element(values), number)
+            new = best(lambda: escape_value_list(values), number)
+            total = best(lambda: build_filter(filter), number)
+            print(
+                f"{name:>6} x {size:>7}: per element {old:8.2f} ms"
+                f"  batch {new:8.2f} ms  build_filter {total:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
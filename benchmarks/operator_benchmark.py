@@ -0,0 +1,90 @@
+# Run from the repository root with: python -m benchmarks.operator_benchmark
+import timeit
+from typing import Any, Dict
+
+from pine_client.client import build_filter, build_option, handle_options
+
+FUNCTIONS = [
+    "$contains",
+    "$endswith",
+    "$startswith",
+    "$tolower",
+    "$toupper",
+    "$trim",
+    "$year",
+    "$month",
+    "$day",
+    "$round",
+    "$floor",
+    "$ceiling",
+    "$isof",
+    "$cast",
+]
+
+
+def function_filter(width: int) -> Any:
+    return {
+        "$and": [
+            {f"field{i}": {FUNCTIONS[i % len(FUNCTIONS)]: f"value{i}"}}
+            for i in range(width)
+        ]
+    }
+
+
+def nested_function_filter(width: int) -> Any:
+    return {
+        "$or": [
+            {
+                "$eq": [
+                    {"$tolower": {"$": f"field{i}"}},
+                    {"$toupper": {"$trim": {"$": "other"}}},
+                ]
+            }
+            for i in range(width)
+        ]
+    }
+
+
+CASES: Dict[str, Any] = {
+    "functions-10": function_filter(10),
+    "functions-200": function_filter(200),
+    "nested-functions-200": nested_function_filter(200),
+}
+
+OPTIONS = {
+    "$select": ["a", "b"],
+    "$filter": {"a": "b"},
+    "$orderby": "a asc",
+    "$top": 10,
+    "$skip": 20,
+}
+
+
+def main():
+    for name, filter in CASES.items():
+        number = 50
+        seconds = min(
+            timeit.repeat(lambda: build_filter(filter), number=number, repeat=5)
+        )
+        print(f"{name:>22}: {seconds / number * 1e6:10.1f} us")
+
+    number = 5000
+    seconds = min(
+        timeit.repeat(
+            lambda: [build_option(k, v) for k, v in OPTIONS.items()],
+            number=number,
+            repeat=5,
+        )
+    )
+    print(f"{'options':>22}: {seconds / number * 1e6:10.1f} us")
+
+    seconds = min(
+        timeit.repeat(
+            lambda: handle_options("$expand", OPTIONS, "a"), number=number, repeat=5
+        )
+    )
+    print(f"{'expand-options':>22}: {seconds / number * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Run from the repository root with: python -m benchmarks.stress_benchmark
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from pine_client.client import build_expand, build_filter
+
+
+def deep_filter(depth: int) -> Any:
+    filter: Any = {"a": "b"}
+    for i in range(depth):
+        filter = {"$or" if i % 2 else "$and": [{"c": {"$ne": i}}, filter]}
+    return filter
+
+
+def deep_not_filter(depth: int) -> Any:
+    filter: Any = {"a": "b"}
+    for _ in range(depth):
+        filter = {"$not": filter}
+    return filter
+
+
+def wide_filter(width: int) -> Any:
+    return {
+        "$or": [
+            {"a": {"$contains": f"value{i}"}, "b": {"$in": [i, i + 1]}, "c": i}
+            for i in range(width)
+        ]
+    }
+
+
+def deep_expand(depth: int) -> Any:
+    expand: Any = "a"
+    for _ in range(depth):
+        expand = {"a": {"$expand": expand, "$top": 1}}
+    return expand
+
+
+CASES: Dict[str, Callable[[], Any]] = {
+    "deep-10k": lambda: "".join(build_filter(deep_filter(10_000))),
+    "not-10k": lambda: "".join(build_filter(deep_not_filter(10_000))),
+    "wide-100k": lambda: "".join(build_filter(wide_filter(100_000))),
+    "expand-10k": lambda: build_expand(deep_expand(10_000)),
+}
+
+
+def measure(fn: Callable[[], Any]) -> Dict[str, float]:
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": seconds * 1e3, "peak_mib": peak / 1024 / 1024}
+
+
+def main():
+    print(f"recursion limit: {sys.getrecursionlimit()}")
+    for name, fn in CASES.items():
+        result = measure(fn)
+        print(
+            f"{name:>10}: {result['ms']:10.1f} ms  {result['peak_mib']:8.1f} MiB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Run from the repository root with: python -m benchmarks.transport_benchmark
+import json
+import threading
+import time
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+from pine_client.transport import ConnectionPool, HTTPPinejsClient
+
+ROWS = json.dumps({"d": [{"id": i, "name": f"device {i}"} for i in range(20)]})
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, which Nagle would delay
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        data = ROWS.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class PerCallPool(ConnectionPool):
+    # What most hand written transports do, a new connection for every call
+    def release(self, connection: HTTPConnection, reusable: bool) -> None:
+        super().release(connection, False)
+
+
+class PerCallClient(HTTPPinejsClient):
+    def pool(self, origin: Any) -> ConnectionPool:
+        with self.pools_lock:
+            if origin not in self.pools:
+                self.pools[origin] = PerCallPool(
+                    origin, self.pool_size, self.timeout, self.pool_timeout
+                )
+            return self.pools[origin]
+
+
+def run(pine: HTTPPinejsClient, threads: int, requests: int) -> float:
+    def work() -> None:
+        for i in range(requests):
+            pine.get({"resource": "device", "options": {"$filter": {"id": i}}})
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (threads * requests) * 1e3
+
+
+def best(fn: Callable[[], float]) -> float:
+    return min(fn() for _ in range(3))
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        for threads in [1, 4, 16]:
+            requests = 2_000 // threads
+            with PerCallClient(url, pool_size=threads) as pine:
+                per_call = best(lambda: run(pine, threads, requests))
+            with HTTPPinejsClient(url, pool_size=threads) as pine:
+                pooled = best(lambda: run(pine, threads, requests))
+                opened = sum(pool.opened for pool in pine.pools.values())
+            print(
+                f"{threads:>2} threads: per call {per_call:6.3f} ms/request"
+                f"  pooled {pooled:6.3f} ms/request ({opened} connections)"
+                f"  {per_call / pooled:5.2f}x"
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,42 @@
 from .client import PinejsClientCore  # type: ignore # noqa
+from .async_client import AsyncPinejsClientCore  # type: ignore # noqa
+from .prepared import PreparedQuery  # type: ignore # noqa
+from .utils import Placeholder  # type: ignore # noqa
+from .client import (  # type: ignore # noqa
+    register_filter_operator,
+    register_filter_operation,
+    register_filter_function,
+)
+from .optimizer import optimize_filter  # type: ignore # noqa
+from .client import to_filter_node, to_query_options  # type: ignore # noqa
+from .ir import (  # type: ignore # noqa
+    QueryOptions,
+    FilterOption,
+    ExpandOption,
+    ExpandItem,
+    OrderByOption,
+    OrderByItem,
+    SelectOption,
+    TopOption,
+    SkipOption,
+    CustomOption,
+    ParameterAliasOption,
+    Compare,
+    In,
+    Call,
+    Raw,
+    And,
+    Or,
+    Not,
+    Lambda,
+)
+from .batch import (  # type: ignore # noqa
+    Batch,
+    AsyncBatch,
+    BatchOperation,
+    BatchRequestError,
+    MultipartBody,
+)
+from .loader import Loader, AsyncLoader  # type: ignore # noqa
+from .transport import HTTPPinejsClient, HTTPRequestError  # type: ignore # noqa
+from .adaptive import UpsertStrategy  # type: ignore # noqa
@@ -0,0 +1,94 @@
+from threading import Lock
+from typing import Any, Dict, Optional
+
+POST_FIRST = "post_first"
+LOOKUP_FIRST = "lookup_first"
+
+
+class ResourceStats:
+    __slots__ = (
+        "strategy",
+        "conflict_rate",
+        "upserts",
+        "conflicts",
+        "posts",
+        "failed_posts",
+        "lookups",
+        "patches",
+        "switches",
+    )
+
+    def __init__(self) -> None:
+        self.strategy = POST_FIRST
+        self.conflict_rate = 0.0
+        self.upserts = 0
+        self.conflicts = 0
+        self.posts = 0
+        self.failed_posts = 0
+        self.lookups = 0
+        self.patches = 0
+        self.switches = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UpsertStrategy:
+    # Tracks how often upserts of each resource hit an existing row, as an
+    # exponentially weighted moving average so it follows the workload.
+    # Mostly new rows are POSTed first, which needs one request when the row
+    # is new. Mostly existing rows are looked up first, which avoids the failed
+    # POST and its 409 for each of them. The two thresholds keep a rate that
+    # hovers around one of them from flipping the strategy on every upsert
+    def __init__(self, alpha: float = 0.1, high: float = 0.6, low: float = 0.4):
+        if not 0 < alpha <= 1:
+            raise Exception(f"alpha must be in (0, 1], got: {alpha}")
+        if not 0 <= low < high <= 1:
+            raise Exception(
+                f"The thresholds must satisfy 0 <= low < high <= 1, got: {low}, {high}"
+            )
+        self.alpha = alpha
+        self.high = high
+        self.low = low
+        self._resources: Dict[str, ResourceStats] = {}
+        self._lock = Lock()
+
+    def _stats(self, resource: str) -> ResourceStats:
+        stats = self._resources.get(resource)
+        if stats is None:
+            stats = self._resources[resource] = ResourceStats()
+        return stats
+
+    def choose(self, resource: str) -> str:
+        with self._lock:
+            return self._stats(resource).strategy
+
+    def record(
+        self, resource: str, looked_up: bool, posted: bool, conflict: bool
+    ) -> None:
+        # Called once per upsert with the requests it made and whether the row
+        # already existed, which is always followed by a PATCH
+        with self._lock:
+            stats = self._stats(resource)
+            stats.upserts += 1
+            stats.conflicts += conflict
+            stats.lookups += looked_up
+            stats.posts += posted
+            stats.failed_posts += posted and conflict
+            stats.patches += conflict
+            stats.conflict_rate += self.alpha * (conflict - stats.conflict_rate)
+            strategy = stats.strategy
+            if strategy == POST_FIRST and stats.conflict_rate >= self.high:
+                strategy = LOOKUP_FIRST
+            elif strategy == LOOKUP_FIRST and stats.conflict_rate <= self.low:
+                strategy = POST_FIRST
+            if strategy != stats.strategy:
+                stats.strategy = strategy
+                stats.switches += 1
+
+    def stats(self, resource: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            if resource is not None:
+                stats = self._resources.get(resource) or ResourceStats()
+                return stats.to_dict()
+            return {r: stats.to_dict() for r, stats in self._resources.items()}
@@ -0,0 +1,129 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from .utils import AliasReference, escape_value
+
+AnyObject = Dict[str, Any]
+
+# Operators whose values are not literals and have to be left untouched
+verbatim_filter_keys = frozenset(["$raw", "$", "@", "$duration"])
+
+
+def alias_key(value: Any) -> Any:
+    # bools and None are never lifted, they are shorter than any alias and
+    # parameter alias options do not render them as OData literals
+    if type(value) in (str, int, float, datetime):
+        return (type(value), value)
+    return None
+
+
+def map_filter_literals(filter: Any, fn: Callable[[Any], Any]) -> Any:
+    if isinstance(filter, list):
+        return [map_filter_literals(value, fn) for value in filter]
+    elif isinstance(filter, dict):
+        result: AnyObject = {}
+        for key, value in filter.items():
+            if key in verbatim_filter_keys:
+                result[key] = value
+            elif key in ("$any", "$all") and isinstance(value, dict):
+                result[key] = {
+                    **value,
+                    "$expr": map_filter_literals(value.get("$expr"), fn),
+                }
+            else:
+                result[key] = map_filter_literals(value, fn)
+        return result
+    return fn(filter)
+
+
+def map_expand_literals(expand: Any, fn: Callable[[Any], Any]) -> Any:
+    if isinstance(expand, list):
+        return [map_expand_literals(value, fn) for value in expand]
+    elif isinstance(expand, dict):
+        return {key: map_option_literals(value, fn) for key, value in expand.items()}
+    return expand
+
+
+def map_option_literals(options: AnyObject, fn: Callable[[Any], Any]) -> AnyObject:
+    result: AnyObject = {}
+    for key, value in options.items():
+        if key == "$filter":
+            result[key] = map_filter_literals(value, fn)
+        elif key == "$expand":
+            result[key] = map_expand_literals(value, fn)
+        elif key == "$count" and isinstance(value, dict):
+            result[key] = map_option_literals(value, fn)
+        else:
+            result[key] = value
+    return result
+
+
+def map_id_literals(id: Any, fn: Callable[[Any], Any]) -> Any:
+    if isinstance(id, dict):
+        if "@" in id:
+            return id
+        return {key: fn(value) for key, value in id.items()}
+    return fn(id)
+
+
+def lift_parameter_aliases(
+    params: AnyObject, min_length: int = 0
+) -> Tuple[AnyObject, Dict[str, Any]]:
+    # Replaces literals with `@pN` parameter alias references, sharing one
+    # alias between identical values. Literals are lifted when they occur
+    # more than once or their escaped form is at least min_length long.
+    options: AnyObject = params.get("options") or {}
+    id = params.get("id")
+
+    counts: Dict[Hashable, int] = {}
+
+    def count(value: Any) -> Any:
+        key = alias_key(value)
+        if key is not None:
+            counts[key] = counts.get(key, 0) + 1
+        return value
+
+    map_option_literals(options, count)
+    if id is not None:
+        map_id_literals(id, count)
+
+    names: Dict[Hashable, str] = {}
+    aliases: Dict[str, Any] = {}
+    next_index = [0]
+
+    def lift(value: Any) -> Any:
+        key = alias_key(value)
+        if key is None:
+            return value
+        name = names.get(key)
+        if name is None:
+            if counts[key] < 2 and len(str(escape_value(value))) < min_length:
+                return value
+            name = f"p{next_index[0]}"
+            while f"@{name}" in options:
+                next_index[0] += 1
+                name = f"p{next_index[0]}"
+            next_index[0] += 1
+            names[key] = name
+            aliases[name] = value
+        return AliasReference(name)
+
+    lifted: AnyObject = {**params}
+    lifted_options = map_option_literals(options, lift)
+    if id is not None:
+        lifted["id"] = map_id_literals(id, lift)
+    if len(aliases) > 0:
+        lifted["options"] = {
+            **lifted_options,
+            **{f"@{name}": value for name, value in aliases.items()},
+        }
+    return lifted, aliases
+
+
+def without_aliases(params: AnyObject, aliases: Dict[str, Any]) -> AnyObject:
+    options: AnyObject = params.get("options") or {}
+    names: List[str] = [f"@{name}" for name in aliases]
+    return {
+        **params,
+        "options": {k: v for k, v in options.items() if k not in names},
+    }
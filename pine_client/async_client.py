@@ -0,0 +1,374 @@
+from abc import ABC, abstractmethod
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
+from collections import deque
+import asyncio
+
+from .adaptive import LOOKUP_FIRST
+from .batch import AsyncBatch
+from .bulk import BulkItems, chunks
+from .coalescing import AsyncSingleFlight
+from .loader import AsyncLoader, IdKey
+from .streaming import (
+    decode_async_stream,
+    is_async_stream,
+    materialize_async,
+    take,
+)
+from .pagination import (
+    Key,
+    Pages,
+    count_params,
+    partition_offsets,
+    partition_params,
+    probe_params,
+)
+from .client import (
+    AnyObject,
+    BulkParams,
+    GetOrCreateParams,
+    Params,
+    PinejsClientBase,
+    UpsertParams,
+    is_unique_violation,
+)
+
+
+class AsyncPinejsClientCore(PinejsClientBase, ABC):
+    single_flight_class = AsyncSingleFlight
+
+    async def get(self, params: Params, max_url_length: Optional[int] = None) -> Any:
+        chunks = self.get_chunks(params, max_url_length)
+        if chunks is not None:
+            results = await self.map_concurrently(
+                lambda p: self._fetch(cast(Params, p)), chunks.chunks
+            )
+            return chunks.merge(results)
+
+        entry = self.response_cache_entry(params)
+        found, cached = self.cached_response(entry)
+        if found:
+            return cached
+
+        async def fetch() -> Any:
+            result = await self._get_uncached(params)
+            if not is_async_stream(result):
+                self.cache_response(entry, result)
+            return result
+
+        key = self.request_key(params)
+        if key is None:
+            return await fetch()
+        return await self.single_flight.do(key, fetch)
+
+    async def _get_uncached(self, params: Params) -> Any:
+        result = await self.request({**params, "method": "GET"})
+        if is_async_stream(result):
+            data_d = await decode_async_stream(result)
+            if params.get("id") is not None and is_async_stream(data_d):
+                # Only the first two rows are needed to check there is one
+                data_d = await take(data_d, 2)
+            result = {"d": data_d}
+        return self.transform_get_result(params)(result)
+
+    async def _fetch(self, params: Params) -> Any:
+        return await materialize_async(await self.get(params))
+
+    async def _lookup(self, params: Params) -> Any:
+        # Lookups that decide what to write must see the current rows, so they
+        # skip the response cache and coalescing like the writes do
+        return await materialize_async(await self._get_uncached(params))
+
+    async def put(self, params: Params) -> Any:
+        return await self.request({**params, "method": "PUT"})
+
+    async def patch(self, params: Params) -> Any:
+        return await self.request({**params, "method": "PATCH"})
+
+    async def post(self, params: Params) -> Any:
+        return await self.request({**params, "method": "POST"})
+
+    async def delete(self, params: Params) -> Any:
+        return await self.request({**params, "method": "DELETE"})
+
+    async def get_or_create(self, params: GetOrCreateParams) -> Any:
+        get_params, post_params = self.get_or_create_params(params)
+
+        result = await self.get(get_params)
+
+        if result is not None:
+            return result
+
+        return await self.post(post_params)
+
+    async def upsert(self, params: UpsertParams) -> Any:
+        post_params, patch_params = self.upsert_params(params)
+
+        looked_up = self.upsert_order(params) == LOOKUP_FIRST
+        if looked_up:
+            rows = await self._lookup(self.upsert_lookup_params(params))
+            if len(rows) > 0:
+                self.record_upsert(params, looked_up, False, True)
+                return await self.patch(patch_params)
+
+        try:
+            result = await self.post(post_params)
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise e
+
+            self.record_upsert(params, looked_up, True, True)
+            return await self.patch(patch_params)
+        self.record_upsert(params, looked_up, True, False)
+        return result
+
+    async def get_or_create_many(
+        self, params: BulkParams, chunk_size: int = 500
+    ) -> List[Any]:
+        items = BulkItems(cast(AnyObject, params), chunk_size)
+        lookups = items.lookup_params(items.unique_keys())
+        for rows in await self.map_concurrently(self._lookup, lookups):
+            items.found(rows)
+
+        async def create(key: IdKey) -> None:
+            try:
+                result = await self.post(cast(Params, items.post_params(key)))
+                items.set_result(key, result)
+            except Exception as e:
+                if not is_unique_violation(e):
+                    raise e
+                # Created by someone else since it was looked up
+                rows = await self._lookup(items.lookup_params([key])[0])
+                if len(rows) == 0:
+                    raise e
+                items.found(rows)
+
+        await self.map_concurrently(create, items.missing())
+        return items.ordered_results()
+
+    async def upsert_many(
+        self, params: BulkParams, chunk_size: int = 500, batch: bool = False
+    ) -> List[Any]:
+        items = BulkItems(cast(AnyObject, params), chunk_size)
+        lookups = items.lookup_params(items.unique_keys(), key_only=True)
+        for rows in await self.map_concurrently(self._lookup, lookups):
+            items.found(rows)
+        writes = items.writes()
+
+        async def fallback(key: IdKey, e: Exception) -> None:
+            if not is_unique_violation(e):
+                raise e
+            # Created by someone else since it was looked up
+            result = await self.patch(cast(Params, items.patch_params(key)))
+            items.set_result(key, result)
+
+        async def write(item: Tuple[IdKey, bool]) -> None:
+            key, exists = item
+            if exists:
+                result = await self.patch(cast(Params, items.patch_params(key)))
+                items.set_result(key, result)
+                return
+            try:
+                result = await self.post(cast(Params, items.post_params(key)))
+                items.set_result(key, result)
+            except Exception as e:
+                await fallback(key, e)
+
+        if not batch:
+            await self.map_concurrently(write, writes)
+            return items.ordered_results()
+
+        for chunk in chunks(writes, chunk_size):
+            async with self.batch() as requests:
+                operations = [
+                    (
+                        key,
+                        (
+                            requests.patch(items.patch_params(key))
+                            if exists
+                            else requests.post(items.post_params(key))
+                        ),
+                    )
+                    for key, exists in chunk
+                ]
+            for key, operation in operations:
+                try:
+                    items.set_result(key, operation.result())
+                except Exception as e:
+                    if operation.method != "POST":
+                        raise e
+                    await fallback(key, e)
+        return items.ordered_results()
+
+    def iter(
+        self,
+        params: Params,
+        page_size: int = 1000,
+        key: Key = "id",
+        keyset: bool = False,
+        cursor: Optional[str] = None,
+        prefetch: int = 1,
+    ) -> AsyncIterator[Any]:
+        return self.iter_rows(
+            self.pages(params, page_size, key, keyset, cursor, prefetch)
+        )
+
+    async def iter_rows(self, pages: Pages) -> AsyncIterator[Any]:
+        async for page in self.iter_pages(pages):
+            for row in page:
+                pages.mark(row)
+                yield row
+
+    async def iter_pages(self, pages: Pages) -> AsyncIterator[List[Any]]:
+        if pages.prefetch > 1:
+            async for page in self.prefetch_pages(pages):
+                yield page
+            return
+        while True:
+            params = pages.next_params()
+            if params is None:
+                return
+            rows = await self._fetch(cast(Params, params))
+            pages.advance(rows)
+            if len(rows) > 0:
+                yield rows
+
+    async def prefetch_pages(self, pages: Pages) -> AsyncIterator[List[Any]]:
+        offset = pages.fetched
+        in_flight: Deque["asyncio.Task[Any]"] = deque()
+        try:
+            while True:
+                while len(in_flight) < pages.prefetch:
+                    params = pages.params_at(offset)
+                    if params is None:
+                        break
+                    in_flight.append(asyncio.ensure_future(self._fetch(params)))
+                    offset += pages.page_size
+                if len(in_flight) == 0:
+                    return
+                rows = await in_flight.popleft()
+                pages.advance(rows)
+                if len(rows) > 0:
+                    yield rows
+                if pages.done:
+                    return
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def partition(
+        self, params: Params, partitions: int = 4, by: str = "id", key: str = "id"
+    ) -> List[Params]:
+        partition_offsets(0, partitions)
+        count = await self._fetch(cast(Params, count_params(cast(AnyObject, params))))
+        offsets = partition_offsets(count, partitions)
+        probes = await self.map_concurrently(
+            lambda offset: self._fetch(
+                cast(Params, probe_params(cast(AnyObject, params), by, offset))
+            ),
+            offsets,
+        )
+        bounds = [rows[0][by] if len(rows) > 0 else None for rows in probes]
+        return cast(
+            List[Params],
+            partition_params(cast(AnyObject, params), by, bounds, by != key),
+        )
+
+    async def scan(
+        self,
+        params: Params,
+        partitions: int = 4,
+        by: str = "id",
+        key: str = "id",
+        page_size: int = 1000,
+        concurrency: Optional[int] = None,
+    ) -> AsyncIterator[Any]:
+        pages = [
+            self.pages(p, page_size, key, keyset=True)
+            for p in await self.partition(params, partitions, by, key)
+        ]
+        async for page in self.scan_pages(pages, concurrency or self.max_concurrency):
+            for row in page:
+                yield row
+
+    async def scan_pages(
+        self, partitions: List[Pages], concurrency: int
+    ) -> AsyncIterator[List[Any]]:
+        results: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue(maxsize=concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def scan(pages: Pages) -> None:
+            try:
+                async with semaphore:
+                    async for page in self.iter_pages(pages):
+                        await results.put(("page", page))
+                await results.put(("done", None))
+            except Exception as e:
+                await results.put(("error", e))
+
+        tasks = [asyncio.ensure_future(scan(pages)) for pages in partitions]
+        try:
+            remaining = len(partitions)
+            while remaining > 0:
+                kind, value = await results.get()
+                if kind == "page":
+                    yield value
+                elif kind == "done":
+                    remaining -= 1
+                else:
+                    raise value
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def batch(self) -> AsyncBatch:
+        return AsyncBatch(
+            self.request_args,
+            self.transform_get_result,
+            self.api_prefix + "$batch",
+            self._request,
+            self.invalidate_response_cache,
+        )
+
+    def loader(
+        self,
+        window: float = 0,
+        max_batch_size: int = 100,
+        max_url_length: Optional[int] = None,
+    ) -> AsyncLoader:
+        return AsyncLoader(self, window, max_batch_size, max_url_length)
+
+    async def map_concurrently(
+        self, fn: Callable[[Any], Awaitable[Any]], items: List[Any]
+    ) -> List[Any]:
+        if len(items) <= 1 or self.max_concurrency <= 1:
+            return [await fn(item) for item in items]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(item: Any) -> Any:
+            async with semaphore:
+                return await fn(item)
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
+
+    async def request(self, params: Params) -> Any:
+        method, url, body = self.request_args(params)
+        if method == "GET":
+            return await self._request(method=method, url=url, body=body)
+        try:
+            return await self._request(method=method, url=url, body=body)
+        finally:
+            self.invalidate_response_cache(params)
+
+    @abstractmethod
+    async def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        pass
@@ -0,0 +1,369 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote
+from uuid import uuid4
+import json
+
+AnyObject = Dict[str, Any]
+RequestArgs = Tuple[str, str, Optional[Any]]
+
+CRLF = "\r\n"
+# Leaves reserved characters and existing escapes as they are
+request_url_safe = "/?&=$(),'@:;*+!~%"
+
+
+class MultipartBody(NamedTuple):
+    # `_request` implementations have to send the text as is with this
+    # content type, instead of encoding the body as JSON
+    content_type: str
+    text: str
+
+
+class Part(NamedTuple):
+    headers: Dict[str, str]
+    body: str
+
+
+class BatchRequestError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value)} is not JSON serializable")
+
+
+def parse_headers(lines: List[str]) -> Dict[str, str]:
+    headers: Dict[str, str] = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def get_boundary(content_type: str) -> Optional[str]:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    return None
+
+
+def split_message(text: str) -> Tuple[List[str], str]:
+    # Returns the start/header lines and the body of a MIME part or HTTP message
+    head, _, body = text.partition(CRLF + CRLF)
+    return head.split(CRLF), body
+
+
+def parse_multipart(text: str, boundary: Optional[str] = None) -> List[Part]:
+    if boundary is None:
+        # Responses are returned without their headers, the boundary is the
+        # first delimiter line of the body
+        for line in text.split(CRLF):
+            if line.startswith("--"):
+                boundary = line[2:].strip()
+                break
+        else:
+            raise Exception("Batch response is not a multipart body")
+
+    delimiter = "--" + boundary
+    sections = text.split(delimiter)
+    parts: List[Part] = []
+    for section in sections[1:]:
+        if section.startswith("--"):
+            break
+        # The line break before a delimiter belongs to the delimiter
+        if section.startswith(CRLF):
+            section = section.partition(CRLF)[2]
+        if section.endswith(CRLF):
+            section = section[: -len(CRLF)]
+        lines, body = split_message(section)
+        parts.append(Part(parse_headers([line for line in lines if line]), body))
+    return parts
+
+
+def parse_http_message(text: str) -> Tuple[str, Dict[str, str], str]:
+    lines, body = split_message(text)
+    return lines[0], parse_headers(lines[1:]), body
+
+
+def render_http_part(
+    method: str,
+    url: str,
+    body: Optional[Any],
+    content_id: Optional[int] = None,
+) -> List[str]:
+    lines = ["Content-Type: application/http", "Content-Transfer-Encoding: binary"]
+    if content_id is not None:
+        lines.append(f"Content-ID: {content_id}")
+    # Compiled urls are not percent encoded yet, which a request line has to be
+    url = quote(url, safe=request_url_safe)
+    lines += ["", f"{method} {url} HTTP/1.1", "Accept: application/json"]
+    if body is None:
+        return lines + ["", ""]
+    return lines + [
+        "Content-Type: application/json",
+        "",
+        json.dumps(body, default=json_default),
+    ]
+
+
+class BatchOperation:
+    __slots__ = ("params", "method", "url", "body", "done", "value", "error")
+
+    def __init__(self, params: AnyObject, method: str, url: str, body: Any):
+        self.params = params
+        self.method = method
+        self.url = url
+        self.body = body
+        self.done = False
+        self.value: Any = None
+        self.error: Optional[Exception] = None
+
+    def result(self) -> Any:
+        if not self.done:
+            raise Exception("The batch has not been sent yet")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+BatchItem = Union[BatchOperation, List[BatchOperation]]
+
+
+class Batch:
+    def __init__(
+        self,
+        request_args: Callable[[Any], RequestArgs],
+        transform_get_result: Callable[[Any], Callable[[Any], Any]],
+        url: str,
+        send: Callable[[str, str, Any], Any],
+        on_write: Optional[Callable[[Any], None]] = None,
+    ):
+        self.request_args = request_args
+        self.transform_get_result = transform_get_result
+        self.url = url
+        self.send_request = send
+        # Called with the params of every modifying request once it was sent
+        self.on_write = on_write
+        # Each item is either a single operation or a change set
+        self.items: List[BatchItem] = []
+        self.current_change_set: Optional[List[BatchOperation]] = None
+        self.sent = False
+
+    def add(self, params: AnyObject, method: str) -> BatchOperation:
+        if self.sent:
+            raise Exception("Cannot add operations to a batch that was already sent")
+        method, url, body = self.request_args({**params, "method": method})
+        operation = BatchOperation(params, method, url, body)
+        if self.current_change_set is None:
+            self.items.append(operation)
+        elif method == "GET":
+            raise Exception("Only modifying requests can be part of a change set")
+        else:
+            self.current_change_set.append(operation)
+        return operation
+
+    def get(self, params: AnyObject) -> BatchOperation:
+        return self.add(params, "GET")
+
+    def put(self, params: AnyObject) -> BatchOperation:
+        return self.add(params, "PUT")
+
+    def patch(self, params: AnyObject) -> BatchOperation:
+        return self.add(params, "PATCH")
+
+    def post(self, params: AnyObject) -> BatchOperation:
+        return self.add(params, "POST")
+
+    def delete(self, params: AnyObject) -> BatchOperation:
+        return self.add(params, "DELETE")
+
+    @contextmanager
+    def change_set(self) -> Iterator["Batch"]:
+        # Operations added inside the block are applied atomically
+        if self.current_change_set is not None:
+            raise Exception("Change sets cannot be nested")
+        change_set: List[BatchOperation] = []
+        self.items.append(change_set)
+        self.current_change_set = change_set
+        try:
+            yield self
+        finally:
+            self.current_change_set = None
+
+    @property
+    def operations(self) -> List[BatchOperation]:
+        operations: List[BatchOperation] = []
+        for item in self.items:
+            if isinstance(item, list):
+                operations.extend(item)
+            else:
+                operations.append(item)
+        return operations
+
+    def body(self) -> MultipartBody:
+        boundary = f"batch_{uuid4().hex}"
+        lines: List[str] = []
+        for item in self.items:
+            lines.append("--" + boundary)
+            if isinstance(item, list):
+                change_set = f"changeset_{uuid4().hex}"
+                lines += [f"Content-Type: multipart/mixed; boundary={change_set}", ""]
+                for index, operation in enumerate(item, 1):
+                    lines.append("--" + change_set)
+                    lines += render_http_part(
+                        operation.method, operation.url, operation.body, index
+                    )
+                lines.append(f"--{change_set}--")
+            else:
+                lines += render_http_part(item.method, item.url, item.body)
+        lines += [f"--{boundary}--", ""]
+        return MultipartBody(f"multipart/mixed; boundary={boundary}", CRLF.join(lines))
+
+    def prepare(self) -> Optional[MultipartBody]:
+        if self.sent:
+            raise Exception("The batch was already sent")
+        if self.current_change_set is not None:
+            raise Exception("Cannot send a batch from inside a change set")
+        self.sent = True
+        # Empty change sets have nothing to send
+        self.items = [item for item in self.items if item != []]
+        if len(self.items) == 0:
+            return None
+        return self.body()
+
+    def resolve_operation(self, operation: BatchOperation, part: Part) -> None:
+        start_line, _, body = parse_http_message(part.body)
+        status_code = int(start_line.split()[1])
+        operation.done = True
+        try:
+            data = json.loads(body) if body.strip() else None
+        except ValueError:
+            data = body
+        if status_code >= 400:
+            message = data if isinstance(data, str) else body
+            operation.error = BatchRequestError(message, status_code)
+            return
+        try:
+            if operation.method == "GET":
+                data = self.transform_get_result(operation.params)(data)
+            operation.value = data
+        except Exception as e:
+            operation.error = e
+
+    def resolve_change_set(self, change_set: List[BatchOperation], part: Part) -> None:
+        boundary = get_boundary(part.headers.get("content-type", ""))
+        if boundary is None:
+            # A failed change set returns a single response for all of it
+            for operation in change_set:
+                self.resolve_operation(operation, part)
+            return
+        parts = parse_multipart(part.body, boundary)
+        if len(parts) != len(change_set):
+            raise Exception(
+                f"Expected {len(change_set)} responses in the change set, got {len(parts)}"
+            )
+        by_content_id = {
+            p.headers["content-id"]: p for p in parts if "content-id" in p.headers
+        }
+        for index, operation in enumerate(change_set):
+            self.resolve_operation(
+                operation, by_content_id.get(str(index + 1), parts[index])
+            )
+
+    def resolve(self, response: Any) -> List[BatchOperation]:
+        if isinstance(response, MultipartBody):
+            parts = parse_multipart(response.text, get_boundary(response.content_type))
+        else:
+            if isinstance(response, bytes):
+                response = response.decode("utf-8")
+            parts = parse_multipart(response)
+        if len(parts) > len(self.items):
+            raise Exception(
+                f"Expected {len(self.items)} responses in the batch, got {len(parts)}"
+            )
+        for item, part in zip(self.items, parts):
+            if isinstance(item, list):
+                self.resolve_change_set(item, part)
+            else:
+                self.resolve_operation(item, part)
+        # The server stops processing a batch at the first failed request
+        # unless asked to continue, so the rest never ran
+        returned = len(parts)
+        for item in self.items[returned:]:
+            for operation in item if isinstance(item, list) else [item]:
+                operation.done = True
+                operation.error = Exception(
+                    f"The request was not executed as the batch only returned "
+                    f"{returned} of {len(self.items)} responses: "
+                    f"{operation.method} {operation.url}"
+                )
+        return self.operations
+
+    def written(self) -> None:
+        if self.on_write is None:
+            return
+        for operation in self.operations:
+            if operation.method != "GET":
+                self.on_write(operation.params)
+
+    def send(self) -> List[BatchOperation]:
+        body = self.prepare()
+        if body is None:
+            return []
+        try:
+            return self.resolve(self.send_request("POST", self.url, body))
+        finally:
+            self.written()
+
+    def __enter__(self) -> "Batch":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if exc_type is None:
+            self.send()
+
+
+class AsyncBatch(Batch):
+    def __init__(
+        self,
+        request_args: Callable[[Any], RequestArgs],
+        transform_get_result: Callable[[Any], Callable[[Any], Any]],
+        url: str,
+        send: Callable[[str, str, Any], Awaitable[Any]],
+        on_write: Optional[Callable[[Any], None]] = None,
+    ):
+        super().__init__(request_args, transform_get_result, url, send, on_write)
+
+    async def send(self) -> List[BatchOperation]:  # type: ignore
+        body = self.prepare()
+        if body is None:
+            return []
+        try:
+            return self.resolve(await self.send_request("POST", self.url, body))
+        finally:
+            self.written()
+
+    async def __aenter__(self) -> "AsyncBatch":
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if exc_type is None:
+            await self.send()
@@ -0,0 +1,129 @@
+from copy import deepcopy
+from typing import Any, Dict, List, Set, Tuple
+
+from .loader import IdKey, batch_params, fan_out, is_json_scalar, normalize_key
+from .pagination import to_keys
+
+AnyObject = Dict[str, Any]
+
+
+def chunks(values: List[Any], size: int) -> List[List[Any]]:
+    result: List[List[Any]] = []
+    for start in range(0, len(values), size):
+        end = start + size
+        result.append(values[start:end])
+    return result
+
+
+class BulkItems:
+    # Bodies to write in bulk, identified by the values of their natural key.
+    # Keys are looked up `chunk_size` at a time with `$in`, or `$or` for
+    # composite keys, and the results are handed back in the input's order
+    def __init__(self, params: AnyObject, chunk_size: int = 500):
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise Exception(f"chunk_size must be a positive integer, got: {chunk_size}")
+        if params["resource"].endswith("/$count"):
+            raise Exception("Bulk writes do not support $count on resources")
+        options = params.get("options") or {}
+        if not isinstance(options, dict):
+            raise Exception("Bulk writes cannot use query IR options")
+        for option in ("$top", "$skip", "$orderby", "$count"):
+            if option in options:
+                raise Exception(f"Bulk writes cannot use {option}")
+        items = params.get("items")
+        if not isinstance(items, list):
+            raise Exception("The items property must be a list of bodies")
+
+        self.fields = tuple(to_keys(params["key"]))
+        # Items are tracked by their normalized key, which returned rows are
+        # matched with, and the values as given are used in filters
+        self.keys: List[IdKey] = []
+        self.values: Dict[IdKey, IdKey] = {}
+        self.bodies: Dict[IdKey, AnyObject] = {}
+        for item in items:
+            if not isinstance(item, dict):
+                raise Exception("The items property must be a list of bodies")
+            values = tuple(item.get(field) for field in self.fields)
+            if not all(is_json_scalar(value) for value in values):
+                raise Exception(
+                    f"Every item must have a string or number for the key "
+                    f"{list(self.fields)}, got: {item}"
+                )
+            key = normalize_key(values)
+            self.keys.append(key)
+            self.values[key] = values
+            # Later items with the same key win, like writing them in order would
+            self.bodies[key] = item
+        self.params = {
+            k: v for k, v in params.items() if k not in ("items", "key", "id", "body")
+        }
+        self.chunk_size = chunk_size
+        # Key fields that had to be added to $select to match rows to items
+        self.added = batch_params(self.params, self.fields, [])[1]
+        self.results: Dict[IdKey, Any] = {}
+
+    def unique_keys(self) -> List[IdKey]:
+        return list(self.bodies.keys())
+
+    def lookup_params(
+        self, keys: List[IdKey], key_only: bool = False
+    ) -> List[AnyObject]:
+        # With `key_only` rows are only fetched to know which keys exist
+        params = self.params
+        if key_only:
+            params = {**params, "options": {"$select": list(self.fields)}}
+        return [
+            batch_params(params, self.fields, [self.values[key] for key in chunk])[0]
+            for chunk in chunks(keys, self.chunk_size)
+        ]
+
+    def found(self, rows: List[Any]) -> None:
+        for key, matches in fan_out(rows, self.fields, self.added).items():
+            if len(matches) > 1:
+                raise Exception(
+                    f"The key {list(self.fields)} matched several rows for {list(key)}"
+                )
+            self.results[key] = matches[0]
+
+    def missing(self) -> List[IdKey]:
+        return [key for key in self.bodies if key not in self.results]
+
+    def post_params(self, key: IdKey) -> AnyObject:
+        params = {k: v for k, v in self.params.items() if k != "options"}
+        return {**params, "body": self.bodies[key]}
+
+    def patch_params(self, key: IdKey) -> AnyObject:
+        # Matches upsert, the key filters the rows to update instead of being
+        # written to them
+        params = {k: v for k, v in self.params.items() if k != "options"}
+        options = self.params.get("options") or {}
+        key_filter = dict(zip(self.fields, self.values[key]))
+        filter = options.get("$filter")
+        body = {k: v for k, v in self.bodies[key].items() if k not in self.fields}
+        return {
+            **params,
+            "options": {
+                **options,
+                "$filter": (
+                    key_filter if filter is None else {"$and": [filter, key_filter]}
+                ),
+            },
+            "body": body,
+        }
+
+    def writes(self) -> List[Tuple[IdKey, bool]]:
+        # Each key, and whether a row with it already exists
+        return [(key, key in self.results) for key in self.bodies]
+
+    def set_result(self, key: IdKey, result: Any) -> None:
+        self.results[key] = result
+
+    def ordered_results(self) -> List[Any]:
+        # Items that share a key each get their own copy of its row
+        results: List[Any] = []
+        seen: Set[IdKey] = set()
+        for key in self.keys:
+            result = self.results.get(key)
+            results.append(deepcopy(result) if key in seen else result)
+            seen.add(key)
+        return results
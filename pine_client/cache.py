@@ -0,0 +1,213 @@
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import json
+
+from .ir import Node
+from .utils import Unhashable, scalar_key  # noqa: F401
+
+end_marker = object()
+
+
+def structural_key(value: Any) -> Hashable:
+    # Containers are flattened into one tuple delimited by their type and
+    # `end_marker` rather than nested tuples, so keys for arbitrarily deep values
+    # are built, hashed and compared without recursing. Dicts keep their
+    # insertion order since it determines the compiled output.
+    if isinstance(value, Node):
+        # Query IR nodes are hashable themselves
+        return value
+    if not isinstance(value, (dict, list, tuple)):
+        return scalar_key(value)
+    key: List[Hashable] = []
+    stack: List[Any] = [value]
+    while len(stack) > 0:
+        item = stack.pop()
+        if item is end_marker:
+            key.append(end_marker)
+        elif isinstance(item, dict):
+            key.append(dict)
+            stack.append(end_marker)
+            for k, v in reversed(item.items()):
+                stack.append(v)
+                stack.append(k)
+        elif isinstance(item, (list, tuple)):
+            key.append(list)
+            stack.append(end_marker)
+            stack.extend(reversed(item))
+        elif isinstance(item, Node):
+            key.append(item)
+        else:
+            key.append(scalar_key(item))
+    return tuple(key)
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        if max_size < 1:
+            raise Exception(f"Cache size must be at least 1, got: {max_size}")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ResponseCache:
+    # GET results keyed by their url, each indexed under the resource it was
+    # fetched from so writes to that resource can drop it
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        max_bytes: Optional[int] = None,
+        clock: Callable[[], float] = monotonic,
+    ):
+        if max_size < 1:
+            raise Exception(f"Cache size must be at least 1, got: {max_size}")
+        if ttl <= 0:
+            raise Exception(f"Cache ttl must be positive, got: {ttl}")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # key -> (expires_at, resource, size, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, str, int, Any]]" = (
+            OrderedDict()
+        )
+        self._by_resource: Dict[str, Set[Hashable]] = {}
+        self._generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: Hashable) -> None:
+        _, resource, size, _ = self._entries.pop(key)
+        self.bytes -= size
+        keys = self._by_resource[resource]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self._by_resource[resource]
+
+    def generation(self, resource: str) -> int:
+        # Bumped by every invalidation, a result fetched across one is stale
+        with self._lock:
+            return self._generation(resource)
+
+    def _generation(self, resource: str) -> int:
+        # Both counters only grow, so their sum changes whenever either does
+        return self._global_generation + self._generations.get(resource, 0)
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers are free to mutate the results they get
+        return True, deepcopy(entry[3])
+
+    def set(self, key: Hashable, resource: str, value: Any, generation: int) -> None:
+        size = 0
+        if self.max_bytes is not None:
+            size = len(json.dumps(value, default=str))
+            if size > self.max_bytes:
+                return
+        value = deepcopy(value)
+        with self._lock:
+            if self._generation(resource) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, resource, size, value)
+            self._by_resource.setdefault(resource, set()).add(key)
+            self.bytes += size
+            while len(self._entries) > self.max_size or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, resource: Optional[str] = None) -> None:
+        # Drops the entries of a resource, or every entry when it is None
+        with self._lock:
+            resources = list(self._by_resource) if resource is None else [resource]
+            if resource is None:
+                self._global_generation += 1
+            else:
+                self._generations[resource] = self._generations.get(resource, 0) + 1
+            for r in resources:
+                for key in list(self._by_resource.get(r, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_resource.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,236 @@
+from functools import cmp_to_key
+from heapq import merge
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .utils import escape_value
+
+AnyObject = Dict[str, Any]
+FilterPath = List[Union[str, int]]
+OrderByKeys = List[Tuple[str, bool]]
+
+
+def is_in_value(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and all(not isinstance(v, (dict, list)) for v in value)
+    )
+
+
+def is_property(key: Any) -> bool:
+    return isinstance(key, str) and key[0] not in ("$", "@")
+
+
+def find_in_lists(filter: Any) -> List[FilterPath]:
+    # Only $in lists on a property of the resource itself, reached through
+    # $and, can be split. The union of the chunked results is then exactly the
+    # result of the full filter and a row can never match more than one chunk.
+    # Through a navigation property, eg `a/b in (...)`, a row with several `a`
+    # could match several chunks and be merged or counted more than once
+    paths: List[FilterPath] = []
+    stack: List[Tuple[Any, FilterPath]] = [(filter, [])]
+    while len(stack) > 0:
+        node, path = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            if key == "$in" and is_in_value(value):
+                if sum(is_property(k) for k in path) <= 1:
+                    paths.append(path + [key])
+            elif key == "$and" and isinstance(value, list):
+                for index, item in enumerate(value):
+                    stack.append((item, path + [key, index]))
+            elif key == "$and" or is_property(key):
+                stack.append((value, path + [key]))
+    return paths
+
+
+def get_at(filter: Any, path: FilterPath) -> Any:
+    for key in path:
+        filter = filter[key]
+    return filter
+
+
+def replace_at(filter: Any, path: FilterPath, value: Any) -> Any:
+    if len(path) == 0:
+        return value
+    key = path[0]
+    copy = list(filter) if isinstance(filter, list) else dict(filter)
+    copy[key] = replace_at(filter[key], path[1:], value)  # type: ignore
+    return copy
+
+
+def parse_order_by(order_by: Any) -> OrderByKeys:
+    if isinstance(order_by, str):
+        keys: OrderByKeys = []
+        for part in order_by.split(","):
+            tokens = part.split()
+            if len(tokens) == 0 or len(tokens) > 2 or "/" in tokens[0]:
+                raise Exception(f"Cannot merge chunked results ordered by '{order_by}'")
+            direction = tokens[1] if len(tokens) == 2 else "asc"
+            if direction not in ("asc", "desc"):
+                raise Exception(f"Cannot merge chunked results ordered by '{order_by}'")
+            keys.append((tokens[0], direction == "desc"))
+        return keys
+    elif isinstance(order_by, list):
+        return [key for item in order_by for key in parse_order_by(item)]
+    elif isinstance(order_by, dict) and len(order_by) == 1:
+        for property, direction in order_by.items():
+            if isinstance(direction, str):
+                return parse_order_by(f"{property} {direction}")
+    raise Exception(f"Cannot merge chunked results ordered by '{order_by}'")
+
+
+def compare_rows(keys: OrderByKeys) -> Callable[[AnyObject, AnyObject], int]:
+    def compare(a: AnyObject, b: AnyObject) -> int:
+        for property, desc in keys:
+            x = a[property]
+            y = b[property]
+            if x == y:
+                continue
+            # Nulls sort as the largest value, as postgres does by default
+            if x is None:
+                result = 1
+            elif y is None:
+                result = -1
+            else:
+                result = -1 if x < y else 1
+            return -result if desc else result
+        return 0
+
+    return compare
+
+
+class InChunks:
+    def __init__(
+        self,
+        params: AnyObject,
+        compile: Callable[[AnyObject], str],
+        max_url_length: int,
+    ):
+        if params.get("url") is not None:
+            raise Exception("Cannot split requests that specify a url")
+        if params.get("id") is not None:
+            raise Exception("Cannot split requests for a single resource by id")
+        options: AnyObject = params.get("options") or {}
+        if not isinstance(options, dict):
+            raise Exception("Cannot split requests whose options are query IR")
+        self.is_count = "$count" in options or params["resource"].endswith("/$count")
+        self.count_options = "$count" in options
+        query_options: AnyObject = options.get("$count", options)
+
+        self.skip: int = query_options.get("$skip", 0)
+        self.top: Optional[int] = query_options.get("$top")
+        order_by = query_options.get("$orderby")
+        self.order_by: Optional[OrderByKeys] = (
+            None if order_by is None else parse_order_by(order_by)
+        )
+
+        if self.skip and self.order_by is None:
+            raise Exception("Cannot split requests that use $skip without $orderby")
+        select = query_options.get("$select")
+        if self.order_by is not None and select is not None:
+            select = [select] if isinstance(select, str) else select
+            missing = [p for p, _ in self.order_by if p not in select]
+            if len(missing) > 0:
+                raise Exception(
+                    f"Cannot merge chunked results ordered by {missing} as they are not in $select"
+                )
+
+        filter = query_options.get("$filter")
+        paths = find_in_lists(filter)
+        if len(paths) == 0:
+            raise Exception(
+                f"The url is longer than {max_url_length} characters and has no $in list that can be split"
+            )
+        self.path = max(paths, key=lambda path: len(get_at(filter, path)))
+        self.params = params
+        self.query_options = query_options
+        self.filter = filter
+
+        values = get_at(filter, self.path)
+        values = list({(type(v), v): v for v in values}.values())
+        self.chunks = self.split(values, compile, max_url_length)
+
+    def with_options(self, query_options: AnyObject) -> AnyObject:
+        if self.count_options:
+            return {**self.params, "options": {"$count": query_options}}
+        return {**self.params, "options": query_options}
+
+    def chunk_params(self, values: List[Any]) -> AnyObject:
+        query_options = {
+            **self.query_options,
+            "$filter": replace_at(self.filter, self.path, values),
+        }
+        if self.skip:
+            del query_options["$skip"]
+            if self.top is not None:
+                query_options["$top"] = self.skip + self.top
+        return self.with_options(query_options)
+
+    def split(
+        self,
+        values: List[Any],
+        compile: Callable[[AnyObject], str],
+        max_url_length: int,
+    ) -> List[AnyObject]:
+        lengths = [len(f"{escape_value(v)}") for v in values]
+        overhead = len(compile(self.chunk_params(values[:1]))) - lengths[0]
+        if overhead + max(lengths) > max_url_length:
+            raise Exception(
+                f"The url cannot be shortened below {max_url_length} characters by splitting $in"
+            )
+
+        bounds: List[Tuple[int, int]] = []
+        start = 0
+        length = overhead
+        for index, value_length in enumerate(lengths):
+            separator = 0 if index == start else 2
+            if length + separator + value_length > max_url_length:
+                bounds.append((start, index))
+                start = index
+                length = overhead + value_length
+            else:
+                length += separator + value_length
+        bounds.append((start, len(values)))
+
+        # The estimate assumes each value is written once, where it is in the
+        # $in list. Compiling can write it differently, eg as a parameter
+        # alias, so chunks that still end up too long are halved until they fit
+        chunks: List[AnyObject] = []
+        # Popped from the end, so chunks stay in the order of the values
+        bounds.reverse()
+        while len(bounds) > 0:
+            start, end = bounds.pop()
+            params = self.chunk_params(values[start:end])
+            if len(compile(params)) <= max_url_length:
+                chunks.append(params)
+            elif end - start == 1:
+                raise Exception(
+                    f"The url cannot be shortened below {max_url_length} characters by splitting $in"
+                )
+            else:
+                middle = (start + end) // 2
+                bounds += [(middle, end), (start, middle)]
+        return chunks
+
+    def merge(self, results: List[Any]) -> Any:
+        if self.is_count:
+            return sum(results)
+        if self.order_by is None:
+            rows = [row for result in results for row in result]
+        else:
+            rows = list(merge(*results, key=cmp_to_key(compare_rows(self.order_by))))
+        start = self.skip
+        end = None if self.top is None else start + self.top
+        return rows[start:end]
+
+
+def split_in_chunks(
+    params: AnyObject,
+    compile: Callable[[AnyObject], str],
+    max_url_length: int,
+) -> Optional[InChunks]:
+    if len(compile(params)) <= max_url_length:
+        return None
+    return InChunks(params, compile, max_url_length)
@@ -1,18 +1,68 @@
-from typing import Any, Dict, Union, Literal, TypedDict, Optional, cast, List, Callable
+from typing import (
+    Any,
+    Dict,
+    Union,
+    Literal,
+    NamedTuple,
+    TypedDict,
+    Optional,
+    Tuple,
+    cast,
+    get_args,
+    List,
+    Callable,
+    Generator,
+    Iterator,
+    Deque,
+)
+from types import GeneratorType
 from typing_extensions import NotRequired
 from datetime import datetime
+from itertools import islice
 import re
 
 from abc import ABC, abstractmethod
-
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, Queue
+import threading
+
+from . import ir
+from .aliases import lift_parameter_aliases, without_aliases
+from .adaptive import LOOKUP_FIRST, POST_FIRST, UpsertStrategy
+from .batch import Batch
+from .bulk import BulkItems, chunks
+from .cache import LRUCache, ResponseCache, Unhashable, structural_key
+from .chunking import InChunks, split_in_chunks
+from .coalescing import SingleFlight
+from .loader import IdKey, Loader
+from .optimizer import optimize_options
+from .pagination import (
+    Key,
+    Pages,
+    count_params,
+    paginate,
+    partition_offsets,
+    partition_params,
+    probe_params,
+)
+from .prepared import PreparedQuery
+from .streaming import decode_stream, is_stream, materialize
 from .utils import (
     escape_resource,
     escape_parameter_alias,
     map_obj,
     escape_value,
+    escape_value_list,
+    parse_raw_template,
+    format_escaped,
     is_valid_option,
-    bracket_join,
+    Placeholder,
+    AliasReference,
+    CountSteps,
+    StrSteps,
     join,
+    run_steps,
 )
 
 AnyObject = Dict[str, Any]
@@ -243,7 +293,7 @@ class Params(TypedDict, total=False):
     body: AnyObject
     passthrough: AnyObject
     passthrough_by_method: Dict[ODataMethod, AnyObject]
-    options: ODataOptions
+    options: Union[ODataOptions, ir.QueryOptions]
 
 
 class GetOrCreateParams(TypedDict):
@@ -268,122 +318,278 @@ class UpsertParams(TypedDict):
     options: NotRequired[ODataOptions]
 
 
+class BulkParams(TypedDict):
+    api_prefix: NotRequired[str]
+    resource: str
+    key: Union[str, List[str]]
+    items: List[AnyObject]
+    passthrough: NotRequired[AnyObject]
+    passthrough_by_method: NotRequired[Dict[ODataMethod, AnyObject]]
+    options: NotRequired[ODataOptions]
+
+
 def is_primitive(obj: Any) -> bool:
-    return obj is None or isinstance(obj, (str, int, float, bool, datetime))
+    return obj is None or isinstance(
+        obj, (str, int, float, bool, datetime, Placeholder, AliasReference)
+    )
 
 
-def add_parent_key(
-    filter: Union[List[str], str, bool, float, int, None],
+# The filter compiler writes every fragment into a single shared `out` buffer.
+# Each writer returns how many top level fragments it produced, which decides
+# whether its output has to be wrapped in brackets by the caller. Brackets are
+# filled into a slot reserved before the fragments were written so nothing is
+# re-joined or copied until the final "".join().
+#
+# Nothing in the compiler recurses so filters and expands can be nested to any
+# depth, see `run_steps`.
+
+
+def write_value(
+    out: List[str],
+    value: Union[str, bool, float, int, None],
     parent_key: Optional[List[str]] = None,
     operator: str = " eq ",
-) -> List[str]:
+) -> int:
     if parent_key is not None:
-        if isinstance(filter, list):
-            if len(filter) == 1:
-                filter = filter[0]
-            else:
-                filter = f"({''.join(filter)})"
-        else:
-            if filter is None:
-                filter_python_converted = "null"
-            elif isinstance(filter, bool):
-                filter_python_converted = "true" if filter else "false"
-            else:
-                filter_python_converted = filter
+        out.append(escape_resource(parent_key))
+        out.append(operator)
+        out.append(format_escaped(value))
+        return 3
+    out.append(f"{value}")
+    return 1
 
-            filter = f"{filter_python_converted}"
-        return [escape_resource(parent_key), operator, filter]
-    if isinstance(filter, list):
-        return filter
-    return [f"{filter}"]
+
+def open_parent_key(
+    out: List[str],
+    parent_key: Optional[List[str]] = None,
+    operator: str = " eq ",
+) -> int:
+    if parent_key is None:
+        return -1
+    out.append(escape_resource(parent_key))
+    out.append(operator)
+    out.append("")
+    return len(out) - 1
+
+
+def close_parent_key(out: List[str], slot: int, count: int) -> int:
+    if slot < 0:
+        return count
+    if count != 1:
+        out[slot] = "("
+        out.append(")")
+    return 3
+
+
+def close_parent_key_steps(out: List[str], slot: int, steps: CountSteps) -> CountSteps:
+    if slot < 0:
+        return steps
+    return close_parent_key_after(out, slot, steps)
+
+
+def close_parent_key_after(
+    out: List[str], slot: int, steps: CountSteps
+) -> Generator[Any, Any, int]:
+    return close_parent_key(out, slot, (yield steps))
 
 
-def handle_filter_array(
-    filter: FilterArray, parent_key: Optional[List[str]] = None, min_elements: int = 2
-) -> List[List[str]]:
+def close_bracket(out: List[str], slot: int, count: int) -> None:
+    if count > 1:
+        out[slot] = "("
+        out.append(")")
+    elif count == 0:
+        raise Exception("Cannot join an empty filter")
+
+
+def write_filter_array_steps(
+    out: List[str],
+    filter: FilterArray,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+    min_elements: int = 2,
+) -> CountSteps:
     if len(filter) < min_elements:
         raise Exception(
             f"Filter arrays must have at least {min_elements}, got {filter}"
         )
-    return list(map(lambda value: build_filter(value, parent_key), filter))
+    if len(filter) == 1:
+        return write_filter_steps(out, filter[0], parent_key)
+    return write_filter_items_steps(out, filter, separator, parent_key)
+
+
+def write_filter_items_steps(
+    out: List[str],
+    filter: FilterArray,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+) -> Generator[Any, Any, int]:
+    for index, value in enumerate(filter):
+        if index != 0:
+            out.append(separator)
+        slot = len(out)
+        out.append("")
+        count = write_filter_steps(out, value, parent_key)
+        if isinstance(count, GeneratorType):
+            count = yield count
+        close_bracket(out, slot, count)
+    return 2 * len(filter) - 1
+
+
+def write_filter_object_steps(
+    out: List[str],
+    filter: FilterObj,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    if len(filter) == 1:
+        for key, value in filter.items():
+            return write_filter_key_steps(out, value, key, parent_key)
+    return write_filter_entries_steps(out, filter, separator, parent_key)
+
+
+def write_filter_entries_steps(
+    out: List[str],
+    filter: FilterObj,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+) -> Generator[Any, Any, int]:
+    for index, (key, value) in enumerate(filter.items()):
+        if index != 0:
+            out.append(separator)
+        slot = len(out)
+        out.append("")
+        count = write_filter_key_steps(out, value, key, parent_key)
+        # Most entries are leaves, so only suspend when something is nested
+        if isinstance(count, GeneratorType):
+            count = yield count
+        close_bracket(out, slot, count)
+    return max(2 * len(filter) - 1, 0)
 
 
 def filter_operation(
+    out: List[str],
     filter: FilterOperationValue,
     operator: FilterOperationKey,
     parent_key: Optional[List[str]] = None,
-) -> List[str]:
+) -> CountSteps:
     op = " " + operator[1:] + " "
     if is_primitive(filter):
-        filter_str = escape_value(filter)
-        return add_parent_key(filter_str, parent_key, op)
+        return write_value(out, escape_value(filter), parent_key, op)
     elif isinstance(filter, list):
-        filter_arr = handle_filter_array(filter)
-        filter_str = bracket_join(filter_arr, op)
-        return add_parent_key(filter_str, parent_key)
+        slot = open_parent_key(out, parent_key)
+        return close_parent_key_steps(
+            out, slot, write_filter_array_steps(out, filter, op)
+        )
     elif isinstance(filter, dict):
-        result = handle_filter_object(filter)
-        if len(result) < 1:
+        if len(filter) < 1:
             raise Exception(
                 f"{operator} objects must have at least 1 property, got: {filter}"
             )
-        if len(result) == 1:
-            return add_parent_key(result[0], parent_key, op)
-        else:
-            filter_str = bracket_join(result, op)
-            return add_parent_key(filter_str, parent_key)
+        slot = open_parent_key(out, parent_key, op if len(filter) == 1 else " eq ")
+        return close_parent_key_steps(
+            out, slot, write_filter_object_steps(out, filter, op)
+        )
     else:
         raise Exception(f"Expected None/str/int/float/dict/list, got: {type(filter)}")
 
 
+def write_function_arguments_steps(
+    out: List[str], fn_name: str, filter: Union[FilterArray, FilterObj]
+) -> Generator[Any, Any, int]:
+    out.append(f"{fn_name}(")
+    if isinstance(filter, list):
+        for index, value in enumerate(filter):
+            if index != 0:
+                out.append(",")
+            yield write_filter_steps(out, value)
+    else:
+        for index, (key, value) in enumerate(filter.items()):
+            if index != 0:
+                out.append(",")
+            yield write_filter_key_steps(out, value, key)
+    out.append(")")
+    return 1
+
+
 def filter_function(
+    out: List[str],
     filter: FilterOperationValue,
     fn_identifier: FilterFunctionKey,
     parent_key: Optional[List[str]] = None,
-) -> List[str]:
+) -> CountSteps:
     fn_name = fn_identifier[1:]
     if is_primitive(filter):
         operands: List[Any] = []
         if parent_key is not None:
             operands.append(escape_resource(parent_key))
         operands.append(escape_value(filter))
-        return [f"{fn_name}({','.join([o for o in operands if o is not None])})"]
-    elif isinstance(filter, list):
-        filter_arr = handle_filter_array(filter)
-        filter_str = ",".join(map(lambda sub_arr: "".join(sub_arr), filter_arr))
-        filter_str = f"{fn_name}({filter_str})"
-        return add_parent_key(filter_str, parent_key)
-    elif isinstance(filter, dict):
-        filter_arr = handle_filter_object(filter)
-        filter_str = ",".join(map(lambda sub_arr: "".join(sub_arr), filter_arr))
-        filter_str = f"{fn_name}({filter_str})"
-        return add_parent_key(filter_str, parent_key)
+        out.append(f"{fn_name}({','.join([o for o in operands if o is not None])})")
+        return 1
+    elif isinstance(filter, (list, dict)):
+        if isinstance(filter, list) and len(filter) < 2:
+            raise Exception(f"Filter arrays must have at least 2, got {filter}")
+        slot = open_parent_key(out, parent_key)
+        return close_parent_key_steps(
+            out, slot, write_function_arguments_steps(out, fn_name, filter)
+        )
     else:
         raise Exception(f"Expected None/str/int/float/dict/list, got: {type(filter)}")
 
 
+def write_binds_steps(
+    out: List[str], filter: str, params: Dict[str, Filter]
+) -> Generator[Any, Any, int]:
+    parts = parse_raw_template(filter)
+    # Binds the template does not use are compiled too, so invalid ones still
+    # raise, and each bind is only compiled once however often it is used
+    compiled: Dict[str, str] = {}
+    for name, param in params.items():
+        param_out: List[str] = []
+        yield write_filter_steps(param_out, param)
+        compiled[name] = "".join(param_out)
+
+    out.append("(")
+    out.append(parts[0])
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        if name in compiled:
+            out.append("(")
+            out.append(compiled[name])
+            out.append(")")
+        else:
+            out.append("$")
+            out.append(name)
+        out.append(parts[i + 1])
+    out.append(")")
+    return 1
+
+
 def apply_binds(
+    out: List[str],
     filter: str,
     params: Dict[str, Filter],
     parent_key: Optional[List[str]] = None,
-) -> List[str]:
-    for index, param in params.items():
-        param_str = f"({''.join(build_filter(param))})"
-        # TODO: I am not yet sure about this regexes...
-        param_str = param_str.replace("$", "$$")
-        filter = re.sub(rf"\${index}([^a-zA-Z0-9]|$)", f"{param_str}\\1", filter)
-    filter = f"({filter})"
-    return add_parent_key(filter, parent_key)
+) -> CountSteps:
+    slot = open_parent_key(out, parent_key)
+    return close_parent_key_steps(out, slot, write_binds_steps(out, filter, params))
 
 
-def handle_expand_array(expands: List[Union[str, ResourceExpand]]) -> List[str]:
+def handle_expand_array_steps(
+    expands: List[Union[str, ResourceExpand]],
+) -> Generator[Any, Any, List[str]]:
     if len(expands) < 1:
         raise Exception(f"Expand arrays must have at least 1 elements, got: {expands}")
-    return list(map(lambda expand: build_expand(expand), expands))
+    expand_str: List[str] = []
+    for expand in expands:
+        expand_str.append((yield build_expand_steps(expand)))
+    return expand_str
 
 
-def handle_expand_object(expand: ResourceExpand) -> List[str]:
-    def __handle_expand_object(value: Any, key: str) -> str:
+def handle_expand_object_steps(
+    expand: ResourceExpand,
+) -> Generator[Any, Any, List[str]]:
+    expand_str: List[str] = []
+    for key, value in expand.items():
         if key[0] == "$":
             raise Exception(
                 "Cannot have expand options without first expanding something!"
@@ -401,30 +607,30 @@ def handle_expand_object(expand: ResourceExpand) -> List[str]:
                 "'`$expand: { 'a/$count': {...} }` is deprecated, please use"
                 "`$expand: { a: { $count: {...} } }` instead."
             )
-        return handle_options("$expand", value, key)
-
-    return map_obj(expand, __handle_expand_object)
+        expand_str.append((yield handle_options_steps("$expand", value, key)))
+    return expand_str
 
 
-def build_expand(expand: Expand) -> str:
+def build_expand_steps(expand: Expand) -> StrSteps:
     if is_primitive(expand):
         return escape_resource(expand)  # type: ignore
     elif isinstance(expand, list):
-        expand_str = handle_expand_array(expand)
-        return join(expand_str)
+        return join_steps(handle_expand_array_steps(expand))
     elif isinstance(expand, dict):
-        expand_str = handle_expand_object(expand)
-        return join(expand_str)
+        return join_steps(handle_expand_object_steps(expand))
     else:
         raise Exception(f"Unknown type for expand '${type(expand)}'")
 
 
-def build_order_by(orderby: OrderBy) -> str:
-    def __build_order_by(v: OrderBy) -> str:
-        if isinstance(v, list):
-            raise Exception("'$orderby' cannot have nested arrays")
-        return build_order_by(v)
+def join_steps(steps: Generator[Any, Any, List[str]]) -> Generator[Any, Any, str]:
+    return join((yield steps))
+
+
+def build_expand(expand: Expand) -> str:
+    return run_steps(build_expand_steps(expand))
+
 
+def build_order_by_steps(orderby: OrderBy) -> StrSteps:
     if isinstance(orderby, str):
         if re.search(r"/\$count\b", orderby):
             raise Exception(
@@ -435,101 +641,136 @@ def build_order_by(orderby: OrderBy) -> str:
     elif isinstance(orderby, list):
         if len(orderby) == 0:
             raise Exception("'$orderby' arrays have to have at least 1 element")
-        result = map(__build_order_by, orderby)
-        return join(list(result))
+        return build_order_by_array_steps(orderby)
     elif isinstance(orderby, dict):  # type: ignore
-        dollar_dir = orderby.get("$dir")
+        return build_order_by_object_steps(orderby)
+    else:
+        raise Exception("'$orderby' option has to be either a string, array, or object")
 
-        remaining_keys = set(list(orderby.keys()))
-        remaining_keys.discard("$dir")
-        dollar_orderby = {k: orderby[k] for k in remaining_keys}
 
-        def __map_dollar_orderby(dir_or_options: Any, key: str) -> str:
-            property_path = key
-            dir = dollar_dir
-            if isinstance(dir_or_options, str):
-                dir = dir_or_options
-            else:
-                keys = dir_or_options.keys()
-                if "$count" not in dir_or_options or len(keys) > 1:
-                    raise Exception(
-                        f"When using {ODataOptionCodeExampleMap['$orderby']} you can only specify $count, "
-                        f"got {list(keys)}"
-                    )
-                property_path = handle_options(
-                    "$orderby", dir_or_options, property_path
-                )
-            if dir is None:  # type: ignore
-                raise Exception(
-                    "'$orderby' objects should either use the '{ a: 'asc' }' or the"
-                    "'$orderby: { a: { $count: ... }, $dir: 'asc' }' notation"
-                )
-            if dir != "asc" and dir != "desc":
-                raise Exception("'$orderby' direction must be 'asc' or 'desc'")
-            return f"{property_path} {dir}"
+def build_order_by_array_steps(orderby: List[OrderBy]) -> Generator[Any, Any, str]:
+    result: List[str] = []
+    for v in orderby:
+        if isinstance(v, list):
+            raise Exception("'$orderby' cannot have nested arrays")
+        result.append((yield build_order_by_steps(v)))
+    return join(result)
 
-        result = map_obj(dollar_orderby, __map_dollar_orderby)
 
-        if len(result) != 1:
-            raise Exception(
-                f"'$orderby' objects must have exactly one element, got {len(result)} elements"
-            )
-        return result[0]
-    else:
-        raise Exception("'$orderby' option has to be either a string, array, or object")
+def build_order_by_object_steps(orderby: Dict[str, Any]) -> Generator[Any, Any, str]:
+    dollar_dir = orderby.get("$dir")
 
-
-def build_option(option: str, value: Any) -> str:
-    compiled_value = ""
-    if option == "$filter":
-        compiled_value = "".join(build_filter(value))
-    elif option == "$expand":
-        compiled_value = build_expand(value)
-    elif option == "$orderby":
-        compiled_value = build_order_by(value)
-    elif option in ["$top", "$skip"]:
-        num = value
-        if not isinstance(num, int):
-            raise Exception(f"'{option}' option has to be a number")
-        compiled_value += str(num)
-    elif option == "$select":
-        select = value
-        if isinstance(select, str):
-            compiled_value = join(select)
-        elif isinstance(select, list):
-            if len(select) == 0:  # type: ignore
-                raise Exception(f"'{option}' arrays have to have at least 1 element")
-            compiled_value = join(select)  # type: ignore
+    result: List[str] = []
+    for key, dir_or_options in orderby.items():
+        if key == "$dir":
+            continue
+        property_path = key
+        dir = dollar_dir
+        if isinstance(dir_or_options, str):
+            dir = dir_or_options
         else:
-            raise Exception(f"'{option}' option has to be either a string or array")
-    else:
-        if option[0] == "@":
-            if not is_primitive(value):
+            keys = dir_or_options.keys()
+            if "$count" not in dir_or_options or len(keys) > 1:
                 raise Exception(
-                    f"Unknown type for parameter alias option '{option}': {type(value)}"
+                    f"When using {ODataOptionCodeExampleMap['$orderby']} you can only specify $count, "
+                    f"got {list(keys)}"
                 )
-            compiled_value = str(escape_value(value))
+            property_path = yield handle_options_steps(
+                "$orderby", dir_or_options, property_path
+            )
+        if dir is None:  # type: ignore
+            raise Exception(
+                "'$orderby' objects should either use the '{ a: 'asc' }' or the"
+                "'$orderby: { a: { $count: ... }, $dir: 'asc' }' notation"
+            )
+        if dir != "asc" and dir != "desc":
+            raise Exception("'$orderby' direction must be 'asc' or 'desc'")
+        result.append(f"{property_path} {dir}")
+
+    if len(result) != 1:
+        raise Exception(
+            f"'$orderby' objects must have exactly one element, got {len(result)} elements"
+        )
+    return result[0]
 
-        elif isinstance(value, list):
-            compiled_value = join(value)  # type: ignore
-        elif isinstance(value, str):
-            compiled_value = value
-        elif isinstance(value, bool):
-            compiled_value = "true" if value else "false"
-        elif isinstance(value, (int, float)):
-            compiled_value = str(value)
 
-        else:
-            raise Exception(f"Unknown type for option {type(value)}")
+def build_order_by(orderby: OrderBy) -> str:
+    return run_steps(build_order_by_steps(orderby))
+
+
+def build_filter_option(option: str, value: Any) -> StrSteps:
+    out: List[str] = []
+    yield write_filter_steps(out, value)
+    return "".join(out)
+
+
+def build_expand_option(option: str, value: Any) -> StrSteps:
+    return build_expand_steps(value)
+
+
+def build_order_by_option(option: str, value: Any) -> StrSteps:
+    return build_order_by_steps(value)
+
+
+def build_number_option(option: str, value: Any) -> str:
+    if not isinstance(value, int):
+        raise Exception(f"'{option}' option has to be a number")
+    return str(value)
+
+
+def build_select_option(option: str, value: Any) -> str:
+    if isinstance(value, str):
+        return join(value)
+    elif isinstance(value, list):
+        if len(value) == 0:  # type: ignore
+            raise Exception(f"'{option}' arrays have to have at least 1 element")
+        return join(value)  # type: ignore
+    raise Exception(f"'{option}' option has to be either a string or array")
+
+
+option_builders: Dict[str, Callable[[str, Any], StrSteps]] = {
+    "$filter": build_filter_option,
+    "$expand": build_expand_option,
+    "$orderby": build_order_by_option,
+    "$top": build_number_option,
+    "$skip": build_number_option,
+    "$select": build_select_option,
+}
+
+
+def build_option_steps(option: str, value: Any) -> Generator[Any, Any, str]:
+    builder = option_builders.get(option)
+    if builder is not None:
+        compiled_value = yield builder(option, value)
+    elif option[0] == "@":
+        if not is_primitive(value):
+            raise Exception(
+                f"Unknown type for parameter alias option '{option}': {type(value)}"
+            )
+        compiled_value = str(escape_value(value))
+    elif isinstance(value, list):
+        compiled_value = join(value)  # type: ignore
+    elif isinstance(value, str):
+        compiled_value = value
+    elif isinstance(value, bool):
+        compiled_value = "true" if value else "false"
+    elif isinstance(value, (int, float)):
+        compiled_value = str(value)
+    else:
+        raise Exception(f"Unknown type for option {type(value)}")
 
     return f"{option}={compiled_value}"
 
 
-def handle_options(
+def build_option(option: str, value: Any) -> str:
+    return run_steps(build_option_steps(option, value))
+
+
+def handle_options_steps(
     option_operation: Literal["$filter", "$expand", "$orderby"],
     options: ODataOptions,
     parent_key: str,
-) -> str:
+) -> Generator[Any, Any, str]:
     if "$count" in options.keys():
         keys = options.keys()
         if len(keys) > 1:
@@ -553,11 +794,13 @@ def handle_options(
                     f"you can only specify $filter in the $count, got {list(options.keys())}"
                 )
 
-    def __parse_options(value: Any, key: str) -> str:
+    options_array: List[str] = []
+    for key, value in options.items():
         if key[0] == "$":
             if not is_valid_option(key):
                 raise Exception(f"Unknown key option '{key}'")
-            return build_option(key, value)
+            options_array.append((yield build_option_steps(key, value)))
+            continue
         if option_operation == "$expand":
             raise Exception(
                 f"'$expand: {parent_key}: ${key}: ...' is invalid, use '$expand: {parent_key}: $expand:"
@@ -568,8 +811,7 @@ def handle_options(
             f"'${option_operation}: ${parent_key}: ${key}: ...' is invalid."
         )
 
-    options_array = map_obj(options, __parse_options)
-    options_str = ";".join(list(options_array))
+    options_str = ";".join(options_array)
 
     if len(options_str) > 0:
         options_str = f"({options_str})"
@@ -577,237 +819,687 @@ def handle_options(
     return escape_resource(parent_key) + options_str
 
 
-def handle_filter_operator(
-    filter: FilterObj,
-    operator: FilterObjOperators,
+def handle_options(
+    option_operation: Literal["$filter", "$expand", "$orderby"],
+    options: ODataOptions,
+    parent_key: str,
+) -> str:
+    return run_steps(handle_options_steps(option_operation, options, parent_key))
+
+
+def filter_duration(
+    out: List[str],
+    filter: DurationValue,
+    operator: str,
     parent_key: Optional[List[str]] = None,
-) -> List[str]:
-    if operator in [
-        "$ne",
-        "$eq",
-        "$gt",
-        "$ge",
-        "$lt",
-        "$le",
-        "$add",
-        "$sub",
-        "$mul",
-        "$div",
-        "$mod",
-    ]:
-        return filter_operation(filter, cast(FilterOperationKey, operator), parent_key)
-    elif operator in [
-        "$contains",
-        "$endswith",
-        "$startswith",
-        "$length",
-        "$indexof",
-        "$substring",
-        "$tolower",
-        "$toupper",
-        "$trim",
-        "$concat",
-        "$year",
-        "$month",
-        "$day",
-        "$hour",
-        "$minute",
-        "$second",
-        "$fractionalseconds",
-        "$date",
-        "$time",
-        "$totaloffsetminutes",
-        "$now",
-        "$maxdatetime",
-        "$mindatetime",
-        "$totalseconds",
-        "$round",
-        "$floor",
-        "$ceiling",
-        "$isof",
-        "$cast",
-    ]:
-        return filter_function(filter, cast(FilterFunctionKey, operator), parent_key)
-
-    elif operator == "$duration":
-        if not isinstance(filter, dict):
-            raise Exception(f"Expected type for {operator}, got: {type(filter)}")
-
-        duration_value = cast(DurationValue, filter)
-        duration_string = "P"
-
-        days = duration_value.get("days")
-        if days is not None:
-            duration_string += f"{days}D"
-
-        time_part = ""
-        for part_key, part_flag in duration_timepart_flag_entries:
-            key = duration_value.get(part_key)
-            if key is not None:
-                time_part += f"{key}{part_flag}"
-
-        if len(time_part) > 0:
-            duration_string += f"T{time_part}"
-
-        if len(duration_string) <= 1:
-            raise Exception(
-                f"Expected {operator} to include duration properties, got: {type(filter)}"
-            )
+) -> int:
+    duration_string = "P"
 
-        if duration_value.get("negative"):
-            duration_string = f"-{duration_string}"
+    days = filter.get("days")
+    if days is not None:
+        duration_string += f"{days}D"
 
-        return add_parent_key(f"duration'{duration_string}'", parent_key)
+    time_part = ""
+    for part_key, part_flag in duration_timepart_flag_entries:
+        key = filter.get(part_key)
+        if key is not None:
+            time_part += f"{key}{part_flag}"
 
-    elif operator == "$raw":
-        if isinstance(filter, str):
-            f = f"({filter})"
-            return add_parent_key(f, parent_key)
-        elif not is_primitive(filter):
-            if isinstance(filter, list):
-                raw_filter = filter[0]  # type: ignore
-                params = cast(List[Filter], filter[0:])  # type: ignore
+    if len(time_part) > 0:
+        duration_string += f"T{time_part}"
 
-                if not isinstance(raw_filter, str):
-                    raise Exception(
-                        f"First element of array for {operator} must be a string, got: {type(raw_filter)}"
-                    )
+    if len(duration_string) <= 1:
+        raise Exception(
+            f"Expected {operator} to include duration properties, got: {type(filter)}"
+        )
 
-                mapped_params: Dict[str, Filter] = {}
-                for index in range(len(params)):
-                    mapped_params[str(index)] = params[index]
-                return apply_binds(raw_filter, mapped_params, parent_key)
-            elif isinstance(filter, dict):  # type: ignore
-                filter_str = filter["$string"]  # type: ignore
-                if not isinstance(filter_str, str):
-                    raise Exception(
-                        f"$string element of object for {operator} must be a string got: "
-                        f"{type(filter_str)}"  # type: ignore
-                    )
-                mapped_params: Dict[str, Filter] = {}
-                for index in filter.keys():
-                    if index != "$string":
-                        if not re.match("^[a-zA-Z0-9]+$", index):
-                            raise Exception(
-                                f"{operator} param names must contain only [a-zA-Z0-9], got: {index}"
-                            )
-                        mapped_params[index] = cast(Filter, filter[index])
-                return apply_binds(filter_str, mapped_params, parent_key)
+    if filter.get("negative"):
+        duration_string = f"-{duration_string}"
+
+    return write_value(out, f"duration'{duration_string}'", parent_key)
 
+
+def filter_raw(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    if isinstance(filter, str):
+        return write_value(out, f"({filter})", parent_key)
+    elif isinstance(filter, list):
+        raw_filter = filter[0]  # type: ignore
+        params = cast(List[Filter], filter[0:])  # type: ignore
+
+        if not isinstance(raw_filter, str):
             raise Exception(
-                f"Expected None/str/int/float/dict/list, got: {type(filter)}"
+                f"First element of array for {operator} must be a string, got: {type(raw_filter)}"
             )
 
-    elif operator == "$":
-        resource = escape_resource(filter)  # type: ignore
-        return add_parent_key(resource, parent_key)
-    elif operator == "$count":
-        keys = ["$count"]
-        if (
-            parent_key is not None
-            and isinstance(filter, dict)  # type: ignore
-            and (len(filter.keys()) == 0 or "$filter" in filter.keys())
-        ):
-            keys = parent_key[:-1]
-            keys.append(handle_options("$filter", {"$count": filter}, parent_key[-1]))
-            return ["/".join(keys)]
-        if parent_key is not None:
-            keys = parent_key + keys
-        return build_filter(filter, keys)
-
-    elif operator in ["$and", "$or"]:
-        filter_str = build_filter(filter, None, f" {operator[1:]} ")
-        return add_parent_key(filter_str, parent_key)
-    elif operator == "$in":
-        if is_primitive(filter):
-            filter_str = escape_value(filter)
-            return add_parent_key(filter_str, parent_key, " eq ")
-        elif isinstance(filter, list):
-            if all(map(is_primitive, filter)):
-                filter_str = handle_filter_array(filter, None, 1)
-                in_str = "".join(bracket_join(filter_str, ", "))
-                return add_parent_key(f"({in_str})", parent_key, " in ")
-            else:
-                filter_str = handle_filter_array(filter, parent_key, 1)
-                return bracket_join(filter_str, " or ")
-        elif isinstance(filter, dict):  # type: ignore
-            filter_arr = handle_filter_object(filter, parent_key)
-            if len(filter_arr) < 1:
-                raise Exception(
-                    f"{operator} objects must have at least 1 property, got: {filter}"
-                )
-            return bracket_join(filter_arr, " or ")
-        else:
+        mapped_params: Dict[str, Filter] = {}
+        for index in range(len(params)):
+            mapped_params[str(index)] = params[index]
+        return apply_binds(out, raw_filter, mapped_params, parent_key)
+    elif isinstance(filter, dict):
+        filter_str = filter["$string"]  # type: ignore
+        if not isinstance(filter_str, str):
             raise Exception(
-                f"Expected None/str/int/float/dict/list, got: {type(filter)}"
+                f"$string element of object for {operator} must be a string got: "
+                f"{type(filter_str)}"  # type: ignore
             )
-    elif operator == "$not":
-        filter_str = f"not({''.join(build_filter(filter))})"
-        return add_parent_key(filter_str, parent_key)
-    elif operator in ["$any", "$all"]:
-        alias = filter["$alias"]  # type: ignore
-        expr = filter["$expr"]  # type: ignore
+        mapped_params: Dict[str, Filter] = {}
+        for index in filter.keys():
+            if index != "$string":
+                if not re.match("^[a-zA-Z0-9]+$", index):
+                    raise Exception(
+                        f"{operator} param names must contain only [a-zA-Z0-9], got: {index}"
+                    )
+                mapped_params[index] = cast(Filter, filter[index])
+        return apply_binds(out, filter_str, mapped_params, parent_key)
 
-        if alias is None:
-            raise Exception(f"Lambda expression ({operator}) has no alias defined.")
-        if expr is None:
-            raise Exception(f"Lambda expression ({operator}) has no expr defined.")
+    raise Exception(f"Expected None/str/int/float/dict/list, got: {type(filter)}")
 
-        filter_str = "".join(build_filter(expr))  # type: ignore
-        filter_str = f"{operator[1:]}({alias}:{filter_str})"
-        return add_parent_key(filter_str, parent_key, "/")
 
-    raise Exception(f"Unrecognised operator: '{operator}'")
+def filter_resource(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> int:
+    return write_value(out, escape_resource(filter), parent_key)
 
 
-def handle_filter_object(
-    filter: FilterObj,
+def filter_count(
+    out: List[str],
+    filter: Any,
+    operator: str,
     parent_key: Optional[List[str]] = None,
-) -> List[List[str]]:
-    def __handle_filter_object_key(
-        value: Union[Filter, Lambda, None], key: str
-    ) -> List[str]:
-        # TODO: check None vs null+undefined here
-        if key[0] == "$":
-            return handle_filter_operator(value, key, parent_key)  # type: ignore
-        elif key[0] == "@":
-            parameter_alias = escape_parameter_alias(value)
-            return add_parent_key(parameter_alias, parent_key)
+) -> CountSteps:
+    keys = ["$count"]
+    if (
+        parent_key is not None
+        and isinstance(filter, dict)
+        and (len(filter.keys()) == 0 or "$filter" in filter.keys())
+    ):
+        return write_count_options_steps(out, filter, parent_key)
+    if parent_key is not None:
+        keys = parent_key + keys
+    return write_filter_steps(out, filter, keys)
+
+
+def write_count_options_steps(
+    out: List[str], filter: AnyObject, parent_key: List[str]
+) -> Generator[Any, Any, int]:
+    keys = parent_key[:-1]
+    keys.append(
+        (yield handle_options_steps("$filter", {"$count": filter}, parent_key[-1]))
+    )
+    out.append("/".join(keys))
+    return 1
+
+
+def filter_junction(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    slot = open_parent_key(out, parent_key)
+    return close_parent_key_steps(
+        out, slot, write_filter_steps(out, filter, None, f" {operator[1:]} ")
+    )
+
+
+def filter_in(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    if is_primitive(filter):
+        return write_value(out, escape_value(filter), parent_key, " eq ")
+    elif isinstance(filter, list):
+        in_str = escape_value_list(filter)
+        if in_str is not None:
+            slot = open_parent_key(out, parent_key, " in ")
+            out.append(f"({in_str})")
+            return close_parent_key(out, slot, 1)
+        elif all(map(is_primitive, filter)):
+            if len(filter) < 1:
+                raise Exception(f"Filter arrays must have at least 1, got {filter}")
+            slot = open_parent_key(out, parent_key, " in ")
+            out.append("(")
+            for index, value in enumerate(filter):
+                if index != 0:
+                    out.append(", ")
+                out.append(f"{escape_value(value)}")
+            out.append(")")
+            return close_parent_key(out, slot, 1)
         else:
-            keys = [key]
-            if parent_key is not None:
-                # if len(parent_key) > 0:
-                #     raise Exception(
-                #         "`$filter: a: b: ...` is deprecated, please use `$filter: a: $any: { $alias: 'x', \
-                #                     $expr: x: b: ... }` instead."
-                #     )
-                keys = parent_key + keys
-            return build_filter(value, keys)  # type: ignore
+            return write_filter_array_steps(out, filter, " or ", parent_key, 1)
+    elif isinstance(filter, dict):
+        if len(filter) < 1:
+            raise Exception(
+                f"{operator} objects must have at least 1 property, got: {filter}"
+            )
+        return write_filter_object_steps(out, filter, " or ", parent_key)
+    raise Exception(f"Expected None/str/int/float/dict/list, got: {type(filter)}")
+
+
+def filter_not(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> Generator[Any, Any, int]:
+    slot = open_parent_key(out, parent_key)
+    out.append("not(")
+    yield write_filter_steps(out, filter)
+    out.append(")")
+    return close_parent_key(out, slot, 1)
+
+
+def filter_lambda(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> Generator[Any, Any, int]:
+    alias = filter["$alias"]
+    expr = filter["$expr"]
 
-    return map_obj(filter, __handle_filter_object_key)
+    if alias is None:
+        raise Exception(f"Lambda expression ({operator}) has no alias defined.")
+    if expr is None:
+        raise Exception(f"Lambda expression ({operator}) has no expr defined.")
 
+    slot = open_parent_key(out, parent_key, "/")
+    out.append(f"{operator[1:]}({alias}:")
+    yield write_filter_steps(out, expr)
+    out.append(")")
+    return close_parent_key(out, slot, 1)
 
-def build_filter(
+
+# Handlers either return the fragment count or, to compile nested values, the
+# steps producing it
+FilterOperatorHandler = Callable[[List[str], Any, str, Optional[List[str]]], CountSteps]
+
+
+class FilterOperatorSpec(NamedTuple):
+    handler: FilterOperatorHandler
+    # Number of operands a list value must have, None when it is not checked
+    arity: Optional[int] = None
+    # Types the value must be an instance of, None when it is not checked
+    value_types: Optional[Tuple[type, ...]] = None
+
+
+filter_operators: Dict[str, FilterOperatorSpec] = {
+    **{
+        operator: FilterOperatorSpec(filter_operation)
+        for operator in get_args(FilterOperationKey)
+    },
+    **{
+        operator: FilterOperatorSpec(filter_function)
+        for operator in get_args(FilterFunctionKey)
+    },
+    "$duration": FilterOperatorSpec(filter_duration, value_types=(dict,)),
+    "$raw": FilterOperatorSpec(filter_raw),
+    "$": FilterOperatorSpec(filter_resource),
+    "$count": FilterOperatorSpec(filter_count),
+    "$and": FilterOperatorSpec(filter_junction),
+    "$or": FilterOperatorSpec(filter_junction),
+    "$in": FilterOperatorSpec(filter_in),
+    "$not": FilterOperatorSpec(filter_not),
+    "$any": FilterOperatorSpec(filter_lambda),
+    "$all": FilterOperatorSpec(filter_lambda),
+}
+
+
+def register_filter_operator(
+    operator: str,
+    handler: FilterOperatorHandler,
+    arity: Optional[int] = None,
+    value_types: Optional[Tuple[type, ...]] = None,
+) -> None:
+    if not operator.startswith("$") or len(operator) < 2:
+        raise Exception(f"Filter operators must start with '$', got: '{operator}'")
+    if operator in filter_operators:
+        raise Exception(f"Filter operator '{operator}' is already registered")
+    filter_operators[operator] = FilterOperatorSpec(handler, arity, value_types)
+
+
+def register_filter_operation(operator: str) -> None:
+    register_filter_operator(operator, filter_operation, 2)
+
+
+def register_filter_function(operator: str, arity: Optional[int] = None) -> None:
+    register_filter_operator(operator, filter_function, arity)
+
+
+def write_filter_operator_steps(
+    out: List[str],
+    filter: Any,
+    operator: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    spec = filter_operators.get(operator)
+    if spec is None:
+        raise Exception(f"Unrecognised operator: '{operator}'")
+    if spec.value_types is not None and not isinstance(filter, spec.value_types):
+        raise Exception(f"Expected type for {operator}, got: {type(filter)}")
+    if (
+        spec.arity is not None
+        and isinstance(filter, list)
+        and len(filter) != spec.arity
+    ):
+        raise Exception(
+            f"{operator} expects {spec.arity} operands, got {len(filter)}: {filter}"
+        )
+    return spec.handler(out, filter, operator, parent_key)
+
+
+def write_filter_key_steps(
+    out: List[str],
+    value: Union[Filter, Lambda, None],
+    key: str,
+    parent_key: Optional[List[str]] = None,
+) -> CountSteps:
+    # TODO: check None vs null+undefined here
+    if key[0] == "$":
+        return write_filter_operator_steps(out, value, key, parent_key)  # type: ignore
+    elif key[0] == "@":
+        parameter_alias = escape_parameter_alias(value)
+        return write_value(out, parameter_alias, parent_key)
+    else:
+        keys = [key]
+        if parent_key is not None:
+            # if len(parent_key) > 0:
+            #     raise Exception(
+            #         "`$filter: a: b: ...` is deprecated, please use `$filter: a: $any: { $alias: 'x', \
+            #                     $expr: x: b: ... }` instead."
+            #     )
+            keys = parent_key + keys
+        return write_filter_steps(out, value, keys)  # type: ignore
+
+
+def write_filter_steps(
+    out: List[str],
     filter: Filter,
     parent_key: Optional[List[str]] = None,
     join_str: Optional[str] = None,
-) -> List[str]:
+) -> CountSteps:
     if is_primitive(filter):
-        filter_str = escape_value(filter)
-        return add_parent_key(filter_str, parent_key)
+        return write_value(out, escape_value(filter), parent_key)
     elif isinstance(filter, list):
-        filter_arr = handle_filter_array(filter)
-        filter_str = bracket_join(filter_arr, " or " if join_str is None else join_str)
-        return add_parent_key(filter_str, parent_key)
+        slot = open_parent_key(out, parent_key)
+        return close_parent_key_steps(
+            out,
+            slot,
+            write_filter_array_steps(
+                out, filter, " or " if join_str is None else join_str
+            ),
+        )
     elif isinstance(filter, dict):
-        filter_arr = handle_filter_object(filter, parent_key)
-        return bracket_join(filter_arr, " and " if join_str is None else join_str)
+        return write_filter_object_steps(
+            out, filter, " and " if join_str is None else join_str, parent_key
+        )
     else:
         raise Exception(f"Expected None/str/int/float/dict/list, got: {type(filter)}")
 
 
-class PinejsClientCore(ABC):
-    def __init__(self, params: Union[str, Params]):
+def write_filter_array(
+    out: List[str],
+    filter: FilterArray,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+    min_elements: int = 2,
+) -> int:
+    return run_steps(
+        write_filter_array_steps(out, filter, separator, parent_key, min_elements)
+    )
+
+
+def write_filter_object(
+    out: List[str],
+    filter: FilterObj,
+    separator: str,
+    parent_key: Optional[List[str]] = None,
+) -> int:
+    return run_steps(write_filter_object_steps(out, filter, separator, parent_key))
+
+
+def write_filter_key(
+    out: List[str],
+    value: Union[Filter, Lambda, None],
+    key: str,
+    parent_key: Optional[List[str]] = None,
+) -> int:
+    return run_steps(write_filter_key_steps(out, value, key, parent_key))
+
+
+def write_filter(
+    out: List[str],
+    filter: Filter,
+    parent_key: Optional[List[str]] = None,
+    join_str: Optional[str] = None,
+) -> int:
+    return run_steps(write_filter_steps(out, filter, parent_key, join_str))
+
+
+def build_filter(
+    filter: Filter,
+    parent_key: Optional[List[str]] = None,
+    join_str: Optional[str] = None,
+) -> List[str]:
+    out: List[str] = []
+    write_filter(out, filter, parent_key, join_str)
+    return out
+
+
+# Conversion of options dicts into the query IR (see `ir`). Filters without a
+# dedicated node are compiled once into fragments, so any dict converts and
+# errors surface when the IR is built rather than when it is serialised.
+
+
+def filter_fragment(filter: Filter) -> ir.Fragment:
+    out: List[str] = []
+    count = write_filter(out, filter)
+    return ir.Fragment("".join(out), count)
+
+
+def junction_node_steps(
+    junction: Callable[..., Any], steps: List[Any]
+) -> Generator[Any, Any, Any]:
+    children = []
+    for child_steps in steps:
+        child = yield child_steps
+        if child is None:
+            return None
+        children.append(child)
+    return junction(*children)
+
+
+def not_node_steps(steps: Any) -> Generator[Any, Any, ir.FilterNode]:
+    return ir.Not((yield steps))
+
+
+def lambda_node_steps(
+    path: List[str], kind: str, alias: str, steps: Any
+) -> Generator[Any, Any, ir.FilterNode]:
+    return ir.Lambda(path, kind, alias, (yield steps))
+
+
+def fallback_node_steps(
+    steps: Any, filter: Filter
+) -> Generator[Any, Any, ir.FilterNode]:
+    node = yield steps
+    return filter_fragment(filter) if node is None else node
+
+
+def property_node_steps(path: List[str], value: Any) -> Any:
+    # Returns None for values under a property path that have no dedicated node
+    if is_primitive(value):
+        return ir.Compare(path, "eq", value)
+    if not isinstance(value, dict) or len(value) == 0:
+        return None
+    steps = [path_entry_node_steps(path, key, v) for key, v in value.items()]
+    if len(steps) == 1:
+        return steps[0]
+    return junction_node_steps(ir.And, steps)
+
+
+def path_entry_node_steps(path: List[str], key: str, value: Any) -> Any:
+    if key[0] not in ("$", "@"):
+        return property_node_steps(path + [key], value)
+    if key == "@":
+        return (
+            ir.Compare(path, "eq", AliasReference(value))
+            if isinstance(value, str)
+            else None
+        )
+    spec = filter_operators.get(key)
+    if spec is None or (
+        spec.value_types is not None and not isinstance(value, spec.value_types)
+    ):
+        return None
+    if spec.handler is filter_operation and is_primitive(value):
+        return ir.Compare(path, key[1:], value)
+    if spec.handler is filter_function and is_primitive(value):
+        return ir.Call(key[1:], path, value)
+    if spec.handler is filter_in:
+        if is_primitive(value):
+            return ir.Compare(path, "eq", value)
+        if isinstance(value, list) and len(value) > 0 and all(map(is_primitive, value)):
+            return ir.In(path, value)
+    if (
+        spec.handler is filter_lambda
+        and isinstance(value, dict)
+        and isinstance(value.get("$alias"), str)
+        and value.get("$expr") is not None
+    ):
+        return lambda_node_steps(
+            path, key[1:], value["$alias"], filter_node_steps(value["$expr"])
+        )
+    return None
+
+
+def filter_entry_node_steps(key: str, value: Any) -> Any:
+    if key in ("$and", "$or"):
+        junction = ir.And if key == "$and" else ir.Or
+        if isinstance(value, list) and len(value) >= 2:
+            return junction_node_steps(junction, [filter_node_steps(v) for v in value])
+        if isinstance(value, dict) and len(value) > 0:
+            return junction_node_steps(
+                junction, [filter_entry_node_steps(k, v) for k, v in value.items()]
+            )
+    elif key == "$not":
+        return not_node_steps(filter_node_steps(value))
+    elif key == "$raw" and isinstance(value, str):
+        return ir.Raw(value)
+    elif key[0] not in ("$", "@"):
+        return fallback_node_steps(property_node_steps([key], value), {key: value})
+    return filter_fragment({key: value})
+
+
+def filter_node_steps(filter: Filter) -> Any:
+    if isinstance(filter, dict) and len(filter) > 0:
+        steps = [filter_entry_node_steps(key, value) for key, value in filter.items()]
+        if len(steps) == 1:
+            return steps[0]
+        return junction_node_steps(ir.And, steps)
+    elif isinstance(filter, list) and len(filter) >= 2:
+        return junction_node_steps(ir.Or, [filter_node_steps(v) for v in filter])
+    return filter_fragment(filter)
+
+
+def to_filter_node(filter: Filter) -> ir.FilterNode:
+    return run_steps(filter_node_steps(filter))
+
+
+def count_query_options(
+    options: ODataOptions, option_operation: str, parent_key: str
+) -> Generator[Any, Any, ir.QueryOptions]:
+    if len(options.keys()) > 1:
+        raise Exception(
+            f"When using {ODataOptionCodeExampleMap[option_operation]}"
+            f"you can only specify $count, got: {options.keys()}"
+        )
+    count_options = options["$count"]
+    if len(count_options.keys()) > (1 if "$filter" in count_options.keys() else 0):
+        if option_operation == "$expand":
+            raise Exception(
+                "using OData options other than $filter in a '$expand: { a: { $count: {...} } }' "
+                "is not allowed, please remove them."
+            )
+        raise Exception(
+            f"When using {ODataOptionCodeExampleMap[option_operation]} "
+            f"you can only specify $filter in the $count, got {list(count_options.keys())}"
+        )
+    return (yield query_options_steps(count_options, parent_key))
+
+
+def expand_items_steps(expand: Expand) -> Generator[Any, Any, List[ir.ExpandItem]]:
+    if is_primitive(expand):
+        return [ir.ExpandItem(expand)]  # type: ignore
+    elif isinstance(expand, list):
+        if len(expand) < 1:
+            raise Exception(
+                f"Expand arrays must have at least 1 elements, got: {expand}"
+            )
+        items: List[ir.ExpandItem] = []
+        for value in expand:
+            items.extend((yield expand_items_steps(value)))
+        return items
+    elif isinstance(expand, dict):
+        if len(expand) == 0:
+            raise Exception("Expand objects must have at least 1 property")
+        items = []
+        for key, value in expand.items():
+            if key[0] == "$":
+                raise Exception(
+                    "Cannot have expand options without first expanding something!"
+                )
+            if not isinstance(value, dict) or key.endswith("/$count"):
+                # Let the compiler raise its error for invalid values
+                build_expand({key: value})
+            if "$count" in value:
+                options = yield count_query_options(value, "$expand", key)
+                items.append(ir.ExpandItem(key, options, count=True))
+            else:
+                options = yield query_options_steps(value, key)
+                items.append(ir.ExpandItem(key, options))
+        return items
+    raise Exception(f"Unknown type for expand '${type(expand)}'")
+
+
+def order_by_items_steps(
+    orderby: OrderBy,
+) -> Generator[Any, Any, List[ir.OrderByItem]]:
+    if isinstance(orderby, str):
+        build_order_by(orderby)
+        items: List[ir.OrderByItem] = []
+        for part in orderby.split(","):
+            tokens = part.split(" ")
+            if len(tokens) == 2 and tokens[1] in ("asc", "desc") and tokens[0] != "":
+                items.append(ir.OrderByItem(tokens[0], tokens[1]))
+            else:
+                items.append(ir.OrderByItem(part))
+        return items
+    elif isinstance(orderby, list):
+        if len(orderby) == 0:
+            raise Exception("'$orderby' arrays have to have at least 1 element")
+        items = []
+        for value in orderby:
+            if isinstance(value, list):
+                raise Exception("'$orderby' cannot have nested arrays")
+            items.extend((yield order_by_items_steps(value)))
+        return items
+    elif isinstance(orderby, dict):
+        # Validates the object, including its direction and number of properties
+        build_order_by(orderby)
+        dollar_dir = orderby.get("$dir")
+        for key, dir_or_options in orderby.items():
+            if key == "$dir":
+                continue
+            if isinstance(dir_or_options, str):
+                return [ir.OrderByItem(key, dir_or_options)]
+            options = yield count_query_options(dir_or_options, "$orderby", key)
+            return [ir.OrderByItem(key, dollar_dir, options)]
+    raise Exception("'$orderby' option has to be either a string, array, or object")
+
+
+def select_option(value: Any) -> ir.SelectOption:
+    if isinstance(value, str):
+        return ir.SelectOption(value)
+    elif isinstance(value, list):
+        return ir.SelectOption(*value)
+    raise Exception("'$select' option has to be either a string or array")
+
+
+def query_options_steps(
+    options: ODataOptions, parent_key: Optional[str] = None
+) -> Generator[Any, Any, ir.QueryOptions]:
+    # `parent_key` is the expanded property for the options of an $expand
+    nodes: List[ir.Option] = []
+    count = False
+    if parent_key is None and options.get("$count") is not None:
+        if len(options.keys()) > 1:
+            raise Exception(
+                f"When using '$expand: a: $count: ...' you can only specify $count, got: '{options.keys()}'"
+            )
+        count = True
+        options = options["$count"]
+
+    for key, value in options.items():
+        if key[0] == "$" and not is_valid_option(key):
+            raise Exception(f"Unknown key option '{key}'")
+        if parent_key is not None and key[0] != "$":
+            raise Exception(
+                f"'$expand: {parent_key}: ${key}: ...' is invalid, use '$expand: {parent_key}: $expand:"
+                f"{key}: ...' instead."
+            )
+        if key == "$filter":
+            nodes.append(ir.FilterOption((yield filter_node_steps(value))))
+        elif key == "$expand":
+            nodes.append(ir.ExpandOption(*(yield expand_items_steps(value))))
+        elif key == "$orderby":
+            nodes.append(ir.OrderByOption(*(yield order_by_items_steps(value))))
+        elif key == "$select":
+            nodes.append(select_option(value))
+        elif key == "$top":
+            nodes.append(ir.TopOption(value))
+        elif key == "$skip":
+            nodes.append(ir.SkipOption(value))
+        elif key[0] == "@":
+            if not is_primitive(value):
+                raise Exception(
+                    f"Unknown type for parameter alias option '{key}': {type(value)}"
+                )
+            nodes.append(ir.ParameterAliasOption(key[1:], value))
+        else:
+            nodes.append(ir.CustomOption(key, value))
+    return ir.QueryOptions(*nodes, count=count)
+
+
+def to_query_options(options: ODataOptions) -> ir.QueryOptions:
+    return run_steps(query_options_steps(options))
+
+
+CacheEntry = Tuple[str, str, int]
+
+
+def resource_name(params: Params) -> Optional[str]:
+    resource = params.get("resource")
+    if resource is None:
+        return None
+    return re.split(r"[/(]", resource, maxsplit=1)[0]
+
+
+def is_unique_violation(e: Exception) -> bool:
+    if re.search(r"unique", e.message, re.IGNORECASE):  # type: ignore
+        if e.status_code == 409:  # type: ignore
+            return True
+    return False
+
+
+class PinejsClientBase:
+    # Everything that does not do I/O, shared by the sync and async clients
+    single_flight_class: Callable[[], Any]
+
+    def __init__(
+        self,
+        params: Union[str, Params],
+        *,
+        compile_cache_size: Optional[int] = None,
+        max_concurrency: int = 4,
+        parameter_alias_min_length: Optional[int] = None,
+        optimize_filters: bool = False,
+        response_cache_size: Optional[int] = None,
+        response_cache_ttl: float = 60,
+        response_cache_max_bytes: Optional[int] = None,
+        coalesce_requests: bool = False,
+        adaptive_upsert: bool = False,
+    ):
         params_to_set: Params = {}
         if isinstance(params, str):
             params_to_set = {"api_prefix": params}
@@ -818,19 +1510,44 @@ class PinejsClientCore(ABC):
         self.passthrough = params_to_set.get("passthrough", {})
         self.passthrough_by_method = params_to_set.get("passthrough_by_method", {})
         self.backend_params: Optional[AnyObject] = None
+        self.compile_cache: Optional[LRUCache] = (
+            None if compile_cache_size is None else LRUCache(compile_cache_size)
+        )
+        self.max_concurrency = max_concurrency
+        self.parameter_alias_min_length = parameter_alias_min_length
+        self.optimize_filters = optimize_filters
+        self.response_cache: Optional[ResponseCache] = (
+            None
+            if response_cache_size is None
+            else ResponseCache(
+                response_cache_size, response_cache_ttl, response_cache_max_bytes
+            )
+        )
+        self.single_flight: Any = (
+            self.single_flight_class() if coalesce_requests else None
+        )
+        self.upsert_strategy: Optional[UpsertStrategy] = (
+            UpsertStrategy() if adaptive_upsert else None
+        )
 
     def transform_get_result(self, params: Params) -> Callable[[Any], Any]:
         singular = False if params.get("id") is None else True
 
         def transform_get_result_fn(data: AnyObject) -> Any:
-            if not isinstance(data, dict):  # type: ignore
+            if is_stream(data):
+                # Rows are decoded lazily as the caller iterates them
+                data_d = decode_stream(data)
+            elif not isinstance(data, dict):  # type: ignore
                 raise Exception(f"Response was not a JSON object: '{type(data)}'")
-            data_d = data.get("d")
+            else:
+                data_d = data.get("d")
             if data_d is None:
                 raise Exception(
                     "Invalid response received, the 'd' property is missing."
                 )
             if singular:
+                if isinstance(data_d, Iterator):
+                    data_d = list(islice(data_d, 2))
                 if len(data_d) > 1:
                     raise Exception(
                         "Returned multiple results when only one was expected."
@@ -844,23 +1561,20 @@ class PinejsClientCore(ABC):
 
         return transform_get_result_fn
 
-    def get(self, params: Params) -> Any:
-        result = self.request({**params, "method": "GET"})
-        return self.transform_get_result(params)(result)
-
-    def put(self, params: Params) -> Any:
-        return self.request({**params, "method": "PUT"})
-
-    def patch(self, params: Params) -> Any:
-        return self.request({**params, "method": "PATCH"})
-
-    def post(self, params: Params) -> Any:
-        return self.request({**params, "method": "POST"})
-
-    def delete(self, params: Params) -> Any:
-        return self.request({**params, "method": "DELETE"})
+    def get_chunks(
+        self, params: Params, max_url_length: Optional[int]
+    ) -> Optional[InChunks]:
+        if max_url_length is None:
+            return None
+        api_prefix = params.get("api_prefix", self.api_prefix)
+        return split_in_chunks(
+            cast(AnyObject, params),
+            lambda p: api_prefix + self.compile(cast(Params, p)),
+            max_url_length,
+        )
 
-    def get_or_create(self, params: GetOrCreateParams) -> Any:
+    def get_or_create_params(self, params: GetOrCreateParams) -> Tuple[Params, Params]:
+        # Returns the params to get the existing resource and to create it
         id = params["id"]
         body = params["body"]
 
@@ -880,14 +1594,14 @@ class PinejsClientCore(ABC):
         remaining_keys.discard("body")
         remaining_params: Params = {k: params[k] for k in remaining_keys}  # type: ignore
 
-        result = self.get({**remaining_params, "id": id})
-
-        if result is not None:
-            return result
-
-        return self.post({**remaining_params, "body": {**id, **body}})
+        return {**remaining_params, "id": id}, {
+            **remaining_params,
+            "body": {**id, **body},
+        }
 
-    def upsert(self, params: UpsertParams) -> Any:
+    def upsert_params(self, params: UpsertParams) -> Tuple[Params, Params]:
+        # Returns the params to create the resource and to update it when the
+        # create hits a unique constraint
         id = params["id"]
         body = params["body"]
 
@@ -910,44 +1624,148 @@ class PinejsClientCore(ABC):
 
         post_params: Params = {**remaining_params, "body": {**id, **body}}
 
-        try:
-            return self.post(post_params)
-        except Exception as e:
-            is_unique_violation_response = False
-            if re.search(r"unique", e.message, re.IGNORECASE):  # type: ignore
-                if e.status_code == 409:  # type: ignore
-                    is_unique_violation_response = True
+        options = remaining_params.get("options", {})
+        dollar_filter = (
+            id if options.get("$filter") is None else {"$and": [options["$filter"], id]}
+        )
 
-            if not is_unique_violation_response:
-                raise e
+        patch_parameters: Params = {
+            **remaining_params,
+            "options": {**options, "$filter": dollar_filter},
+            "body": body,
+        }
 
-            options = remaining_params.get("options", {})
-            dollar_filter = (
-                id
-                if options.get("$filter") is None
-                else {"$and": [options["$filter"], id]}
-            )
+        return post_params, patch_parameters
 
-            patch_parameters: Params = {
-                **remaining_params,
-                "options": {**options, "$filter": dollar_filter},
-                "body": body,
-            }
+    def upsert_lookup_params(self, params: UpsertParams) -> Params:
+        # Only selects the key, to find out whether the row exists
+        id = params["id"]
+        remaining_params: Params = {
+            k: v  # type: ignore
+            for k, v in params.items()
+            if k not in ("id", "body", "options")
+        }
+        return {
+            **remaining_params,
+            "options": {"$select": list(id.keys()), "$filter": id, "$top": 1},
+        }
+
+    def upsert_order(self, params: UpsertParams) -> str:
+        if self.upsert_strategy is None:
+            return POST_FIRST
+        return self.upsert_strategy.choose(cast(str, resource_name(params)))
+
+    def record_upsert(
+        self, params: UpsertParams, looked_up: bool, posted: bool, conflict: bool
+    ) -> None:
+        if self.upsert_strategy is not None:
+            self.upsert_strategy.record(
+                cast(str, resource_name(params)), looked_up, posted, conflict
+            )
 
-            return self.patch(patch_parameters)
+    def pages(
+        self,
+        params: Params,
+        page_size: int = 1000,
+        key: Key = "id",
+        keyset: bool = False,
+        cursor: Optional[str] = None,
+        prefetch: int = 1,
+    ) -> Pages:
+        return paginate(
+            cast(AnyObject, params), page_size, key, keyset, cursor, prefetch
+        )
 
-    def request(self, params: Params) -> Any:
+    def request_key(self, params: Params) -> Optional[str]:
+        # Identical GETs in flight at the same time share one request
+        if self.single_flight is None:
+            return None
+        return params.get("api_prefix", self.api_prefix) + self.compile(params)
+
+    def response_cache_entry(self, params: Params) -> Optional[CacheEntry]:
+        # The url a GET is cached under, the resource whose writes drop it and
+        # the resource's cache generation when the GET started
+        if self.response_cache is None:
+            return None
+        resource = resource_name(params)
+        if resource is None:
+            return None
+        url = params.get("api_prefix", self.api_prefix) + self.compile(params)
+        return url, resource, self.response_cache.generation(resource)
+
+    def cached_response(self, entry: Optional[CacheEntry]) -> Tuple[bool, Any]:
+        if entry is None or self.response_cache is None:
+            return False, None
+        return self.response_cache.get(entry[0])
+
+    def cache_response(self, entry: Optional[CacheEntry], result: Any) -> None:
+        # Streamed rows can only be read once so they are never cached
+        if entry is None or self.response_cache is None or is_stream(result):
+            return
+        url, resource, generation = entry
+        self.response_cache.set(url, resource, result, generation)
+
+    def invalidate_response_cache(self, params: Params) -> None:
+        if self.response_cache is not None:
+            self.response_cache.invalidate(resource_name(params))
+
+    def request_args(self, params: Params) -> Tuple[str, str, Optional[Any]]:
         # TODO: actually passthrought the passthrought stuff
         api_prefix = params.get("api_prefix", self.api_prefix)
         url = api_prefix + self.compile(params)
         method = params.get("method", "GET").upper()
-        return self._request(method=method, url=url, body=params.get("body"))
-
-    @abstractmethod
-    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
-        pass
+        return method, url, params.get("body")
 
     def compile(self, params: Params) -> str:
+        if self.compile_cache is None:
+            return self._compile(params)
+
+        try:
+            # The key is a snapshot of the params so mutating them after the
+            # call can never make the cache return a stale url
+            key = structural_key(
+                [
+                    params.get("url"),
+                    params.get("resource"),
+                    params.get("id"),
+                    params.get("options"),
+                ]
+            )
+        except Unhashable:
+            return self._compile(params)
+
+        url = self.compile_cache.get(key)
+        if url is None:
+            url = self._compile(params)
+            self.compile_cache.set(key, url)
+        return url
+
+    def prepare(self, params: Params) -> PreparedQuery:
+        return PreparedQuery(cast(AnyObject, params), self.compile(params))
+
+    def compile_shape(self, params: Params) -> Tuple[str, Dict[str, Any]]:
+        if isinstance(params.get("options"), ir.QueryOptions):
+            raise Exception("Cannot lift parameter aliases out of query IR")
+        lifted, aliases = lift_parameter_aliases(
+            cast(AnyObject, params), self.parameter_alias_min_length or 0
+        )
+        return self._build_url(cast(Params, without_aliases(lifted, aliases))), aliases
+
+    def _compile(self, params: Params) -> str:
+        options = params.get("options")
+        if isinstance(options, ir.QueryOptions):
+            # Query IR is already in its final form
+            return self._build_url(params)
+        if self.optimize_filters and options is not None:
+            params = {**params, "options": optimize_options(options)}
+        if params.get("url") is None and self.parameter_alias_min_length is not None:
+            lifted, _ = lift_parameter_aliases(
+                cast(AnyObject, params), self.parameter_alias_min_length
+            )
+            return self._build_url(cast(Params, lifted))
+        return self._build_url(params)
+
+    def _build_url(self, params: Params) -> str:
         url = params.get("url")
 
         if url is not None:
@@ -960,15 +1778,21 @@ class PinejsClientCore(ABC):
         url = escape_resource(resource)
         options = params.get("options")
 
-        if options is not None and options.get("$count") is not None:
-            keys = options.keys()
+        if isinstance(options, ir.QueryOptions):
+            if options.count:
+                url += "/$count"
+        elif options is not None and options.get("$count") is not None:
+            # Parameter aliases are query options of the whole url, so they
+            # are kept next to the options of the $count
+            aliases = {k: v for k, v in options.items() if k.startswith("@")}
+            keys = options.keys() - aliases.keys()
             if len(keys) > 1:
                 raise Exception(
                     f"When using '$expand: a: $count: ...' you can only specify $count, got: '{keys}'"
                 )
 
             url += "/$count"
-            options = options.get("$count")
+            options = {**options["$count"], **aliases}
 
         id = params.get("id")
 
@@ -984,6 +1808,13 @@ class PinejsClientCore(ABC):
 
             url += f"({value})"
 
+        if isinstance(options, ir.QueryOptions):
+            if len(options.options) == 0:
+                return url
+            out = [url, "?"]
+            run_steps(options.write_steps(out))
+            return "".join(out)
+
         query_options: List[str] = []
 
         if options is not None:
@@ -1008,3 +1839,342 @@ class PinejsClientCore(ABC):
         if key[0] == "$" and not is_valid_option(key):
             raise Exception(f"Unknown key option '{key}'")
         return build_option(key, value)
+
+
+class PinejsClientCore(PinejsClientBase, ABC):
+    single_flight_class = SingleFlight
+
+    def get(self, params: Params, max_url_length: Optional[int] = None) -> Any:
+        chunks = self.get_chunks(params, max_url_length)
+        if chunks is not None:
+            results = self.map_concurrently(
+                lambda p: self._fetch(cast(Params, p)), chunks.chunks
+            )
+            return chunks.merge(results)
+
+        entry = self.response_cache_entry(params)
+        found, cached = self.cached_response(entry)
+        if found:
+            return cached
+
+        def fetch() -> Any:
+            result = self._get_uncached(params)
+            self.cache_response(entry, result)
+            return result
+
+        key = self.request_key(params)
+        if key is None:
+            return fetch()
+        return self.single_flight.do(key, fetch)
+
+    def _get_uncached(self, params: Params) -> Any:
+        result = self.request({**params, "method": "GET"})
+        return self.transform_get_result(params)(result)
+
+    def _fetch(self, params: Params) -> Any:
+        # Streamed rows are read into a list for callers that need all of them
+        return materialize(self.get(params))
+
+    def _lookup(self, params: Params) -> Any:
+        # Lookups that decide what to write must see the current rows, so they
+        # skip the response cache and coalescing like the writes do
+        return materialize(self._get_uncached(params))
+
+    def put(self, params: Params) -> Any:
+        return self.request({**params, "method": "PUT"})
+
+    def patch(self, params: Params) -> Any:
+        return self.request({**params, "method": "PATCH"})
+
+    def post(self, params: Params) -> Any:
+        return self.request({**params, "method": "POST"})
+
+    def delete(self, params: Params) -> Any:
+        return self.request({**params, "method": "DELETE"})
+
+    def get_or_create(self, params: GetOrCreateParams) -> Any:
+        get_params, post_params = self.get_or_create_params(params)
+
+        result = self.get(get_params)
+
+        if result is not None:
+            return result
+
+        return self.post(post_params)
+
+    def upsert(self, params: UpsertParams) -> Any:
+        post_params, patch_params = self.upsert_params(params)
+
+        looked_up = self.upsert_order(params) == LOOKUP_FIRST
+        if looked_up and len(self._lookup(self.upsert_lookup_params(params))) > 0:
+            self.record_upsert(params, looked_up, False, True)
+            return self.patch(patch_params)
+
+        try:
+            result = self.post(post_params)
+        except Exception as e:
+            if not is_unique_violation(e):
+                raise e
+
+            self.record_upsert(params, looked_up, True, True)
+            return self.patch(patch_params)
+        self.record_upsert(params, looked_up, True, False)
+        return result
+
+    def get_or_create_many(
+        self, params: BulkParams, chunk_size: int = 500
+    ) -> List[Any]:
+        items = BulkItems(cast(AnyObject, params), chunk_size)
+        lookups = items.lookup_params(items.unique_keys())
+        for rows in self.map_concurrently(self._lookup, lookups):
+            items.found(rows)
+
+        def create(key: IdKey) -> None:
+            try:
+                items.set_result(key, self.post(cast(Params, items.post_params(key))))
+            except Exception as e:
+                if not is_unique_violation(e):
+                    raise e
+                # Created by someone else since it was looked up
+                rows = self._lookup(items.lookup_params([key])[0])
+                if len(rows) == 0:
+                    raise e
+                items.found(rows)
+
+        self.map_concurrently(create, items.missing())
+        return items.ordered_results()
+
+    def upsert_many(
+        self, params: BulkParams, chunk_size: int = 500, batch: bool = False
+    ) -> List[Any]:
+        # Finds which keys exist up front, so existing rows are PATCHed right
+        # away instead of after a POST that fails
+        items = BulkItems(cast(AnyObject, params), chunk_size)
+        lookups = items.lookup_params(items.unique_keys(), key_only=True)
+        for rows in self.map_concurrently(self._lookup, lookups):
+            items.found(rows)
+        writes = items.writes()
+
+        def fallback(key: IdKey, e: Exception) -> None:
+            if not is_unique_violation(e):
+                raise e
+            # Created by someone else since it was looked up
+            items.set_result(key, self.patch(cast(Params, items.patch_params(key))))
+
+        def write(item: Tuple[IdKey, bool]) -> None:
+            key, exists = item
+            if exists:
+                result = self.patch(cast(Params, items.patch_params(key)))
+                items.set_result(key, result)
+                return
+            try:
+                items.set_result(key, self.post(cast(Params, items.post_params(key))))
+            except Exception as e:
+                fallback(key, e)
+
+        if not batch:
+            self.map_concurrently(write, writes)
+            return items.ordered_results()
+
+        for chunk in chunks(writes, chunk_size):
+            with self.batch() as requests:
+                operations = [
+                    (
+                        key,
+                        (
+                            requests.patch(items.patch_params(key))
+                            if exists
+                            else requests.post(items.post_params(key))
+                        ),
+                    )
+                    for key, exists in chunk
+                ]
+            for key, operation in operations:
+                try:
+                    items.set_result(key, operation.result())
+                except Exception as e:
+                    if operation.method != "POST":
+                        raise e
+                    fallback(key, e)
+        return items.ordered_results()
+
+    def iter(
+        self,
+        params: Params,
+        page_size: int = 1000,
+        key: Key = "id",
+        keyset: bool = False,
+        cursor: Optional[str] = None,
+        prefetch: int = 1,
+    ) -> Iterator[Any]:
+        # Validates eagerly, rows are then fetched one page at a time
+        return self.iter_rows(
+            self.pages(params, page_size, key, keyset, cursor, prefetch)
+        )
+
+    def iter_rows(self, pages: Pages) -> Iterator[Any]:
+        for page in self.iter_pages(pages):
+            for row in page:
+                pages.mark(row)
+                yield row
+
+    def iter_pages(self, pages: Pages) -> Iterator[List[Any]]:
+        if pages.prefetch > 1:
+            yield from self.prefetch_pages(pages)
+            return
+        while True:
+            params = pages.next_params()
+            if params is None:
+                return
+            rows = self._fetch(cast(Params, params))
+            pages.advance(rows)
+            if len(rows) > 0:
+                yield rows
+
+    def prefetch_pages(self, pages: Pages) -> Iterator[List[Any]]:
+        # Keeps `pages.prefetch` requests in flight assuming every page is
+        # full, pages past a short one are then discarded
+        offset = pages.fetched
+        in_flight: Deque[Future] = deque()
+        executor = ThreadPoolExecutor(max_workers=pages.prefetch)
+        try:
+            while True:
+                while len(in_flight) < pages.prefetch:
+                    params = pages.params_at(offset)
+                    if params is None:
+                        break
+                    in_flight.append(executor.submit(self._fetch, params))
+                    offset += pages.page_size
+                if len(in_flight) == 0:
+                    return
+                rows = in_flight.popleft().result()
+                pages.advance(rows)
+                if len(rows) > 0:
+                    yield rows
+                if pages.done:
+                    return
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def partition(
+        self, params: Params, partitions: int = 4, by: str = "id", key: str = "id"
+    ) -> List[Params]:
+        # Splits the collection into disjoint ranges of `by` holding about the
+        # same number of rows, rows with a null `by` go in the last one.
+        # Partition counts are validated before any request is made
+        partition_offsets(0, partitions)
+        count = self._fetch(cast(Params, count_params(cast(AnyObject, params))))
+        offsets = partition_offsets(count, partitions)
+        probes = self.map_concurrently(
+            lambda offset: self._fetch(
+                cast(Params, probe_params(cast(AnyObject, params), by, offset))
+            ),
+            offsets,
+        )
+        bounds = [rows[0][by] if len(rows) > 0 else None for rows in probes]
+        return cast(
+            List[Params],
+            partition_params(cast(AnyObject, params), by, bounds, by != key),
+        )
+
+    def scan(
+        self,
+        params: Params,
+        partitions: int = 4,
+        by: str = "id",
+        key: str = "id",
+        page_size: int = 1000,
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Any]:
+        # Rows come in no particular order across partitions
+        pages = [
+            self.pages(p, page_size, key, keyset=True)
+            for p in self.partition(params, partitions, by, key)
+        ]
+        return self.scan_rows(pages, concurrency or self.max_concurrency)
+
+    def scan_rows(self, partitions: List[Pages], concurrency: int) -> Iterator[Any]:
+        for page in self.scan_pages(partitions, concurrency):
+            yield from page
+
+    def scan_pages(
+        self, partitions: List[Pages], concurrency: int
+    ) -> Iterator[List[Any]]:
+        # Each partition is paged by its own worker, at most `concurrency`
+        # pages wait in the queue for the caller
+        results: "Queue[Tuple[str, Any]]" = Queue(maxsize=concurrency)
+        stopped = threading.Event()
+
+        def scan(pages: Pages) -> None:
+            try:
+                for page in self.iter_pages(pages):
+                    if stopped.is_set():
+                        return
+                    results.put(("page", page))
+                results.put(("done", None))
+            except Exception as e:
+                results.put(("error", e))
+
+        executor = ThreadPoolExecutor(max_workers=min(concurrency, len(partitions)))
+        futures = [executor.submit(scan, pages) for pages in partitions]
+        try:
+            remaining = len(partitions)
+            while remaining > 0:
+                kind, value = results.get()
+                if kind == "page":
+                    yield value
+                elif kind == "done":
+                    remaining -= 1
+                else:
+                    raise value
+        finally:
+            stopped.set()
+            for future in futures:
+                future.cancel()
+            # Unblock the workers waiting to queue a page
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.01)
+                except Empty:
+                    pass
+            executor.shutdown()
+
+    def batch(self) -> Batch:
+        return Batch(
+            self.request_args,
+            self.transform_get_result,
+            self.api_prefix + "$batch",
+            self._request,
+            self.invalidate_response_cache,
+        )
+
+    def loader(
+        self,
+        window: float = 0.005,
+        max_batch_size: int = 100,
+        max_url_length: Optional[int] = None,
+    ) -> Loader:
+        return Loader(self, window, max_batch_size, max_url_length)
+
+    def map_concurrently(self, fn: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+        if len(items) <= 1 or self.max_concurrency <= 1:
+            return [fn(item) for item in items]
+        workers = min(self.max_concurrency, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(fn, items))
+
+    def request(self, params: Params) -> Any:
+        method, url, body = self.request_args(params)
+        if method == "GET":
+            return self._request(method=method, url=url, body=body)
+        try:
+            return self._request(method=method, url=url, body=body)
+        finally:
+            # Also when the write failed, as it may still have been applied
+            self.invalidate_response_cache(params)
+
+    @abstractmethod
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        pass
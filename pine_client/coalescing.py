@@ -0,0 +1,101 @@
+from copy import deepcopy
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+
+from .streaming import is_async_stream, is_stream
+
+
+def is_shareable(value: Any) -> bool:
+    # Streamed rows can only be read by the caller that started the request
+    return not is_stream(value) and not is_async_stream(value)
+
+
+class Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share the first caller's call, the
+    # others wait for its result or exception instead of making their own
+    def __init__(self) -> None:
+        self.coalesced = 0
+        self._calls: Dict[Hashable, Call] = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = Call()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        if not is_shareable(call.result):
+            return fn()
+        # Every caller gets its own copy to mutate
+        return deepcopy(call.result)
+
+
+class AsyncSingleFlight:
+    def __init__(self) -> None:
+        self.coalesced = 0
+        self._calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self.lead(key, fn)
+            self.coalesced += 1
+            try:
+                # Shielded so a waiter being cancelled does not cancel the
+                # request the other waiters share
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller leading the request was cancelled, retry
+                continue
+            if not is_shareable(result):
+                return await fn()
+            return deepcopy(result)
+
+    async def lead(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        # Marks the exception as retrieved when no other caller waited for it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,529 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from types import GeneratorType
+from typing import Any, Generator, Hashable, List, Optional, Sequence, Tuple, Union
+
+from .utils import (
+    AliasReference,
+    Placeholder,
+    escape_resource,
+    escape_value,
+    escape_value_list,
+    format_escaped,
+    is_valid_option,
+    scalar_key,
+)
+
+# A typed representation of query options between the options dicts and the
+# url. Nodes are validated when they are built, leaves render their part of
+# the url once and every node caches its hash, so a tree can be reused and
+# cached without looking at the options again. Like the dict compiler, nodes
+# are written through steps (see `run_steps`) so trees of any depth can be
+# serialised, hashed and compared without recursion.
+
+PropertyPath = Union[str, Sequence[str]]
+
+primitive_types = (str, int, float, bool, datetime, Placeholder, AliasReference)
+
+
+def to_path(path: PropertyPath) -> Tuple[str, ...]:
+    parts = (path,) if isinstance(path, str) else tuple(path)
+    if len(parts) == 0 or not all(isinstance(p, str) and len(p) > 0 for p in parts):
+        raise Exception(f"Property paths must be non empty strings, got: {path}")
+    return parts
+
+
+def literal_key(value: Any) -> Hashable:
+    if value is not None and not isinstance(value, primitive_types):
+        raise Exception(
+            f"Expected None/str/int/float/bool/datetime, got: {type(value)}"
+        )
+    return scalar_key(value)
+
+
+def nodes_equal(a: "Node", b: "Node") -> bool:
+    stack: List[Tuple[Any, Any]] = [(a, b)]
+    while len(stack) > 0:
+        x, y = stack.pop()
+        if x is y:
+            continue
+        if isinstance(x, Node):
+            if type(x) is not type(y) or x._hash != y._hash:
+                return False
+            stack.append((x._key, y._key))
+        elif isinstance(x, tuple):
+            if not isinstance(y, tuple) or len(x) != len(y):
+                return False
+            stack.extend(zip(x, y))
+        elif x != y:
+            return False
+    return True
+
+
+class Node:
+    __slots__ = ("_key", "_hash")
+    fields: Tuple[str, ...] = ()
+
+    def freeze(self, *key: Any) -> None:
+        # Child nodes in the key already cached their hash, so hashing a node
+        # never recurses into its children
+        self._key = key
+        self._hash = hash((type(self), key))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Node):
+            return NotImplemented
+        return nodes_equal(self, other)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.fields)
+        return f"{type(self).__name__}({fields})"
+
+
+class FilterNode(Node, ABC):
+    __slots__ = ("count",)
+
+    @abstractmethod
+    def write_steps(self, out: List[str]) -> Any:
+        pass
+
+
+class FilterLeaf(FilterNode):
+    __slots__ = ("text",)
+
+    def write_steps(self, out: List[str]) -> None:
+        out.append(self.text)
+
+
+class Compare(FilterLeaf):
+    __slots__ = ("path", "operator", "value")
+    fields = ("path", "operator", "value")
+
+    def __init__(self, path: PropertyPath, operator: str, value: Any):
+        self.path = to_path(path)
+        if not isinstance(operator, str) or not operator.isidentifier():
+            raise Exception(f"Comparison operators must be names, got: '{operator}'")
+        self.operator = operator
+        self.value = value
+        self.freeze(self.path, operator, literal_key(value))
+        self.text = (
+            f"{escape_resource(list(self.path))} {operator} "
+            f"{format_escaped(escape_value(value))}"
+        )
+        self.count = 3
+
+
+class In(FilterLeaf):
+    __slots__ = ("path", "values")
+    fields = ("path", "values")
+
+    def __init__(self, path: PropertyPath, values: Sequence[Any]):
+        self.path = to_path(path)
+        self.values = tuple(values)
+        if len(self.values) == 0:
+            raise Exception("In must have at least 1 value")
+        self.freeze(self.path, tuple(literal_key(v) for v in self.values))
+        in_str = escape_value_list(list(self.values))
+        if in_str is None:
+            in_str = ", ".join(f"{escape_value(v)}" for v in self.values)
+        self.text = f"{escape_resource(list(self.path))} in ({in_str})"
+        self.count = 3
+
+
+class Call(FilterLeaf):
+    __slots__ = ("function", "path", "value")
+    fields = ("function", "path", "value")
+
+    def __init__(self, function: str, path: PropertyPath, value: Any):
+        if not isinstance(function, str) or len(function) == 0 or "$" in function:
+            raise Exception(f"Function names must be non empty, got: '{function}'")
+        self.function = function
+        self.path = to_path(path)
+        self.value = value
+        self.freeze(function, self.path, literal_key(value))
+        operands = [escape_resource(list(self.path))]
+        escaped = escape_value(value)
+        if escaped is not None:
+            operands.append(f"{escaped}")
+        self.text = f"{function}({','.join(operands)})"
+        self.count = 1
+
+
+class Raw(FilterLeaf):
+    __slots__ = ("filter",)
+    fields = ("filter",)
+
+    def __init__(self, filter: str):
+        if not isinstance(filter, str):
+            raise Exception(f"Raw filters must be a string, got: {type(filter)}")
+        self.filter = filter
+        self.freeze(filter)
+        self.text = f"({filter})"
+        self.count = 1
+
+
+class Fragment(FilterLeaf):
+    # An already compiled filter, for filters that have no dedicated node
+    __slots__ = ()
+    fields = ("text", "count")
+
+    def __init__(self, text: str, count: int):
+        self.text = text
+        self.count = count
+        self.freeze(text, count)
+
+
+class Junction(FilterNode):
+    __slots__ = ("children",)
+    fields = ("children",)
+    separator = ""
+
+    def __init__(self, *children: FilterNode):
+        if len(children) == 0:
+            raise Exception(f"{type(self).__name__} must have at least 1 filter")
+        for child in children:
+            if not isinstance(child, FilterNode):
+                raise Exception(f"Expected a filter node, got: {type(child)}")
+            if len(children) > 1 and child.count == 0:
+                raise Exception("Cannot join an empty filter")
+        self.children = children
+        self.freeze(children)
+        self.count = children[0].count if len(children) == 1 else 2 * len(children) - 1
+
+    def write_steps(self, out: List[str]) -> Any:
+        if len(self.children) == 1:
+            return self.children[0].write_steps(out)
+        return self.write_children_steps(out)
+
+    def write_children_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        for index, child in enumerate(self.children):
+            if index != 0:
+                out.append(self.separator)
+            if child.count > 1:
+                out.append("(")
+            steps = child.write_steps(out)
+            if isinstance(steps, GeneratorType):
+                yield steps
+            if child.count > 1:
+                out.append(")")
+
+
+class And(Junction):
+    __slots__ = ()
+    separator = " and "
+
+
+class Or(Junction):
+    __slots__ = ()
+    separator = " or "
+
+
+class Not(FilterNode):
+    __slots__ = ("filter",)
+    fields = ("filter",)
+
+    def __init__(self, filter: FilterNode):
+        if not isinstance(filter, FilterNode):
+            raise Exception(f"Expected a filter node, got: {type(filter)}")
+        self.filter = filter
+        self.freeze(filter)
+        self.count = 1
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        out.append("not(")
+        yield self.filter.write_steps(out)
+        out.append(")")
+
+
+class Lambda(FilterNode):
+    __slots__ = ("path", "kind", "alias", "expr")
+    fields = ("path", "kind", "alias", "expr")
+
+    def __init__(self, path: PropertyPath, kind: str, alias: str, expr: FilterNode):
+        self.path = to_path(path)
+        if kind not in ("any", "all"):
+            raise Exception(f"Lambda kinds must be 'any' or 'all', got: '{kind}'")
+        if not isinstance(alias, str) or len(alias) == 0:
+            raise Exception(f"Lambda expression ({kind}) has no alias defined.")
+        if not isinstance(expr, FilterNode):
+            raise Exception(f"Expected a filter node, got: {type(expr)}")
+        self.kind = kind
+        self.alias = alias
+        self.expr = expr
+        self.freeze(self.path, kind, alias, expr)
+        self.count = 3
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        out.append(f"{escape_resource(list(self.path))}/{self.kind}({self.alias}:")
+        yield self.expr.write_steps(out)
+        out.append(")")
+
+
+class Option(Node, ABC):
+    __slots__ = ("name",)
+
+    @abstractmethod
+    def write_steps(self, out: List[str]) -> Any:
+        pass
+
+
+class RenderedOption(Option):
+    __slots__ = ("text",)
+
+    def write_steps(self, out: List[str]) -> None:
+        out.append(self.text)
+
+
+class FilterOption(Option):
+    __slots__ = ("filter",)
+    fields = ("filter",)
+
+    def __init__(self, filter: FilterNode):
+        if not isinstance(filter, FilterNode):
+            raise Exception(f"Expected a filter node, got: {type(filter)}")
+        self.name = "$filter"
+        self.filter = filter
+        self.freeze(filter)
+
+    def write_steps(self, out: List[str]) -> Any:
+        out.append("$filter=")
+        return self.filter.write_steps(out)
+
+
+def count_options(options: Optional["QueryOptions"], usage: str) -> "QueryOptions":
+    options = QueryOptions() if options is None else options
+    if any(not isinstance(option, FilterOption) for option in options.options):
+        raise Exception(
+            f"Only $filter can be used in the $count of {usage}, got: {options.names}"
+        )
+    return options
+
+
+def write_options_suffix(
+    out: List[str], options: "QueryOptions"
+) -> Generator[Any, Any, None]:
+    if len(options.options) > 0:
+        out.append("(")
+        yield options.write_steps(out, ";")
+        out.append(")")
+
+
+class ExpandItem(Node):
+    __slots__ = ("path", "options", "count")
+    fields = ("path", "options", "count")
+
+    def __init__(
+        self,
+        path: str,
+        options: Optional["QueryOptions"] = None,
+        count: bool = False,
+    ):
+        if not isinstance(path, str) or len(path) == 0:
+            raise Exception(f"Expand paths must be non empty strings, got: '{path}'")
+        if count:
+            options = count_options(options, "an expand")
+        self.path = path
+        self.options = QueryOptions() if options is None else options
+        self.count = count
+        self.freeze(path, self.options, count)
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        out.append(escape_resource(self.path + "/$count" if self.count else self.path))
+        yield write_options_suffix(out, self.options)
+
+
+class ExpandOption(Option):
+    __slots__ = ("items",)
+    fields = ("items",)
+
+    def __init__(self, *items: Union[str, ExpandItem]):
+        if len(items) == 0:
+            raise Exception("$expand must have at least 1 item")
+        self.name = "$expand"
+        self.items = tuple(
+            ExpandItem(item) if isinstance(item, str) else item for item in items
+        )
+        self.freeze(self.items)
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        out.append("$expand=")
+        for index, item in enumerate(self.items):
+            if index != 0:
+                out.append(",")
+            yield item.write_steps(out)
+
+
+class OrderByItem(Node):
+    __slots__ = ("path", "direction", "count")
+    fields = ("path", "direction", "count")
+
+    def __init__(
+        self,
+        path: str,
+        direction: Optional[str] = None,
+        count: Optional["QueryOptions"] = None,
+    ):
+        if not isinstance(path, str) or len(path) == 0:
+            raise Exception(f"Order by paths must be non empty strings, got: '{path}'")
+        if direction not in (None, "asc", "desc"):
+            raise Exception("'$orderby' direction must be 'asc' or 'desc'")
+        if count is not None:
+            if direction is None:
+                raise Exception("Ordering by a $count needs a direction")
+            count = count_options(count, "an order by")
+        self.path = path
+        self.direction = direction
+        self.count = count
+        self.freeze(path, direction, count)
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        if self.count is None:
+            out.append(self.path)
+        else:
+            out.append(escape_resource(self.path + "/$count"))
+            yield write_options_suffix(out, self.count)
+        if self.direction is not None:
+            out.append(f" {self.direction}")
+
+
+class OrderByOption(Option):
+    __slots__ = ("items",)
+    fields = ("items",)
+
+    def __init__(self, *items: Union[str, OrderByItem]):
+        if len(items) == 0:
+            raise Exception("'$orderby' arrays have to have at least 1 element")
+        self.name = "$orderby"
+        self.items = tuple(
+            OrderByItem(item) if isinstance(item, str) else item for item in items
+        )
+        self.freeze(self.items)
+
+    def write_steps(self, out: List[str]) -> Generator[Any, Any, None]:
+        out.append("$orderby=")
+        for index, item in enumerate(self.items):
+            if index != 0:
+                out.append(",")
+            yield item.write_steps(out)
+
+
+class SelectOption(RenderedOption):
+    __slots__ = ("properties",)
+    fields = ("properties",)
+
+    def __init__(self, *properties: str):
+        if len(properties) == 0:
+            raise Exception("'$select' arrays have to have at least 1 element")
+        if not all(isinstance(p, str) and len(p) > 0 for p in properties):
+            raise Exception(
+                f"'$select' properties must be non empty strings, got: {properties}"
+            )
+        self.name = "$select"
+        self.properties = properties
+        self.freeze(properties)
+        self.text = f"$select={','.join(properties)}"
+
+
+class NumberOption(RenderedOption):
+    __slots__ = ("value",)
+    fields = ("value",)
+    option = ""
+
+    def __init__(self, value: int):
+        if not isinstance(value, int):
+            raise Exception(f"'{self.option}' option has to be a number")
+        self.name = self.option
+        self.value = value
+        self.freeze(scalar_key(value))
+        self.text = f"{self.option}={value}"
+
+
+class TopOption(NumberOption):
+    __slots__ = ()
+    option = "$top"
+
+
+class SkipOption(NumberOption):
+    __slots__ = ()
+    option = "$skip"
+
+
+typed_options = frozenset(
+    ["$filter", "$expand", "$orderby", "$select", "$top", "$skip"]
+)
+
+
+class CustomOption(RenderedOption):
+    __slots__ = ("value",)
+    fields = ("name", "value")
+
+    def __init__(self, name: str, value: Union[str, int, float, bool, Sequence[str]]):
+        if not isinstance(name, str) or len(name) == 0 or name[0] == "@":
+            raise Exception(f"Custom option names must be non empty, got: '{name}'")
+        if name in typed_options:
+            raise Exception(f"Use the dedicated node for the '{name}' option")
+        if name[0] == "$" and not is_valid_option(name):
+            raise Exception(f"Unknown key option '{name}'")
+        if isinstance(value, bool):
+            text = "true" if value else "false"
+        elif isinstance(value, (str, int, float)):
+            text = f"{value}"
+        elif isinstance(value, (list, tuple)) and all(
+            isinstance(v, str) for v in value
+        ):
+            value = tuple(value)
+            text = ",".join(value)
+        else:
+            raise Exception(f"Unknown type for option {type(value)}")
+        self.name = name
+        self.value = value
+        self.freeze(name, value if isinstance(value, tuple) else scalar_key(value))
+        self.text = f"{name}={text}"
+
+
+class ParameterAliasOption(RenderedOption):
+    __slots__ = ("alias", "value")
+    fields = ("alias", "value")
+
+    def __init__(self, alias: str, value: Any):
+        if not isinstance(alias, str) or len(alias) == 0:
+            raise Exception(f"Parameter alias names must be non empty, got: '{alias}'")
+        self.name = f"@{alias}"
+        self.alias = alias
+        self.value = value
+        self.freeze(alias, literal_key(value))
+        self.text = f"@{alias}={escape_value(value)}"
+
+
+class QueryOptions(Node):
+    __slots__ = ("options", "count")
+    fields = ("options", "count")
+
+    def __init__(self, *options: Option, count: bool = False):
+        names = set()
+        for option in options:
+            if not isinstance(option, Option):
+                raise Exception(f"Expected an option node, got: {type(option)}")
+            if option.name in names:
+                raise Exception(f"The '{option.name}' option is used more than once")
+            names.add(option.name)
+        self.options = options
+        self.count = count
+        self.freeze(options, count)
+
+    @property
+    def names(self) -> List[str]:
+        return [option.name for option in self.options]
+
+    def write_steps(
+        self, out: List[str], separator: str = "&"
+    ) -> Generator[Any, Any, None]:
+        for index, option in enumerate(self.options):
+            if index != 0:
+                out.append(separator)
+            steps = option.write_steps(out)
+            if isinstance(steps, GeneratorType):
+                yield steps
@@ -0,0 +1,278 @@
+from copy import deepcopy
+from threading import Event, Lock
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import asyncio
+
+from .cache import Unhashable, structural_key
+from .streaming import materialize, materialize_async
+
+AnyObject = Dict[str, Any]
+IdKey = Tuple[Any, ...]
+
+# Options that change which rows a request by id returns, or how many
+unbatchable_options = ("$top", "$skip", "$orderby", "$count")
+
+
+def is_json_scalar(value: Any) -> bool:
+    # Only ids that rows can come back with, anything else such as datetimes
+    # would never match the JSON values of the returned rows
+    return type(value) in (str, int, float)
+
+
+def normalize_key(values: IdKey) -> IdKey:
+    # A key can be asked for with a different type than the JSON value rows
+    # come back with, eg '5' for an integer id, so both sides are compared as
+    # the same strings
+    return tuple(
+        str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+        for v in values
+    )
+
+
+def id_fields(params: AnyObject) -> Optional[Tuple[Tuple[str, ...], IdKey]]:
+    # The key properties and values of a get by id that can be batched
+    id = params.get("id")
+    if isinstance(id, dict):
+        if len(id) == 0 or "@" in id:
+            return None
+        fields = tuple(sorted(id.keys()))
+        values = tuple(id[field] for field in fields)
+    else:
+        fields, values = ("id",), (id,)
+    if not all(is_json_scalar(value) for value in values):
+        return None
+    return fields, values
+
+
+def batch_key(
+    params: AnyObject, api_prefix: str
+) -> Optional[Tuple[Hashable, Tuple[str, ...], IdKey]]:
+    # Gets that only differ by id are loaded together
+    if params.get("url") is not None or params.get("id") is None:
+        return None
+    resource = params.get("resource")
+    if not isinstance(resource, str) or "/" in resource:
+        return None
+    options = params.get("options") or {}
+    if not isinstance(options, dict) or any(o in options for o in unbatchable_options):
+        return None
+    ids = id_fields(params)
+    if ids is None:
+        return None
+    fields, values = ids
+    try:
+        key = structural_key(
+            [params.get("api_prefix", api_prefix), resource, list(fields), options]
+        )
+    except Unhashable:
+        return None
+    return key, fields, values
+
+
+def batch_params(
+    params: AnyObject, fields: Tuple[str, ...], ids: List[IdKey]
+) -> Tuple[AnyObject, List[str]]:
+    # Returns the params of one request for all the ids, and the key fields
+    # that had to be added to $select to match rows back to their ids
+    if len(fields) == 1:
+        ids_filter: Any = {fields[0]: {"$in": [values[0] for values in ids]}}
+    else:
+        ids_filter = {"$or": [dict(zip(fields, values)) for values in ids]}
+        if len(ids) == 1:
+            ids_filter = ids_filter["$or"][0]
+    options = dict(params.get("options") or {})
+    filter = options.get("$filter")
+    options["$filter"] = (
+        ids_filter if filter is None else {"$and": [filter, ids_filter]}
+    )
+
+    added: List[str] = []
+    select = options.get("$select")
+    if select is not None:
+        select = [select] if isinstance(select, str) else list(select)
+        added = [field for field in fields if field not in select]
+        options["$select"] = select + added
+    result = {k: v for k, v in params.items() if k != "id"}
+    return {**result, "options": options}, added
+
+
+def fan_out(
+    rows: List[Any], fields: Tuple[str, ...], added: List[str]
+) -> Dict[IdKey, List[Any]]:
+    # Rows by their normalized key, rows with a null key cannot match any
+    by_id: Dict[IdKey, List[Any]] = {}
+    for row in rows:
+        values = tuple(row.get(field) for field in fields)
+        if not all(is_json_scalar(value) for value in values):
+            continue
+        key = normalize_key(values)
+        if len(added) > 0:
+            row = {k: v for k, v in row.items() if k not in added}
+        by_id.setdefault(key, []).append(row)
+    return by_id
+
+
+def single_result(by_id: Dict[IdKey, List[Any]], values: IdKey) -> Any:
+    # Matches what transform_get_result does for singular requests
+    rows = by_id.get(normalize_key(values), [])
+    if len(rows) > 1:
+        raise Exception("Returned multiple results when only one was expected.")
+    return rows[0] if len(rows) == 1 else None
+
+
+class PendingLoad:
+    __slots__ = ("params", "fields", "ids", "full", "done", "by_id", "error", "seen")
+
+    def __init__(self, params: AnyObject, fields: Tuple[str, ...]):
+        self.params = params
+        self.fields = fields
+        self.ids: List[IdKey] = []
+        self.full = Event()
+        self.done = Event()
+        self.by_id: Dict[IdKey, List[Any]] = {}
+        self.error: Optional[BaseException] = None
+        self.seen: Dict[IdKey, int] = {}
+
+    def add(self, values: IdKey, max_batch_size: int) -> None:
+        key = normalize_key(values)
+        if key not in self.seen:
+            self.ids.append(values)
+        self.seen[key] = self.seen.get(key, 0) + 1
+        if len(self.ids) >= max_batch_size:
+            self.full.set()
+
+    def request(self) -> Tuple[AnyObject, List[str]]:
+        return batch_params(self.params, self.fields, self.ids)
+
+    def resolve(self, rows: List[Any], added: List[str]) -> None:
+        self.by_id = fan_out(rows, self.fields, added)
+
+    def claim(self, values: IdKey) -> bool:
+        # Whether the caller has to copy the row, as other callers that asked
+        # for the same id are still to get it. Not thread safe on its own
+        key = normalize_key(values)
+        self.seen[key] -= 1
+        return self.seen[key] > 0
+
+    def result(self, values: IdKey, copy: bool) -> Any:
+        if self.error is not None:
+            raise self.error
+        result = single_result(self.by_id, values)
+        return deepcopy(result) if copy else result
+
+
+class Loader:
+    # Collects gets by id made from several threads within `window` seconds
+    # and loads them with a single `$in` request. Anything else is passed
+    # through to the client as is
+    def __init__(
+        self,
+        client: Any,
+        window: float = 0.005,
+        max_batch_size: int = 100,
+        max_url_length: Optional[int] = None,
+    ):
+        if max_batch_size < 1:
+            raise Exception(f"max_batch_size must be at least 1, got: {max_batch_size}")
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_url_length = max_url_length
+        self.batches = 0
+        self._pending: Dict[Hashable, PendingLoad] = {}
+        self._lock = Lock()
+
+    def get(self, params: AnyObject) -> Any:
+        key = batch_key(params, self.client.api_prefix)
+        if key is None:
+            return self.client.get(params)
+        batch_id, fields, values = key
+
+        with self._lock:
+            pending = self._pending.get(batch_id)
+            leader = pending is None
+            if pending is None:
+                pending = self._pending[batch_id] = PendingLoad(params, fields)
+            pending.add(values, self.max_batch_size)
+            if pending.full.is_set():
+                del self._pending[batch_id]
+
+        if leader:
+            pending.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(batch_id) is pending:
+                    del self._pending[batch_id]
+            try:
+                request, added = pending.request()
+                self.batches += 1
+                rows = self.client.get(request, max_url_length=self.max_url_length)
+                pending.resolve(materialize(rows), added)
+            except BaseException as e:
+                pending.error = e
+            pending.done.set()
+        else:
+            pending.done.wait()
+        with self._lock:
+            copy = pending.claim(values)
+        return pending.result(values, copy)
+
+
+class AsyncLoader:
+    # Collects gets by id made in the same event loop iteration, or within
+    # `window` seconds when it is set
+    def __init__(
+        self,
+        client: Any,
+        window: float = 0,
+        max_batch_size: int = 100,
+        max_url_length: Optional[int] = None,
+    ):
+        if max_batch_size < 1:
+            raise Exception(f"max_batch_size must be at least 1, got: {max_batch_size}")
+        self.client = client
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_url_length = max_url_length
+        self.batches = 0
+        self._pending: Dict[Hashable, Tuple[PendingLoad, "asyncio.Future[Any]"]] = {}
+
+    async def get(self, params: AnyObject) -> Any:
+        key = batch_key(params, self.client.api_prefix)
+        if key is None:
+            return await self.client.get(params)
+        batch_id, fields, values = key
+
+        entry = self._pending.get(batch_id)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = (PendingLoad(params, fields), loop.create_future())
+            self._pending[batch_id] = entry
+            if self.window > 0:
+                loop.call_later(self.window, self.dispatch, batch_id, entry)
+            else:
+                loop.call_soon(self.dispatch, batch_id, entry)
+        pending, future = entry
+        pending.add(values, self.max_batch_size)
+        if pending.full.is_set():
+            self.dispatch(batch_id, entry)
+        await asyncio.shield(future)
+        return pending.result(values, pending.claim(values))
+
+    def dispatch(
+        self, batch_id: Hashable, entry: Tuple[PendingLoad, "asyncio.Future[Any]"]
+    ) -> None:
+        if self._pending.get(batch_id) is not entry:
+            # Already sent once it was full
+            return
+        del self._pending[batch_id]
+        self.batches += 1
+        asyncio.ensure_future(self.load(*entry))
+
+    async def load(self, pending: PendingLoad, future: "asyncio.Future[Any]") -> None:
+        try:
+            request, added = pending.request()
+            rows = await self.client.get(request, max_url_length=self.max_url_length)
+            pending.resolve(await materialize_async(rows), added)
+        except Exception as e:
+            pending.error = e
+        future.set_result(None)
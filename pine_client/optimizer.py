@@ -0,0 +1,249 @@
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .cache import Unhashable, structural_key
+
+AnyObject = Dict[str, Any]
+
+# ("and" | "or", [nodes]), ("not", node) or ("leaf", filter)
+Node = Tuple[str, Any]
+
+TRUE: Node = ("leaf", True)
+FALSE: Node = ("leaf", False)
+
+
+def is_property(key: str) -> bool:
+    return key[0] not in ("$", "@")
+
+
+def is_literal(node: Node, value: bool) -> bool:
+    return node[0] == "leaf" and node[1] is value
+
+
+def junction(kind: str, nodes: List[Node]) -> Node:
+    return (kind, nodes)
+
+
+def parse_node(
+    filter: Any, dict_junction: str = "and", list_junction: str = "or"
+) -> Node:
+    if isinstance(filter, dict):
+        return junction(
+            dict_junction, [parse_clause(key, value) for key, value in filter.items()]
+        )
+    elif isinstance(filter, list):
+        return junction(list_junction, [parse_node(value) for value in filter])
+    return ("leaf", filter)
+
+
+def split_path(key: str, value: Any) -> List[AnyObject]:
+    # `a: { b: 1, $ne: 2 }` compiles to `(a/b eq 1) and (a ne 2)` so it can be
+    # split into one single key clause per condition on the path
+    if not isinstance(value, dict) or len(value) == 0:
+        return [{key: value}]
+    clauses: List[AnyObject] = []
+    for sub_key, sub_value in value.items():
+        if is_property(sub_key):
+            clauses.extend({key: clause} for clause in split_path(sub_key, sub_value))
+        else:
+            clauses.append({key: {sub_key: sub_value}})
+    return clauses
+
+
+def parse_clause(key: str, value: Any) -> Node:
+    if key == "$and":
+        return parse_node(value, "and", "and")
+    elif key == "$or":
+        return parse_node(value, "or", "or")
+    elif key == "$not":
+        return ("not", parse_node(value))
+    elif key in ("$any", "$all") and isinstance(value, dict) and "$expr" in value:
+        return ("leaf", {key: {**value, "$expr": optimize_expr(value["$expr"])}})
+    elif is_property(key):
+        clauses = split_path(key, value)
+        if len(clauses) > 1:
+            return junction("and", [parse_clause(key, c[key]) for c in clauses])
+        return ("leaf", {key: optimize_path_value(value)})
+    return ("leaf", {key: value})
+
+
+def optimize_path_value(value: Any) -> Any:
+    # Lambdas can be nested under a property path, `a: { $any: ... }`
+    if isinstance(value, dict) and len(value) == 1:
+        for key, sub_value in value.items():
+            if key in ("$any", "$all") and isinstance(sub_value, dict):
+                if "$expr" in sub_value:
+                    return {
+                        key: {**sub_value, "$expr": optimize_expr(sub_value["$expr"])}
+                    }
+            elif is_property(key):
+                return {key: optimize_path_value(sub_value)}
+    return value
+
+
+def node_key(node: Node) -> Optional[Hashable]:
+    try:
+        return structural_key(to_filter(node))
+    except Unhashable:
+        return None
+
+
+def eq_literal(node: Node) -> Optional[Tuple[Tuple[str, ...], List[Any]]]:
+    # Returns the property path and values of `path eq value`/`path in (...)`
+    # leaves, which can be merged into a single $in inside an $or
+    if node[0] != "leaf" or not isinstance(node[1], dict):
+        return None
+    path: List[str] = []
+    value: Any = node[1]
+    while isinstance(value, dict) and len(value) == 1:
+        key, sub_value = next(iter(value.items()))
+        if key == "$eq":
+            value = sub_value
+            break
+        elif key == "$in":
+            if len(path) == 0 or not isinstance(sub_value, list):
+                return None
+            if len(sub_value) == 0:
+                return None
+            if not all(is_mergeable(v) for v in sub_value):
+                return None
+            return tuple(path), sub_value
+        elif not is_property(key):
+            return None
+        path.append(key)
+        value = sub_value
+    if len(path) == 0 or not is_mergeable(value):
+        return None
+    return tuple(path), [value]
+
+
+def is_mergeable(value: Any) -> bool:
+    # `a eq null` and `a in (null)` differ and bools do not render in $in lists
+    return value is not None and not isinstance(value, (bool, dict, list))
+
+
+def in_leaf(path: Tuple[str, ...], values: List[Any]) -> Node:
+    filter: Any = {"$in": values}
+    for key in reversed(path):
+        filter = {key: filter}
+    return ("leaf", filter)
+
+
+def merge_eq_chains(nodes: List[Node]) -> List[Node]:
+    groups: Dict[Tuple[str, ...], List[Any]] = {}
+    counts: Dict[Tuple[str, ...], int] = {}
+    for node in nodes:
+        literal = eq_literal(node)
+        if literal is not None:
+            path, values = literal
+            groups.setdefault(path, []).extend(values)
+            counts[path] = counts.get(path, 0) + 1
+
+    result: List[Node] = []
+    for node in nodes:
+        literal = eq_literal(node)
+        if literal is None or counts[literal[0]] < 2:
+            result.append(node)
+            continue
+        path = literal[0]
+        if path in groups:
+            values = groups.pop(path)
+            unique = {(type(v), v): v for v in values}
+            result.append(in_leaf(path, list(unique.values())))
+    return result
+
+
+def simplify(node: Node) -> Node:
+    kind, value = node
+    if kind == "not":
+        child = simplify(value)
+        if is_literal(child, True):
+            return FALSE
+        if is_literal(child, False):
+            return TRUE
+        if child[0] == "not":
+            return child[1]
+        return ("not", child)
+    if kind == "leaf":
+        return node
+
+    absorbing = kind == "or"
+    children: List[Node] = []
+    seen = set()
+    stack = list(reversed(value))
+    while len(stack) > 0:
+        child = stack.pop()
+        if child[0] == kind:
+            # Flatten associative junctions
+            stack.extend(reversed(child[1]))
+            continue
+        child = simplify(child)
+        if child[0] == kind:
+            stack.extend(reversed(child[1]))
+            continue
+        if is_literal(child, absorbing):
+            return child
+        if is_literal(child, not absorbing):
+            continue
+        key = node_key(child)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        children.append(child)
+
+    if kind == "or":
+        children = merge_eq_chains(children)
+    if len(children) == 0:
+        return FALSE if absorbing else TRUE
+    if len(children) == 1:
+        return children[0]
+    return (kind, children)
+
+
+def to_filter(node: Node) -> Any:
+    kind, value = node
+    if kind == "leaf":
+        return value
+    elif kind == "not":
+        return {"$not": to_filter(value)}
+    return {f"${kind}": [to_filter(child) for child in value]}
+
+
+def optimize_filter(filter: Any) -> Any:
+    # Returns True when the filter always matches, which callers should treat
+    # as having no filter at all
+    node = simplify(parse_node(filter))
+    if is_literal(node, False):
+        return {"$raw": "false"}
+    return to_filter(node)
+
+
+def optimize_expr(expr: Any) -> Any:
+    optimized = optimize_filter(expr)
+    return expr if optimized is True else optimized
+
+
+def optimize_options(options: AnyObject) -> AnyObject:
+    result: AnyObject = {}
+    for key, value in options.items():
+        if key == "$filter":
+            value = optimize_filter(value)
+            if value is True:
+                continue
+        elif key == "$count" and isinstance(value, dict):
+            value = optimize_options(value)
+        elif key == "$expand":
+            value = optimize_expand(value)
+        result[key] = value
+    return result
+
+
+def optimize_expand(expand: Any) -> Any:
+    if isinstance(expand, list):
+        return [optimize_expand(value) for value in expand]
+    elif isinstance(expand, dict):
+        return {
+            key: optimize_options(value) if isinstance(value, dict) else value
+            for key, value in expand.items()
+        }
+    return expand
@@ -0,0 +1,311 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Dict, List, Optional, Union
+import json
+
+from .loader import is_json_scalar
+
+AnyObject = Dict[str, Any]
+Key = Union[str, List[str]]
+
+
+def order_by_properties(order_by: Any) -> List[str]:
+    if isinstance(order_by, str):
+        return [part.split()[0] for part in order_by.split(",") if part.strip()]
+    elif isinstance(order_by, list):
+        return [p for item in order_by for p in order_by_properties(item)]
+    elif isinstance(order_by, dict):
+        return [key for key in order_by.keys() if key != "$dir"]
+    return []
+
+
+def to_keys(key: Key) -> List[str]:
+    keys = [key] if isinstance(key, str) else list(key)
+    if len(keys) == 0 or not all(isinstance(k, str) and len(k) > 0 for k in keys):
+        raise Exception(
+            f"The pagination key must be a property or list of properties, got: {key}"
+        )
+    return keys
+
+
+def with_tiebreak(order_by: Any, keys: List[str]) -> Any:
+    # Rows that compare equal on the caller's order would otherwise be free to
+    # move between pages, so the unique key is always the last sort property
+    present = order_by_properties(order_by)
+    missing = [key for key in keys if key not in present]
+    if order_by is None:
+        return ",".join(keys)
+    if len(missing) == 0:
+        return order_by
+    if isinstance(order_by, list):
+        return order_by + missing
+    return [order_by] + missing
+
+
+def keyset_filter(keys: List[str], values: List[Any]) -> Any:
+    # `(a gt x) or ((a eq x) and (b gt y))`, ie everything after the last row
+    # in the lexicographic order of the keys
+    clauses: List[AnyObject] = []
+    for index, key in enumerate(keys):
+        clause: AnyObject = {k: v for k, v in zip(keys[:index], values)}
+        clause[key] = {"$gt": values[index]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def encode_cursor(keys: List[str], values: List[Any]) -> str:
+    # Values are stored as JSON, a datetime would come back as a string and
+    # resume by comparing the key with a string literal
+    for key, value in zip(keys, values):
+        if not is_json_scalar(value):
+            raise Exception(
+                f"Cannot create a cursor for the keyset key '{key}', "
+                f"expected a string or number, got: {type(value)}"
+            )
+    data = json.dumps({"k": keys, "v": values}, separators=(",", ":"))
+    return urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: List[str]) -> List[Any]:
+    try:
+        data = json.loads(urlsafe_b64decode(cursor.encode()))
+        cursor_keys, values = data["k"], data["v"]
+    except Exception:
+        raise Exception(f"Invalid pagination cursor: '{cursor}'")
+    if not isinstance(values, list) or len(values) != len(cursor_keys):
+        raise Exception(f"Invalid pagination cursor: '{cursor}'")
+    if not all(is_json_scalar(value) for value in values):
+        raise Exception(f"Invalid pagination cursor: '{cursor}'")
+    if cursor_keys != keys:
+        raise Exception(f"The cursor was created for the key {cursor_keys}, not {keys}")
+    return values
+
+
+class Pages:
+    can_prefetch = True
+
+    def __init__(self, params: AnyObject, page_size: int, key: Key = "id"):
+        if not isinstance(page_size, int) or page_size < 1:
+            raise Exception(f"page_size must be a positive integer, got: {page_size}")
+        options = params.get("options") or {}
+        if not isinstance(options, dict):
+            raise Exception("Cannot paginate requests whose options are query IR")
+        if params.get("url") is not None:
+            raise Exception("Cannot paginate requests that specify a url")
+        if params.get("id") is not None:
+            raise Exception("Cannot paginate requests for a single resource by id")
+        if "$count" in options or params["resource"].endswith("/$count"):
+            raise Exception("Cannot paginate $count requests")
+
+        self.keys = to_keys(key)
+        options = dict(options)
+        self.start: int = options.pop("$skip", 0)
+        self.top: Optional[int] = options.pop("$top", None)
+        options["$orderby"] = with_tiebreak(options.get("$orderby"), self.keys)
+        self.params = params
+        self.options = options
+        self.page_size = page_size
+        self.fetched = 0
+        self.done = False
+        # How many pages are requested at once
+        self.prefetch = 1
+
+    def size_at(self, offset: int) -> int:
+        if self.top is None:
+            return self.page_size
+        return min(self.page_size, self.top - offset)
+
+    def params_at(self, offset: int) -> Optional[AnyObject]:
+        # The page starting `offset` rows into the scan, which does not depend
+        # on the pages before it so several can be requested at once
+        size = self.size_at(offset)
+        if size <= 0:
+            return None
+        options = {**self.options, "$top": size}
+        if self.start + offset > 0:
+            options["$skip"] = self.start + offset
+        return {**self.params, "options": options}
+
+    def next_params(self) -> Optional[AnyObject]:
+        if self.done:
+            return None
+        return self.params_at(self.fetched)
+
+    def advance(self, rows: List[Any]) -> None:
+        self.fetched += len(rows)
+        if len(rows) < self.page_size:
+            # A short page is the last one
+            self.done = True
+
+    def mark(self, row: Any) -> None:
+        # Called with each row as it is handed to the caller
+        pass
+
+
+class KeysetPages(Pages):
+    # Seeks past the last row with a filter on the key instead of $skip, so
+    # the server can start each page from the key's index
+    can_prefetch = False
+
+    def __init__(
+        self,
+        params: AnyObject,
+        page_size: int,
+        key: Key = "id",
+        cursor: Optional[str] = None,
+    ):
+        options = params.get("options") or {}
+        if isinstance(options, dict):
+            if "$orderby" in options:
+                raise Exception(
+                    "Keyset pagination orders by its key and cannot use $orderby"
+                )
+            if "$skip" in options:
+                raise Exception("Keyset pagination cannot be combined with $skip")
+            select = options.get("$select")
+            if select is not None:
+                select = [select] if isinstance(select, str) else select
+                for k in to_keys(key):
+                    if k not in select:
+                        raise Exception(f"The keyset key '{k}' must be in $select")
+        super().__init__(params, page_size, key)
+        self.last: Optional[List[Any]] = None
+        self.seen: Optional[List[Any]] = None
+        if cursor is not None:
+            self.last = self.seen = decode_cursor(cursor, self.keys)
+
+    def key_values(self, row: Any) -> List[Any]:
+        values: List[Any] = []
+        for key in self.keys:
+            value = row.get(key)
+            if value is None:
+                raise Exception(
+                    f"The keyset key '{key}' is missing or null in a returned row"
+                )
+            values.append(value)
+        return values
+
+    def params_at(self, offset: int) -> Optional[AnyObject]:
+        raise Exception(
+            "Keyset pages cannot be prefetched as each page seeks from the one before"
+        )
+
+    def next_params(self) -> Optional[AnyObject]:
+        size = self.size_at(self.fetched)
+        if self.done or size <= 0:
+            return None
+        options = {**self.options, "$top": size}
+        if self.last is not None:
+            filter = keyset_filter(self.keys, self.last)
+            if self.options.get("$filter") is not None:
+                filter = {"$and": [self.options["$filter"], filter]}
+            options = {**self.options, "$filter": filter, "$top": size}
+        return {**self.params, "options": options}
+
+    def advance(self, rows: List[Any]) -> None:
+        if len(rows) > 0:
+            self.last = self.key_values(rows[-1])
+        super().advance(rows)
+
+    def mark(self, row: Any) -> None:
+        self.seen = self.key_values(row)
+
+    @property
+    def cursor(self) -> Optional[str]:
+        # Resumes after the last row handed to the caller
+        if self.seen is None:
+            return None
+        return encode_cursor(self.keys, self.seen)
+
+
+def paginate(
+    params: AnyObject,
+    page_size: int,
+    key: Key = "id",
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    prefetch: int = 1,
+) -> Pages:
+    if not isinstance(prefetch, int) or prefetch < 1:
+        raise Exception(f"prefetch must be a positive integer, got: {prefetch}")
+    pages = (
+        KeysetPages(params, page_size, key, cursor)
+        if keyset or cursor is not None
+        else Pages(params, page_size, key)
+    )
+    if prefetch > 1 and not pages.can_prefetch:
+        raise Exception("Keyset pagination cannot prefetch pages")
+    pages.prefetch = prefetch
+    return pages
+
+
+def check_partitionable(params: AnyObject) -> AnyObject:
+    options = params.get("options") or {}
+    if not isinstance(options, dict):
+        raise Exception("Cannot partition requests whose options are query IR")
+    for option in ("$orderby", "$skip", "$top", "$count"):
+        if option in options:
+            raise Exception(f"Partitioned scans cannot use {option}")
+    if params.get("url") is not None or params.get("id") is not None:
+        raise Exception("Partitioned scans need a resource collection")
+    return options
+
+
+def count_params(params: AnyObject) -> AnyObject:
+    filter = check_partitionable(params).get("$filter")
+    count = {} if filter is None else {"$filter": filter}
+    return {**params, "options": {"$count": count}}
+
+
+def probe_params(params: AnyObject, by: str, offset: int) -> AnyObject:
+    # The `by` value of the row `offset` rows into the ordered collection
+    options: AnyObject = {"$orderby": by, "$top": 1, "$select": by}
+    filter = check_partitionable(params).get("$filter")
+    if filter is not None:
+        options["$filter"] = filter
+    if offset > 0:
+        options["$skip"] = offset
+    return {**params, "options": options}
+
+
+def partition_offsets(count: int, partitions: int) -> List[int]:
+    # Quantiles of the row count, so partitions hold about as many rows each
+    # however the values are distributed. The first offset probes the minimum
+    if not isinstance(partitions, int) or partitions < 1:
+        raise Exception(f"partitions must be a positive integer, got: {partitions}")
+    return sorted({0} | {count * i // partitions for i in range(1, partitions)})
+
+
+def partition_params(
+    params: AnyObject, by: str, bounds: List[Any], nullable: bool
+) -> List[AnyObject]:
+    # `bounds` starts with the minimum, which would only give an empty range
+    options = check_partitionable(params)
+    # Nulls sort last, so a null bound means every later row is null too
+    if None in bounds:
+        bounds = bounds[: bounds.index(None)]
+    bounds = [b for i, b in enumerate(bounds) if i == 0 or b != bounds[i - 1]][1:]
+    if len(bounds) == 0:
+        return [params]
+
+    ranges: List[Any] = []
+    for index in range(len(bounds) + 1):
+        range_filter: AnyObject = {}
+        if index > 0:
+            range_filter["$ge"] = bounds[index - 1]
+        if index < len(bounds):
+            range_filter["$lt"] = bounds[index]
+        ranges.append({by: range_filter})
+    if nullable:
+        ranges[-1] = {"$or": [ranges[-1], {by: None}]}
+
+    filter = options.get("$filter")
+    return [
+        {
+            **params,
+            "options": {
+                **options,
+                "$filter": r if filter is None else {"$and": [filter, r]},
+            },
+        }
+        for r in ranges
+    ]
@@ -0,0 +1,51 @@
+from typing import Any, Dict, List
+
+from .utils import (
+    Placeholder,
+    escape_value,
+    format_escaped,
+    placeholder_token_regex,
+)
+
+
+def bind_value(value: Any, name: str) -> str:
+    if isinstance(value, (dict, list, Placeholder)):
+        raise Exception(
+            f"Placeholder '{name}' can only be bound to a primitive, got: {type(value)}"
+        )
+    return format_escaped(escape_value(value))
+
+
+class PreparedQuery:
+    __slots__ = ("params", "statics", "names")
+
+    def __init__(self, params: Dict[str, Any], url: str):
+        parts = placeholder_token_regex.split(url)
+        self.params = {k: v for k, v in params.items() if k != "options"}
+        self.statics: List[str] = parts[0::2]
+        self.names: List[str] = parts[1::2]
+
+    def url(self, **values: Any) -> str:
+        unknown = set(values.keys()).difference(self.names)
+        if len(unknown) > 0:
+            raise Exception(f"Unknown placeholders: {sorted(unknown)}")
+
+        result = [self.statics[0]]
+        for name, static in zip(self.names, self.statics[1:]):
+            if name not in values:
+                raise Exception(f"Missing value for placeholder '{name}'")
+            result.append(bind_value(values[name], name))
+            result.append(static)
+        return "".join(result)
+
+    def bind(self, **values: Any) -> Dict[str, Any]:
+        params = {**self.params, "url": self.url(**values)}
+        id = params.get("id")
+        if isinstance(id, Placeholder):
+            params["id"] = values[id.name]
+        elif isinstance(id, dict):
+            params["id"] = {
+                k: values[v.name] if isinstance(v, Placeholder) else v
+                for k, v in id.items()
+            }
+        return params
@@ -0,0 +1,243 @@
+from codecs import getincrementaldecoder
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+import json
+
+chunk_size = 64 * 1024
+whitespace = " \t\n\r"
+decoder = json.JSONDecoder()
+missing_d = "Invalid response received, the 'd' property is missing."
+
+Chunk = Union[bytes, str]
+
+
+def is_stream(value: Any) -> bool:
+    # File like objects, or iterators of bytes/str chunks
+    return hasattr(value, "read") or hasattr(value, "__next__")
+
+
+def is_async_stream(value: Any) -> bool:
+    return hasattr(value, "__aiter__")
+
+
+class RowParser:
+    # Incrementally parses `{"d": [...]}` from the chunks it is fed, so only
+    # the row being decoded is held in memory and never the whole response
+    def __init__(self) -> None:
+        self.text_decoder = getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.final = False
+        self.state = "object"
+        self.key: Any = None
+        # Whether `d` is an array, None until its first character is parsed
+        self.is_array: Optional[bool] = None
+        self.value: Any = None
+        self.done = False
+
+    def feed(self, chunk: Chunk, final: bool = False) -> List[Any]:
+        text = (
+            chunk
+            if isinstance(chunk, str)
+            else self.text_decoder.decode(chunk, final=final)
+        )
+        # Drop what was already parsed so the buffer only holds the current row
+        pos = self.pos
+        self.buffer = self.buffer[pos:] + text
+        self.pos = 0
+        self.final = final
+        rows: List[Any] = []
+        while not self.done and self.step(rows):
+            pass
+        if final and not self.done:
+            raise Exception("Invalid JSON in streamed response, it ended early")
+        return rows
+
+    def char(self) -> str:
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in whitespace:
+            self.pos += 1
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else ""
+
+    def decode(self) -> Tuple[bool, Any]:
+        self.char()
+        try:
+            value, end = decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if self.final:
+                raise
+            return False, None
+        # A number at the end of the buffer may continue in the next chunk
+        if end == len(self.buffer) and not self.final:
+            return False, None
+        self.pos = end
+        return True, value
+
+    def expect(self, chars: str) -> str:
+        char = self.char()
+        if char != "":
+            if char not in chars:
+                raise Exception(
+                    f"Invalid JSON in streamed response, expected one of '{chars}'"
+                )
+            self.pos += 1
+        return char
+
+    def step(self, rows: List[Any]) -> bool:
+        # Returns False when more input is needed
+        state = self.state
+        if state in ("key", "skip", "d_value", "row"):
+            ok, value = self.decode()
+            if not ok:
+                return False
+            if state == "key":
+                self.key = value
+                self.state = "colon"
+            elif state == "skip":
+                self.state = "next_key"
+            elif state == "d_value":
+                self.value = value
+                self.done = True
+            else:
+                rows.append(value)
+                self.state = "after_row"
+            return True
+
+        if state == "object":
+            char = self.char()
+            if char not in ("", "{"):
+                raise Exception("Response was not a JSON object")
+            char = self.expect("{")
+            self.state = "first_key"
+        elif state == "first_key":
+            char = self.char()
+            if char == "}":
+                raise Exception(missing_d)
+            self.state = "key"
+        elif state == "colon":
+            char = self.expect(":")
+            self.state = "d" if self.key == "d" else "skip"
+        elif state == "next_key":
+            char = self.expect(",}")
+            if char == "}":
+                raise Exception(missing_d)
+            self.state = "key"
+        elif state == "d":
+            char = self.char()
+            self.is_array = char == "["
+            if char == "[":
+                self.pos += 1
+                self.state = "first_row"
+            else:
+                self.state = "d_value"
+        elif state == "first_row":
+            char = self.char()
+            if char == "]":
+                self.done = True
+            self.state = "row"
+        else:
+            char = self.expect(",]")
+            if char == "]":
+                self.done = True
+            self.state = "row"
+        if char == "":
+            # Nothing was consumed, wait for more input
+            self.state = state
+            if state == "d":
+                self.is_array = None
+            return False
+        return True
+
+
+def iter_chunks(stream: Any) -> Iterator[Chunk]:
+    if hasattr(stream, "read"):
+        return iter(lambda: stream.read(chunk_size), stream.read(0))
+    return stream
+
+
+def close(stream: Any) -> None:
+    if hasattr(stream, "close"):
+        stream.close()
+
+
+def feed(parser: RowParser, chunks: Iterator[Chunk]) -> List[Any]:
+    chunk = next(chunks, None)
+    if chunk is None:
+        return parser.feed(b"", True)
+    return parser.feed(chunk)
+
+
+def decode_stream(stream: Any) -> Any:
+    # Returns the value of `d`, lazily as an iterator of rows when it is an array
+    parser = RowParser()
+    chunks = iter_chunks(stream)
+    pending: List[Any] = []
+    try:
+        while parser.is_array is None or (not parser.is_array and not parser.done):
+            pending += feed(parser, chunks)
+    except BaseException:
+        close(stream)
+        raise
+    if not parser.is_array:
+        close(stream)
+        return parser.value
+    return iter_rows(parser, chunks, pending, stream)
+
+
+def iter_rows(
+    parser: RowParser, chunks: Iterator[Chunk], pending: List[Any], stream: Any
+) -> Iterator[Any]:
+    try:
+        yield from pending
+        while not parser.done:
+            yield from feed(parser, chunks)
+    finally:
+        close(stream)
+
+
+async def feed_async(parser: RowParser, chunks: AsyncIterator[Chunk]) -> List[Any]:
+    try:
+        chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        return parser.feed(b"", True)
+    return parser.feed(chunk)
+
+
+async def decode_async_stream(stream: Any) -> Any:
+    # Async iterators of chunks, as returned by most asyncio http clients
+    parser = RowParser()
+    chunks = stream.__aiter__()
+    pending: List[Any] = []
+    while parser.is_array is None or (not parser.is_array and not parser.done):
+        pending += await feed_async(parser, chunks)
+    if not parser.is_array:
+        return parser.value
+    return aiter_rows(parser, chunks, pending)
+
+
+async def aiter_rows(
+    parser: RowParser, chunks: AsyncIterator[Chunk], pending: List[Any]
+) -> AsyncIterator[Any]:
+    for row in pending:
+        yield row
+    while not parser.done:
+        for row in await feed_async(parser, chunks):
+            yield row
+
+
+async def take(rows: AsyncIterator[Any], count: int) -> List[Any]:
+    result: List[Any] = []
+    async for row in rows:
+        result.append(row)
+        if len(result) == count:
+            break
+    return result
+
+
+def materialize(value: Any) -> Any:
+    # For internal callers that need the rows of a page as a list
+    return list(value) if is_stream(value) else value
+
+
+async def materialize_async(value: Any) -> Any:
+    if is_async_stream(value):
+        return [row async for row in value]
+    return materialize(value)
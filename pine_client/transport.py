@@ -0,0 +1,216 @@
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from threading import BoundedSemaphore, Lock
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote, urlsplit
+import json
+import zlib
+
+from .batch import MultipartBody, json_default, request_url_safe
+from .client import Params, PinejsClientCore
+
+Origin = Tuple[str, str, int]
+
+# Errors from reusing a connection the server already closed
+stale_connection_errors = (HTTPException, ConnectionError)
+idempotent_methods = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+class HTTPRequestError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def decode_body(data: bytes, encoding: str) -> bytes:
+    encoding = encoding.strip().lower()
+    if encoding == "gzip":
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    if encoding in ("", "identity"):
+        return data
+    raise Exception(f"Unsupported response Content-Encoding: {encoding}")
+
+
+def encode_body(body: Optional[Any]) -> Tuple[Optional[bytes], Dict[str, str]]:
+    if body is None:
+        return None, {}
+    if isinstance(body, MultipartBody):
+        return body.text.encode("utf-8"), {"Content-Type": body.content_type}
+    data = json.dumps(body, default=json_default, separators=(",", ":"))
+    return data.encode("utf-8"), {"Content-Type": "application/json"}
+
+
+def parse_body(data: bytes, content_type: str) -> Any:
+    text = data.decode("utf-8")
+    if content_type.lower().startswith("multipart/"):
+        return MultipartBody(content_type, text)
+    if "json" in content_type.lower() and text.strip():
+        return json.loads(text)
+    return text
+
+
+class ConnectionPool:
+    # Keeps up to `max_size` connections to one origin, idle ones are reused
+    # most recently used first so the fewest end up timing out server side
+    def __init__(
+        self,
+        origin: Origin,
+        max_size: int,
+        timeout: Optional[float],
+        acquire_timeout: Optional[float],
+    ):
+        self.origin = origin
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.idle: List[HTTPConnection] = []
+        self.slots = BoundedSemaphore(max_size)
+        self.lock = Lock()
+        self.opened = 0
+
+    def connect(self) -> HTTPConnection:
+        scheme, host, port = self.origin
+        self.opened += 1
+        if scheme == "https":
+            return HTTPSConnection(host, port, timeout=self.timeout)
+        return HTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self) -> Tuple[HTTPConnection, bool]:
+        # Returns a connection and whether it was used before
+        if not self.slots.acquire(timeout=self.acquire_timeout):
+            raise Exception(
+                f"Timed out waiting for a connection to {self.origin[1]}, "
+                "all of the pool's connections are in use"
+            )
+        with self.lock:
+            if len(self.idle) > 0:
+                return self.idle.pop(), True
+        return self.connect(), False
+
+    def release(self, connection: HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class HTTPPinejsClient(PinejsClientCore):
+    # A ready to use client that only needs the standard library, keeping
+    # connections alive between requests instead of opening one per call
+    def __init__(
+        self,
+        api_url: str,
+        params: Union[str, Params, None] = None,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = 30,
+        pool_size: int = 10,
+        pool_timeout: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        if pool_size < 1:
+            raise Exception(f"pool_size must be at least 1, got: {pool_size}")
+        parts = urlsplit(api_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise Exception(f"api_url must be an http(s) url, got: '{api_url}'")
+        if params is None:
+            params = parts.path.rstrip("/") + "/"
+        super().__init__(params, **kwargs)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.origin: Origin = (parts.scheme, parts.hostname, port)
+        self.headers = {
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            **(headers or {}),
+        }
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.pools: Dict[Origin, ConnectionPool] = {}
+        self.pools_lock = Lock()
+
+    def pool(self, origin: Origin) -> ConnectionPool:
+        with self.pools_lock:
+            pool = self.pools.get(origin)
+            if pool is None:
+                pool = self.pools[origin] = ConnectionPool(
+                    origin, self.pool_size, self.timeout, self.pool_timeout
+                )
+            return pool
+
+    def target(self, url: str) -> Tuple[Origin, str]:
+        parts = urlsplit(url)
+        if parts.scheme and parts.hostname:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            origin = (parts.scheme, parts.hostname, port)
+            url = parts.path + ("?" + parts.query if parts.query else "")
+        else:
+            origin = self.origin
+        # Compiled urls are not percent encoded yet
+        return origin, quote(url, safe=request_url_safe)
+
+    def send(
+        self,
+        pool: ConnectionPool,
+        method: str,
+        path: str,
+        data: Optional[bytes],
+        headers: Dict[str, str],
+    ) -> Tuple[int, str, bytes]:
+        # A kept alive connection may have been closed by the server since it
+        # was last used, idempotent requests are retried once on a new one
+        while True:
+            connection, reused = pool.acquire()
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except stale_connection_errors:
+                pool.release(connection, False)
+                if reused and method in idempotent_methods:
+                    continue
+                raise
+            except BaseException:
+                pool.release(connection, False)
+                raise
+            pool.release(connection, not response.will_close)
+            content_type = response.getheader("Content-Type", "")
+            encoding = response.getheader("Content-Encoding", "")
+            return response.status, content_type, decode_body(body, encoding)
+
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        origin, path = self.target(url)
+        data, headers = encode_body(body)
+        status, content_type, response = self.send(
+            self.pool(origin), method, path, data, {**self.headers, **headers}
+        )
+        result = parse_body(response, content_type)
+        if status >= 400:
+            message = result if isinstance(result, str) else json.dumps(result)
+            raise HTTPRequestError(message, status)
+        return result
+
+    def close(self) -> None:
+        with self.pools_lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.close()
+
+    def __enter__(self) -> "HTTPPinejsClient":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.close()
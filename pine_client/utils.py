@@ -1,5 +1,7 @@
+from functools import lru_cache
 from urllib.parse import quote
-from typing import Any, List, Union
+from types import GeneratorType
+from typing import Any, Callable, Generator, Hashable, List, Optional, Tuple, Union
 from datetime import datetime
 import re
 
@@ -8,6 +10,10 @@ def encode_uri_component(v: str) -> str:
     return quote(v, safe="~()*!'")
 
 
+# Anything encode_uri_component would change, apart from the NUL separator
+# escape_value_list joins batches with
+batch_unsafe_regex = re.compile("[^A-Za-z0-9_.~()*!'\\x00-]")
+
 encoded_slash = encode_uri_component("/")
 encoded_count = encode_uri_component("$count")
 trailing_count_regex = re.compile(f"(?:(?:{encoded_slash})|/){encoded_count}$")
@@ -43,23 +49,109 @@ def iso_format(dt: datetime):
     return isostring.format(int(round(utc.microsecond / 1000.0)))
 
 
+class Placeholder:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        if not name.isidentifier():
+            raise Exception(f"Placeholder names must be valid identifiers, got: {name}")
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Placeholder({self.name!r})"
+
+    @property
+    def token(self) -> str:
+        # NUL can never appear in an escaped value so the compiled url can be
+        # split on these tokens safely
+        return f"\x00{self.name}\x00"
+
+
+placeholder_token_regex = re.compile("\x00([^\x00]+)\x00")
+
+
+class AliasReference:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"AliasReference({self.name!r})"
+
+
+class Unhashable(Exception):
+    pass
+
+
+def scalar_key(value: Any) -> Hashable:
+    # Values are tagged with their type so that `True`, `1` and `1.0` (which
+    # compare and hash equal in python) do not share a cache entry
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return (bool, value)
+    if isinstance(value, (int, float)):
+        return (type(value), value)
+    if isinstance(value, datetime):
+        # isoformat includes the utc offset, which equality ignores
+        return (datetime, value.isoformat())
+    if isinstance(value, (Placeholder, AliasReference)):
+        return (type(value), value.name)
+    raise Unhashable(f"Cannot build a cache key for type: {type(value)}")
+
+
 def escape_value(value: Any) -> Union[str, int, float, bool, None]:
     if isinstance(value, str):
         value = value.replace("'", "''")
         return f"'{encode_uri_component(value)}'"
     elif isinstance(value, datetime):
         return f"datetime'{iso_format(value)}'"
+    elif isinstance(value, Placeholder):
+        return value.token
+    elif isinstance(value, AliasReference):
+        return escape_parameter_alias(value.name)
     return value
 
 
+def escape_value_list(values: List[Any]) -> Optional[str]:
+    # Escapes a homogeneous list of str/int/float values in one go, returning
+    # None when the list has to go through escape_value element by element
+    value_types = set(map(type, values))
+    if len(value_types) != 1:
+        return None
+    value_type = value_types.pop()
+    if value_type is int or value_type is float:
+        return ", ".join(map(str, values))
+    if value_type is not str:
+        return None
+
+    joined = "\x00".join(values)
+    if joined.count("\x00") != len(values) - 1:
+        return None
+    joined = joined.replace("'", "''")
+    if batch_unsafe_regex.search(joined) is not None:
+        # quote() encodes "%" so "%00" can only come from the separator
+        joined = encode_uri_component(joined).replace("%00", "\x00")
+    return "'" + joined.replace("\x00", "', '") + "'"
+
+
+def format_escaped(value: Union[str, int, float, bool, None]) -> str:
+    if value is None:
+        return "null"
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    return f"{value}"
+
+
 # TODO: When we drop support for python 3.8/3.9 we can use
 # Callable typing https://peps.python.org/pep-0677/ with a TypedVar("T") generic
 def map_obj(obj: Any, fn: Any) -> Any:
     return [fn(value, key) for key, value in obj.items()]
 
 
-def is_valid_option(key: str) -> bool:
-    return key in [
+valid_options = frozenset(
+    [
         "$select",
         "$filter",
         "$expand",
@@ -68,23 +160,20 @@ def is_valid_option(key: str) -> bool:
         "$skip",
         "$format",
     ]
+)
+
+
+def is_valid_option(key: str) -> bool:
+    return key in valid_options
 
 
-def bracket_join(arr: List[List[str]], separator: str) -> List[str]:
-    if len(arr) == 1:
-        return arr[0]
+raw_bind_regex = re.compile(r"\$([a-zA-Z0-9]+)")
 
-    result_arr: List[str] = []
-    map_arr = map(
-        lambda sub_arr: f"({''.join(sub_arr)})" if len(sub_arr) > 1 else sub_arr[0],
-        arr,
-    )
-    for i, the_str in enumerate(map_arr):
-        if i != 0:
-            result_arr.append(separator)
-        result_arr.append(the_str)
 
-    return result_arr
+@lru_cache(maxsize=1024)
+def parse_raw_template(template: str) -> Tuple[str, ...]:
+    # Alternating static text and bind names, so names are at the odd indexes
+    return tuple(raw_bind_regex.split(template))
 
 
 def join(str_or_arr: Union[str, List[str]], separator: str = ",") -> str:
@@ -94,3 +183,35 @@ def join(str_or_arr: Union[str, List[str]], separator: str = ",") -> str:
         return separator.join(str_or_arr)
     else:
         raise Exception(f"Expected a string or array, got: {type(str_or_arr)}")
+
+
+# Nested values are compiled without recursion: a function that needs the
+# result of compiling a nested value is a generator which yields the steps
+# compiling that value and is sent back their result, with `run_steps` keeping
+# the suspended generators on an explicit stack. Steps are either such a
+# generator or an already computed result, which lets functions return
+# directly when there is nothing nested to compile.
+
+CountSteps = Union[int, Generator[Any, Any, int]]
+StrSteps = Union[str, Generator[Any, Any, str]]
+
+
+def run_steps(steps: Any) -> Any:
+    if not isinstance(steps, GeneratorType):
+        return steps
+    # The bound `send` of every suspended generator, innermost last
+    stack: List[Callable[[Any], Any]] = [steps.send]
+    result = None
+    while len(stack) > 0:
+        try:
+            step = stack[-1](result)
+        except StopIteration as stop:
+            stack.pop()
+            result = stop.value
+            continue
+        if isinstance(step, GeneratorType):
+            stack.append(step.send)
+            result = None
+        else:
+            result = step
+    return result
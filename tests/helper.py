@@ -1,5 +1,14 @@
-from pine_client import PinejsClientCore
-from typing import Any, Optional
+from pine_client import AsyncPinejsClientCore, MultipartBody, PinejsClientCore
+from pine_client.batch import parse_http_message, parse_multipart, get_boundary
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote
+import asyncio
+import copy
+import json
+import re
+import threading
+
+AnyObject = Dict[str, Any]
 
 
 class MyClient(PinejsClientCore):
@@ -13,3 +22,317 @@ pine = MyClient("balena-test")
 def assert_compile(input: Any, output: str):
     print(pine.compile(input))
     assert pine.compile(input) == output
+
+
+class RequestError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+token_regex = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?)"
+    r"|(?P<name>[A-Za-z_$][\w/$]*)|(?P<punct>[(),]))"
+)
+
+
+def tokenize(text: str) -> List[Any]:
+    tokens: List[Any] = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = token_regex.match(text, pos)
+        if match is None:
+            raise Exception(f"Cannot parse filter at: {text[pos:]}")
+        pos = match.end()
+        if match.group("string") is not None:
+            tokens.append(
+                ("value", unquote(match.group("string")[1:-1]).replace("''", "'"))
+            )
+        elif match.group("number") is not None:
+            number = match.group("number")
+            tokens.append(("value", float(number) if "." in number else int(number)))
+        elif match.group("name") is not None:
+            name = match.group("name")
+            literals = {"null": None, "true": True, "false": False}
+            if name in literals:
+                tokens.append(("value", literals[name]))
+            else:
+                tokens.append(("name", name))
+        else:
+            tokens.append(("punct", match.group("punct")))
+    return tokens
+
+
+def compare(op: str, a: Any, b: Any) -> bool:
+    if op == "eq":
+        return a == b
+    if op == "ne":
+        return a != b
+    if a is None or b is None:
+        return False
+    return {"gt": a > b, "ge": a >= b, "lt": a < b, "le": a <= b}[op]
+
+
+class FilterParser:
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self) -> Any:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self) -> Any:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self) -> Callable[[AnyObject], bool]:
+        expr = self.parse_junction("or")
+        if self.pos != len(self.tokens):
+            raise Exception(f"Unexpected token: {self.peek()}")
+        return expr
+
+    def parse_junction(self, junction: str) -> Callable[[AnyObject], bool]:
+        parse_next = (
+            (lambda: self.parse_junction("and"))
+            if junction == "or"
+            else self.parse_unary
+        )
+        parts = [parse_next()]
+        while self.peek() == ("name", junction):
+            self.take()
+            parts.append(parse_next())
+        if junction == "or":
+            return lambda row: any(part(row) for part in parts)
+        return lambda row: all(part(row) for part in parts)
+
+    def parse_unary(self) -> Callable[[AnyObject], bool]:
+        if self.peek() == ("name", "not"):
+            self.take()
+            expr = self.parse_unary()
+            return lambda row: not expr(row)
+        if self.peek() == ("punct", "("):
+            self.take()
+            expr = self.parse_junction("or")
+            assert self.take() == ("punct", ")")
+            return expr
+        left = self.parse_operand()
+        if self.peek()[0] != "name" or self.peek() in [("name", "and"), ("name", "or")]:
+            # A bare boolean operand, eg `$raw: "false"`
+            return lambda row: bool(left(row))
+        _, op = self.take()
+        if op == "in":
+            assert self.take() == ("punct", "(")
+            values = [self.take()[1]]
+            while self.peek() == ("punct", ","):
+                self.take()
+                values.append(self.take()[1])
+            assert self.take() == ("punct", ")")
+            return lambda row: left(row) in values
+        right = self.parse_operand()
+        return lambda row: compare(op, left(row), right(row))
+
+    def parse_operand(self) -> Callable[[AnyObject], Any]:
+        kind, value = self.take()
+        if kind == "value":
+            return lambda row: value
+        if kind == "name":
+            return lambda row: get_path(row, value)
+        raise Exception(f"Unexpected operand: {value}")
+
+
+def get_path(row: AnyObject, path: str) -> Any:
+    value: Any = row
+    for part in path.split("/"):
+        value = None if value is None else value.get(part)
+    return value
+
+
+def sort_key(value: Any) -> Any:
+    # nulls sort last, like postgres
+    return (value is None, value)
+
+
+class FakeServer:
+    def __init__(
+        self,
+        resources: Dict[str, List[AnyObject]],
+        unique: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.resources = resources
+        self.unique = unique or {}
+        self.requests: List[Any] = []
+        self.batches: List[MultipartBody] = []
+        self.lock = threading.Lock()
+
+    def parse_url(self, url: str) -> Any:
+        path, _, query = url.lstrip("/").partition("?")
+        options: AnyObject = {}
+        for part in query.split("&") if query else []:
+            key, _, value = part.partition("=")
+            options[key] = value
+        count = path.endswith("/$count")
+        if count:
+            path = path.rsplit("/", 1)[0]
+        resource, _, key = path.partition("(")
+        filters = []
+        if key:
+            key = key[:-1]
+            if "=" in key:
+                filters.append(
+                    " and ".join(f"({k})" for k in key.replace("=", " eq ").split(","))
+                )
+            else:
+                filters.append(f"id eq {key}")
+        if "$filter" in options:
+            filters.append(f"({options['$filter']})")
+        filter = (
+            FilterParser(" and ".join(filters)).parse()
+            if filters
+            else (lambda row: True)
+        )
+        return resource, filter, options, count
+
+    def handle(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        with self.lock:
+            self.requests.append((method, url, body))
+            resource, filter, options, count = self.parse_url(url)
+            rows = self.resources.setdefault(resource, [])
+            matching = [row for row in rows if filter(row)]
+
+            if method == "GET":
+                if count:
+                    return {"d": len(matching)}
+                for order in reversed(options.get("$orderby", "").split(",")):
+                    if order:
+                        field, _, direction = order.partition(" ")
+                        matching.sort(
+                            key=lambda row: sort_key(get_path(row, field)),
+                            reverse=direction == "desc",
+                        )
+                skip = int(options.get("$skip", 0))
+                top = options.get("$top")
+                end = None if top is None else skip + int(top)
+                matching = matching[skip:end]
+                if "$select" in options:
+                    fields = options["$select"].split(",")
+                    matching = [{f: row.get(f) for f in fields} for row in matching]
+                return {"d": [dict(row) for row in matching]}
+            elif method == "POST":
+                for field in self.unique.get(resource, []):
+                    if any(row.get(field) == body.get(field) for row in rows):
+                        raise RequestError(f'"{field}" must be unique.', 409)
+                row = {"id": max([row["id"] for row in rows], default=0) + 1, **body}
+                rows.append(row)
+                return dict(row)
+            elif method == "PATCH":
+                for row in matching:
+                    row.update(body)
+                return "OK"
+            elif method == "DELETE":
+                self.resources[resource] = [row for row in rows if row not in matching]
+                return "OK"
+            raise Exception(f"Unsupported method: {method}")
+
+    def handle_part(self, text: str) -> str:
+        request_line, _, body = parse_http_message(text)
+        method, url, _ = request_line.split(" ")
+        try:
+            result = self.handle(
+                method, unquote(url), json.loads(body) if body else None
+            )
+            return f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(result)}"
+        except RequestError as e:
+            return f"HTTP/1.1 {e.status_code} Error\r\n\r\n{json.dumps(e.message)}"
+
+    def handle_batch(self, body: MultipartBody) -> str:
+        self.batches.append(body)
+        responses: List[str] = []
+        for part in parse_multipart(body.text, get_boundary(body.content_type)):
+            boundary = get_boundary(part.headers["content-type"])
+            if boundary is None:
+                responses.append(
+                    "Content-Type: application/http\r\n\r\n"
+                    + self.handle_part(part.body)
+                )
+                continue
+            snapshot = copy.deepcopy(self.resources)
+            change_set: List[str] = []
+            for sub_part in parse_multipart(part.body, boundary):
+                response = self.handle_part(sub_part.body)
+                if not response.startswith("HTTP/1.1 200"):
+                    # Roll back the whole change set
+                    self.resources = snapshot
+                    change_set = []
+                    break
+                change_set.append(
+                    f"Content-Type: application/http\r\nContent-ID: {sub_part.headers['content-id']}"
+                    f"\r\n\r\n{response}"
+                )
+            if len(change_set) == 0:
+                responses.append(f"Content-Type: application/http\r\n\r\n{response}")
+            else:
+                # Out of order, responses are matched by their Content-ID
+                responses.append(
+                    "Content-Type: multipart/mixed; boundary=response_changeset\r\n\r\n"
+                    + "".join(
+                        f"--response_changeset\r\n{r}\r\n" for r in reversed(change_set)
+                    )
+                    + "--response_changeset--"
+                )
+        return (
+            "".join(f"--response_batch\r\n{r}\r\n" for r in responses)
+            + "--response_batch--\r\n"
+        )
+
+
+def make_server(
+    count: int, unique: Optional[List[str]] = None, **fields: Any
+) -> FakeServer:
+    # `count` devices with ids from 1. String fields are formatted with the id
+    # as `i`, callables are called with it and other values are used as is
+    def value(field: Any, i: int) -> Any:
+        if callable(field):
+            return field(i)
+        if isinstance(field, str):
+            return field.format(i=i)
+        return field
+
+    rows = [
+        {"id": i, **{name: value(field, i) for name, field in fields.items()}}
+        for i in range(1, count + 1)
+    ]
+    return FakeServer({"device": rows}, None if unique is None else {"device": unique})
+
+
+class FakeClient(PinejsClientCore):
+    def __init__(self, server: FakeServer, **kwargs: Any):
+        super().__init__("/", **kwargs)
+        self.server = server
+
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        if isinstance(body, MultipartBody):
+            return self.server.handle_batch(body)
+        return self.server.handle(method, url, body)
+
+
+class AsyncFakeClient(AsyncPinejsClientCore):
+    def __init__(self, server: FakeServer, **kwargs: Any):
+        super().__init__("/", **kwargs)
+        self.server = server
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Yield to the event loop so concurrent requests overlap
+            await asyncio.sleep(0)
+            if isinstance(body, MultipartBody):
+                return self.server.handle_batch(body)
+            return self.server.handle(method, url, body)
+        finally:
+            self.in_flight -= 1
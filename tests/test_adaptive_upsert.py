@@ -0,0 +1,125 @@
+from functools import partial
+from typing import Any, List
+import asyncio
+
+import pytest
+
+from pine_client import UpsertStrategy
+from .helper import AsyncFakeClient, FakeClient, make_server
+
+devices = partial(make_server, 20, ["uuid"], uuid="uuid{i}", app=1)
+
+
+def upsert(pine: Any, uuid: str) -> Any:
+    return pine.upsert({"resource": "device", "id": {"uuid": uuid}, "body": {"app": 2}})
+
+
+def methods(pine: Any) -> List[str]:
+    return [r[0] for r in pine.server.requests]
+
+
+def test_disabled_by_default():
+    pine = FakeClient(devices())
+    upsert(pine, "uuid1")
+    assert pine.upsert_strategy is None
+    assert methods(pine) == ["POST", "PATCH"]
+
+
+def test_switches_to_lookup_first_for_updates():
+    pine = FakeClient(devices(), adaptive_upsert=True)
+    for i in range(1, 21):
+        upsert(pine, f"uuid{i}")
+    stats = pine.upsert_strategy.stats("device")
+    assert stats["strategy"] == "lookup_first"
+    assert stats["switches"] == 1
+    assert stats["upserts"] == stats["conflicts"] == stats["patches"] == 20
+    # Only the upserts before the switch POSTed rows that already existed
+    assert stats["failed_posts"] == stats["posts"] == 20 - stats["lookups"]
+    assert stats["lookups"] > 0
+    assert methods(pine)[-2:] == ["GET", "PATCH"]
+    assert pine.server.requests[-2][1] == (
+        "/device?$select=uuid&$filter=uuid eq 'uuid20'&$top=1"
+    )
+    assert all(row["app"] == 2 for row in pine.server.resources["device"])
+
+
+def test_switches_back_to_post_first_for_inserts():
+    pine = FakeClient(devices(), adaptive_upsert=True)
+    for i in range(1, 21):
+        upsert(pine, f"uuid{i}")
+    pine.server.requests.clear()
+    for i in range(30):
+        upsert(pine, f"new{i}")
+    stats = pine.upsert_strategy.stats("device")
+    assert stats["strategy"] == "post_first"
+    assert stats["switches"] == 2
+    # A new row found missing by the lookup is then POSTed
+    assert methods(pine)[:2] == ["GET", "POST"]
+    assert methods(pine)[-1] == "POST"
+    assert len(pine.server.resources["device"]) == 50
+
+
+def test_lookup_skips_the_response_cache():
+    pine = FakeClient(
+        devices(),
+        adaptive_upsert=True,
+        response_cache_size=100,
+        coalesce_requests=True,
+    )
+    for i in range(1, 21):
+        upsert(pine, f"uuid{i}")
+    lookup = {
+        "resource": "device",
+        "options": {"$select": ["uuid"], "$filter": {"uuid": "new"}, "$top": 1},
+    }
+    assert pine.get(lookup) == []
+    # Created by someone else after the lookup's url was cached
+    pine.server.handle("POST", "/device", {"uuid": "new", "app": 1})
+    pine.server.requests.clear()
+
+    upsert(pine, "new")
+    assert methods(pine) == ["GET", "PATCH"]
+
+
+def test_stats_are_per_resource():
+    pine = FakeClient(devices(), adaptive_upsert=True)
+    upsert(pine, "uuid1")
+    upsert(pine, "new")
+    assert pine.upsert_strategy.stats() == {
+        "device": {
+            "strategy": "post_first",
+            "conflict_rate": pytest.approx(0.09),
+            "upserts": 2,
+            "conflicts": 1,
+            "posts": 2,
+            "failed_posts": 1,
+            "lookups": 0,
+            "patches": 1,
+            "switches": 0,
+        }
+    }
+    assert pine.upsert_strategy.stats("application")["upserts"] == 0
+
+
+def test_invalid_strategy():
+    with pytest.raises(Exception) as err:
+        UpsertStrategy(alpha=0)
+    assert "alpha must be in (0, 1]" in str(err)
+    with pytest.raises(Exception) as err:
+        UpsertStrategy(high=0.3, low=0.5)
+    assert "The thresholds must satisfy" in str(err)
+
+
+def test_async_adaptive_upsert():
+    pine = AsyncFakeClient(devices(), adaptive_upsert=True)
+
+    async def run() -> None:
+        for i in range(1, 21):
+            await pine.upsert(
+                {"resource": "device", "id": {"uuid": f"uuid{i}"}, "body": {"app": 3}}
+            )
+
+    asyncio.run(run())
+    assert pine.upsert_strategy.stats("device")["strategy"] == "lookup_first"
+    assert methods(pine)[-2:] == ["GET", "PATCH"]
+    assert all(row["app"] == 3 for row in pine.server.resources["device"])
@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Any
+
+from .helper import MyClient
+
+
+def aliased_client(min_length: int = 0) -> Any:
+    return MyClient("/", parameter_alias_min_length=min_length)
+
+
+def test_lift_filter_literals():
+    pine = aliased_client()
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "options": {
+                    "$filter": {
+                        "a": "x",
+                        "b": {"$in": ["x", "y", 3]},
+                        "c": True,
+                        "d": None,
+                        "e": {"$startswith": "x"},
+                    }
+                },
+            }
+        )
+        == "device?$filter=(a eq @p0) and (b in (@p0, @p1, @p2)) and (c eq true)"
+        " and (d eq null) and startswith(e,@p0)&@p0='x'&@p1='y'&@p2=3"
+    )
+
+
+def test_lift_nested_literals():
+    pine = aliased_client()
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "id": {"uuid": "abc"},
+                "options": {
+                    "$filter": {
+                        "tag": {"$any": {"$alias": "t", "$expr": {"t": {"k": 1.5}}}},
+                        "$raw": "a eq 'raw'",
+                        "created": datetime(2023, 1, 2),
+                    },
+                    "$expand": {"tag": {"$filter": {"v": "abc"}, "$top": 2}},
+                },
+            }
+        )
+        == "device(uuid=@p2)?$filter=(tag/any(t:t/k eq @p0)) and (a eq 'raw')"
+        " and (created eq @p1)&$expand=tag($filter=v eq @p2;$top=2)"
+        "&@p0=1.5&@p1=datetime'2023-01-02T00:00:00.0Z'&@p2='abc'"
+    )
+
+
+def test_lift_respects_existing_aliases():
+    pine = aliased_client()
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "options": {"$filter": {"a": {"@": "p0"}, "b": "x"}, "@p0": 1},
+            }
+        )
+        == "device?$filter=(a eq @p0) and (b eq @p1)&@p0=1&@p1='x'"
+    )
+
+
+def test_lift_min_length():
+    pine = aliased_client(10)
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "options": {
+                    "$filter": {
+                        "short": "x",
+                        "repeated": {"$in": [1, 1]},
+                        "long": "a long value",
+                    }
+                },
+            }
+        )
+        == "device?$filter=(short eq 'x') and (repeated in (@p0, @p0))"
+        " and (long eq @p1)&@p0=1&@p1='a%20long%20value'"
+    )
+
+
+def test_lift_disabled_by_default():
+    pine = MyClient("/")
+    assert (
+        pine.compile({"resource": "device", "options": {"$filter": {"a": "x"}}})
+        == "device?$filter=a eq 'x'"
+    )
+
+
+def test_compile_shape():
+    pine = MyClient("/")
+
+    def params(uuid: str) -> Any:
+        return {
+            "resource": "device",
+            "options": {"$filter": {"uuid": uuid, "app": 5}, "$select": "id"},
+        }
+
+    shape, aliases = pine.compile_shape(params("abc"))
+    assert shape == "device?$filter=(uuid eq @p0) and (app eq @p1)&$select=id"
+    assert aliases == {"p0": "abc", "p1": 5}
+    assert pine.compile_shape(params("def"))[0] == shape
+
+
+def test_lift_count_literals():
+    pine = aliased_client()
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "options": {"$count": {"$filter": {"name": "abc"}}},
+            }
+        )
+        == "device/$count?$filter=name eq @p0&@p0='abc'"
+    )
@@ -0,0 +1,96 @@
+from functools import partial
+from typing import Any
+import asyncio
+import pytest
+
+from .helper import AsyncFakeClient, FakeClient, make_server
+
+devices = partial(make_server, 100, ["name"], name="device{i}", app=lambda i: i % 3)
+
+
+def test_async_matches_sync():
+    sync = FakeClient(devices())
+    pine = AsyncFakeClient(devices())
+    params: Any = {
+        "resource": "device",
+        "options": {"$filter": {"app": 1}, "$orderby": "id desc", "$top": 5},
+    }
+    assert asyncio.run(pine.get(params)) == sync.get(params)
+    assert pine.server.requests == sync.server.requests
+    assert asyncio.run(pine.get({"resource": "device", "id": 3})) == sync.get(
+        {"resource": "device", "id": 3}
+    )
+
+
+def test_async_crud():
+    async def run() -> Any:
+        pine = AsyncFakeClient(devices())
+        created = await pine.post({"resource": "device", "body": {"name": "new"}})
+        await pine.patch(
+            {"resource": "device", "id": created["id"], "body": {"app": 7}}
+        )
+        await pine.delete({"resource": "device", "options": {"$filter": {"app": 0}}})
+        return pine, await pine.get({"resource": "device", "id": created["id"]})
+
+    pine, row = asyncio.run(run())
+    assert row == {"id": 101, "name": "new", "app": 7}
+    assert [method for method, _, _ in pine.server.requests] == [
+        "POST",
+        "PATCH",
+        "DELETE",
+        "GET",
+    ]
+
+
+def test_async_get_or_create_and_upsert():
+    async def run() -> Any:
+        pine = AsyncFakeClient(devices())
+        existing = await pine.get_or_create(
+            {"resource": "device", "id": {"name": "device5"}, "body": {"app": 9}}
+        )
+        created = await pine.get_or_create(
+            {"resource": "device", "id": {"name": "other"}, "body": {"app": 9}}
+        )
+        await pine.upsert(
+            {"resource": "device", "id": {"name": "device6"}, "body": {"app": 8}}
+        )
+        upserted = await pine.get({"resource": "device", "id": 6})
+        return existing, created, upserted
+
+    existing, created, upserted = asyncio.run(run())
+    assert existing["id"] == 5
+    assert created == {"id": 101, "name": "other", "app": 9}
+    assert upserted["app"] == 8
+
+    with pytest.raises(Exception) as err:
+        asyncio.run(
+            AsyncFakeClient(devices()).upsert(
+                {"resource": "device", "id": {}, "body": {}}
+            )
+        )
+    assert "The id property must be an object with the natural key" in str(err)
+
+
+def test_async_concurrent_requests():
+    pine = AsyncFakeClient(devices())
+
+    async def run() -> Any:
+        return await asyncio.gather(
+            *(pine.get({"resource": "device", "id": i}) for i in range(1, 101))
+        )
+
+    rows = asyncio.run(run())
+    assert [row["id"] for row in rows] == list(range(1, 101))
+    assert pine.max_in_flight == 100
+
+
+def test_async_split_in_list():
+    pine = AsyncFakeClient(devices(), max_concurrency=3)
+    params: Any = {
+        "resource": "device",
+        "options": {"$filter": {"id": {"$in": list(range(100))}}, "$orderby": "id"},
+    }
+    rows = asyncio.run(pine.get(params, max_url_length=100))
+    assert [row["id"] for row in rows] == list(range(1, 100))
+    assert len(pine.server.requests) > 3
+    assert pine.max_in_flight == 3
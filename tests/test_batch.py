@@ -0,0 +1,136 @@
+from typing import Any, Optional
+import asyncio
+import pytest
+
+from pine_client import BatchRequestError
+from .helper import AsyncFakeClient, FakeClient, FakeServer
+
+
+def make_client() -> Any:
+    rows = [{"id": i, "name": f"device{i}", "app": i % 3} for i in range(1, 11)]
+    return FakeClient(FakeServer({"device": rows}, unique={"device": ["name"]}))
+
+
+def test_batch_round_trip():
+    pine = make_client()
+    with pine.batch() as batch:
+        one = batch.get({"resource": "device", "id": 1})
+        apps = batch.get(
+            {"resource": "device", "options": {"$filter": {"app": 2}, "$select": "id"}}
+        )
+        created = batch.post({"resource": "device", "body": {"name": "new"}})
+        batch.patch({"resource": "device", "id": 2, "body": {"app": 7}})
+        missing = batch.get({"resource": "device", "id": 99})
+
+    assert len(pine.server.batches) == 1
+    assert one.result() == {"id": 1, "name": "device1", "app": 1}
+    assert apps.result() == [{"id": 2}, {"id": 5}, {"id": 8}]
+    assert created.result() == {"id": 11, "name": "new"}
+    assert missing.result() is None
+    assert pine.get({"resource": "device", "id": 2})["app"] == 7
+    assert [url for _, url, _ in pine.server.requests[:2]] == [
+        "/device(1)",
+        "/device?$filter=app eq 2&$select=id",
+    ]
+
+
+def test_batch_change_sets():
+    pine = make_client()
+    batch = pine.batch()
+    with batch.change_set():
+        first = batch.post({"resource": "device", "body": {"name": "a"}})
+        second = batch.patch({"resource": "device", "id": 1, "body": {"app": 5}})
+    with batch.change_set():
+        batch.post({"resource": "device", "body": {"name": "b"}})
+        batch.post({"resource": "device", "body": {"name": "device3"}})
+    after = batch.get({"resource": "device", "options": {"$filter": {"name": "b"}}})
+    batch.send()
+
+    assert first.result()["name"] == "a"
+    assert second.result() == "OK"
+    # The second change set is rolled back as a whole
+    assert after.result() == []
+    for operation in batch.operations[2:4]:
+        with pytest.raises(BatchRequestError) as err:
+            operation.result()
+        assert err.value.status_code == 409
+        assert '"name" must be unique.' in str(err)
+
+
+def test_batch_errors():
+    pine = make_client()
+    batch = pine.batch()
+    operation = batch.post({"resource": "device", "body": {"name": "device1"}})
+
+    with pytest.raises(Exception) as err:
+        operation.result()
+    assert "The batch has not been sent yet" in str(err)
+
+    with pytest.raises(Exception) as err:
+        with batch.change_set():
+            batch.get({"resource": "device"})
+    assert "Only modifying requests can be part of a change set" in str(err)
+
+    with pytest.raises(Exception) as err:
+        with batch.change_set():
+            with batch.change_set():
+                pass
+    assert "Change sets cannot be nested" in str(err)
+
+    batch.send()
+    with pytest.raises(BatchRequestError):
+        operation.result()
+
+    with pytest.raises(Exception) as err:
+        batch.get({"resource": "device"})
+    assert "Cannot add operations to a batch that was already sent" in str(err)
+
+    assert pine.batch().send() == []
+    assert len(pine.server.batches) == 1
+
+
+def test_batch_stops_at_the_first_error():
+    class StoppingClient(FakeClient):
+        def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+            # Like a server without continue-on-error, drop every response
+            # after the first failed one
+            response = super()._request(method, url, body)
+            parts = response.split("--response_batch\r\n")[1:]
+            failed = next(i for i, p in enumerate(parts) if "HTTP/1.1 200" not in p)
+            kept = parts[: failed + 1]
+            return "".join(f"--response_batch\r\n{p}" for p in kept) + (
+                "--response_batch--\r\n"
+            )
+
+    pine = StoppingClient(make_client().server)
+    batch = pine.batch()
+    one = batch.get({"resource": "device", "id": 1})
+    failed = batch.post({"resource": "device", "body": {"name": "device2"}})
+    with batch.change_set():
+        patched = batch.patch({"resource": "device", "id": 3, "body": {"app": 9}})
+    after = batch.get({"resource": "device", "id": 4})
+    batch.send()
+
+    assert one.result()["name"] == "device1"
+    with pytest.raises(BatchRequestError) as err:
+        failed.result()
+    assert err.value.status_code == 409
+    for operation in (patched, after):
+        with pytest.raises(Exception) as err:
+            operation.result()
+        assert "The request was not executed" in str(err)
+        assert "returned 2 of 4 responses" in str(err)
+    assert "GET /device(4)" in str(err)
+
+
+def test_async_batch():
+    pine = AsyncFakeClient(make_client().server)
+
+    async def run() -> Any:
+        async with pine.batch() as batch:
+            one = batch.get({"resource": "device", "id": 1})
+            with batch.change_set():
+                batch.delete({"resource": "device", "id": 1})
+        return one.result(), await pine.get({"resource": "device", "id": 1})
+
+    assert asyncio.run(run()) == ({"id": 1, "name": "device1", "app": 1}, None)
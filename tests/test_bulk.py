@@ -0,0 +1,261 @@
+from functools import partial
+from typing import Any, List, Optional
+import asyncio
+
+import pytest
+
+from pine_client.bulk import BulkItems
+from .helper import AsyncFakeClient, FakeClient, make_server
+
+devices = partial(make_server, 3, ["uuid"], uuid="uuid{i}", name="device{i}", app=1)
+
+
+def requests(pine: Any, method: str) -> List[Any]:
+    return [r for r in pine.server.requests if r[0] == method]
+
+
+def test_get_or_create_many():
+    pine = FakeClient(devices())
+    results = pine.get_or_create_many(
+        {
+            "resource": "device",
+            "key": "uuid",
+            "items": [
+                {"uuid": "uuid5", "name": "new5"},
+                {"uuid": "uuid2", "name": "ignored"},
+                {"uuid": "uuid4", "name": "new4"},
+                {"uuid": "uuid2", "name": "ignored"},
+            ],
+        }
+    )
+    assert [r["name"] for r in results] == ["new5", "device2", "new4", "device2"]
+    assert results[1] is not results[3]
+    assert requests(pine, "GET") == [
+        ("GET", "/device?$filter=uuid in ('uuid5', 'uuid2', 'uuid4')", None)
+    ]
+    assert len(requests(pine, "POST")) == 2
+    assert len(pine.server.resources["device"]) == 5
+
+
+def test_get_or_create_many_chunks_and_composite_keys():
+    pine = FakeClient(devices())
+    results = pine.get_or_create_many(
+        {
+            "resource": "device",
+            "key": ["app", "name"],
+            "items": [
+                {"app": 1, "name": "device1"},
+                {"app": 1, "name": "device3"},
+                {"app": 2, "name": "device1", "uuid": "other"},
+            ],
+            "options": {"$select": "uuid"},
+        },
+        chunk_size=2,
+    )
+    assert results[0] == {"uuid": "uuid1"}
+    assert results[1] == {"uuid": "uuid3"}
+    assert results[2]["uuid"] == "other"
+    assert len(requests(pine, "GET")) == 2
+    assert "$select=uuid,app,name" in requests(pine, "GET")[0][1]
+
+
+def test_get_or_create_many_unique_race():
+    class RacingClient(FakeClient):
+        def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+            if method == "POST":
+                # Someone else creates the device between the lookup and the post
+                self.server.handle("POST", url, body)
+            return super()._request(method, url, body)
+
+    pine = RacingClient(devices())
+    [result] = pine.get_or_create_many(
+        {"resource": "device", "key": "uuid", "items": [{"uuid": "uuid9"}]}
+    )
+    assert result["uuid"] == "uuid9"
+    assert len(pine.server.resources["device"]) == 4
+
+
+def test_get_or_create_many_invalid():
+    pine = FakeClient(devices())
+    with pytest.raises(Exception) as err:
+        pine.get_or_create_many(
+            {"resource": "device", "key": "uuid", "items": [{"name": "a"}]}
+        )
+    assert "Every item must have a string or number for the key ['uuid']" in str(err)
+    with pytest.raises(Exception) as err:
+        pine.get_or_create_many(
+            {"resource": "device", "key": "uuid", "items": [], "options": {"$top": 1}}
+        )
+    assert "Bulk writes cannot use $top" in str(err)
+    with pytest.raises(Exception) as err:
+        pine.get_or_create_many(
+            {"resource": "device", "key": "app", "items": [{"app": 1}]}
+        )
+    assert "matched several rows" in str(err)
+    assert (
+        pine.get_or_create_many({"resource": "device", "key": "id", "items": []}) == []
+    )
+
+
+def cached_lookup(params: Any, key_only: bool) -> Any:
+    # The lookup a bulk write sends first
+    items = BulkItems(params)
+    return items.lookup_params(items.unique_keys(), key_only)[0]
+
+
+def test_get_or_create_many_ignores_cached_lookups():
+    pine = FakeClient(devices(), response_cache_size=100)
+    params: Any = {"resource": "device", "key": "uuid", "items": [{"uuid": "uuid2"}]}
+    assert len(pine.get(cached_lookup(params, False))) == 1
+    # Deleted by someone else while the lookup is cached
+    pine.server.resources["device"] = []
+
+    [result] = pine.get_or_create_many(params)
+    assert len(pine.server.resources["device"]) == 1
+    assert result == pine.server.resources["device"][0]
+
+
+def test_async_get_or_create_many():
+    pine = AsyncFakeClient(devices(), max_concurrency=4)
+    items = [{"uuid": f"uuid{i}", "name": f"new{i}"} for i in range(1, 11)]
+
+    async def run() -> List[Any]:
+        return await pine.get_or_create_many(
+            {"resource": "device", "key": "uuid", "items": items}
+        )
+
+    results = asyncio.run(run())
+    assert [r["uuid"] for r in results] == [f"uuid{i}" for i in range(1, 11)]
+    assert [r["name"] for r in results[:4]] == ["device1", "device2", "device3", "new4"]
+    assert len(requests(pine, "POST")) == 7
+    assert pine.max_in_flight > 1
+
+
+def upsert_items() -> List[Any]:
+    return [
+        {"uuid": "uuid1", "name": "renamed1"},
+        {"uuid": "uuid7", "name": "new7"},
+        {"uuid": "uuid3", "name": "renamed3"},
+        {"uuid": "uuid7", "name": "newer7"},
+    ]
+
+
+def test_upsert_many():
+    pine = FakeClient(devices())
+    results = pine.upsert_many(
+        {"resource": "device", "key": "uuid", "items": upsert_items()}
+    )
+    assert results[0] == "OK"
+    assert results[1]["name"] == "newer7"
+    assert results[1] == results[3] and results[1] is not results[3]
+    assert [r[0] for r in pine.server.requests] == ["GET", "PATCH", "POST", "PATCH"]
+    assert pine.server.requests[0][1] == (
+        "/device?$select=uuid&$filter=uuid in ('uuid1', 'uuid7', 'uuid3')"
+    )
+    # The key only filters the rows to update
+    assert pine.server.requests[1][2] == {"name": "renamed1"}
+    assert [row["name"] for row in pine.server.resources["device"]] == [
+        "renamed1",
+        "device2",
+        "renamed3",
+        "newer7",
+    ]
+
+
+def test_upsert_many_batch():
+    pine = FakeClient(devices())
+    results = pine.upsert_many(
+        {
+            "resource": "device",
+            "key": "uuid",
+            "items": upsert_items(),
+            "options": {"$filter": {"app": 1}},
+        },
+        chunk_size=2,
+        batch=True,
+    )
+    assert results[0] == "OK"
+    assert results[1]["name"] == "newer7"
+    # Two lookups, then the three writes in two batches
+    assert len(pine.server.batches) == 2
+    assert [r[0] for r in pine.server.requests] == [
+        "GET",
+        "GET",
+        "PATCH",
+        "POST",
+        "PATCH",
+    ]
+    assert pine.server.resources["device"][2]["name"] == "renamed3"
+
+
+def test_upsert_many_unique_race():
+    class RacingClient(FakeClient):
+        def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+            if method == "POST":
+                self.server.handle("POST", url, {**body, "name": "theirs"})
+            return super()._request(method, url, body)
+
+    pine = RacingClient(devices())
+    [result] = pine.upsert_many(
+        {"resource": "device", "key": "uuid", "items": [{"uuid": "u", "name": "ours"}]}
+    )
+    assert result == "OK"
+    assert pine.server.resources["device"][-1]["name"] == "ours"
+
+
+def test_upsert_many_ignores_cached_lookups():
+    pine = FakeClient(devices(), response_cache_size=100)
+    params: Any = {"resource": "device", "key": "uuid", "items": upsert_items()[:1]}
+    assert len(pine.get(cached_lookup(params, True))) == 1
+    # Deleted by someone else while the lookup is cached
+    pine.server.resources["device"] = []
+    pine.server.requests.clear()
+
+    [result] = pine.upsert_many(params)
+    assert [r[0] for r in pine.server.requests] == ["GET", "POST"]
+    assert len(pine.server.resources["device"]) == 1
+    assert result["name"] == "renamed1"
+
+
+def test_async_upsert_many():
+    pine = AsyncFakeClient(devices())
+
+    async def run(batch: bool) -> List[Any]:
+        return await pine.upsert_many(
+            {"resource": "device", "key": "uuid", "items": upsert_items()},
+            batch=batch,
+        )
+
+    assert asyncio.run(run(False))[1]["name"] == "newer7"
+    # Everything exists the second time round
+    assert asyncio.run(run(True)) == ["OK", "OK", "OK", "OK"]
+    assert len(pine.server.batches) == 1
+    assert len(pine.server.resources["device"]) == 4
+
+
+def test_async_upsert_many_ignores_cached_lookups():
+    pine = AsyncFakeClient(devices(), response_cache_size=100)
+    params: Any = {"resource": "device", "key": "uuid", "items": upsert_items()[:1]}
+
+    async def run() -> List[Any]:
+        await pine.get(cached_lookup(params, True))
+        pine.server.resources["device"] = []
+        return await pine.upsert_many(params)
+
+    [result] = asyncio.run(run())
+    assert len(pine.server.resources["device"]) == 1
+    assert result["name"] == "renamed1"
+
+
+def test_async_get_or_create_many_ignores_cached_lookups():
+    pine = AsyncFakeClient(devices(), response_cache_size=100)
+    params: Any = {"resource": "device", "key": "uuid", "items": [{"uuid": "uuid2"}]}
+
+    async def run() -> List[Any]:
+        await pine.get(cached_lookup(params, False))
+        pine.server.resources["device"] = []
+        return await pine.get_or_create_many(params)
+
+    [result] = asyncio.run(run())
+    assert len(pine.server.resources["device"]) == 1
+    assert result == pine.server.resources["device"][0]
@@ -0,0 +1,157 @@
+from typing import Any
+import pytest
+
+from .helper import FakeClient, FakeServer
+
+
+def make_client(count: int = 300) -> Any:
+    rows = [{"id": i, "name": f"device{i % 7}", "app": i % 3} for i in range(count)]
+    return FakeClient(FakeServer({"device": rows}))
+
+
+def in_params(ids: Any, **options: Any) -> Any:
+    return {
+        "resource": "device",
+        "options": {"$filter": {"id": {"$in": ids}}, **options},
+    }
+
+
+def test_short_urls_are_not_split():
+    pine = make_client()
+    assert len(pine.get(in_params([1, 2, 3]), max_url_length=2000)) == 3
+    assert len(pine.server.requests) == 1
+
+
+def test_split_in_list():
+    pine = make_client()
+    ids = list(range(0, 300, 2))
+    expected = pine.get(in_params(ids))
+    pine.server.requests.clear()
+
+    assert pine.get(in_params(ids), max_url_length=100) == expected
+    assert len(pine.server.requests) > 1
+    for _, url, _ in pine.server.requests:
+        assert len(url) <= 100
+
+
+def test_split_nested_in_list():
+    pine = make_client()
+    params: Any = {
+        "resource": "device",
+        "options": {
+            "$filter": {
+                "$and": [{"app": 1}, {"id": {"$in": list(range(200))}}],
+                "name": {"$ne": "device0"},
+            },
+            "$select": ["id", "name"],
+        },
+    }
+    expected = pine.get(params)
+    assert pine.get(params, max_url_length=150) == expected
+    assert len(pine.server.requests) > 2
+
+
+def test_split_with_order_and_paging():
+    pine = make_client()
+    ids = list(range(300))
+    for options in [
+        {"$orderby": "name desc,id", "$top": 15},
+        {"$orderby": [{"name": "asc"}, {"id": "desc"}], "$skip": 7, "$top": 20},
+        {"$orderby": {"id": "desc"}, "$skip": 290},
+        {"$top": 5},
+    ]:
+        expected = pine.get(in_params(ids, **options))
+        assert pine.get(in_params(ids, **options), max_url_length=200) == expected
+
+
+def test_split_count():
+    pine = make_client()
+    ids = list(range(0, 300, 3))
+    params: Any = {
+        "resource": "device",
+        "options": {"$count": {"$filter": {"id": {"$in": ids}}}},
+    }
+    assert pine.get(params, max_url_length=100) == 100
+
+
+def test_split_dedupes_values():
+    pine = make_client()
+    ids = list(range(100)) * 3
+    assert len(pine.get(in_params(ids), max_url_length=120)) == 100
+
+
+def test_split_refusals():
+    pine = make_client()
+    ids = list(range(300))
+
+    with pytest.raises(Exception) as err:
+        pine.get(
+            {
+                "resource": "device",
+                "options": {"$filter": {"$or": [{"id": {"$in": ids}}, {"app": 1}]}},
+            },
+            max_url_length=200,
+        )
+    assert "has no $in list that can be split" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get(
+            {
+                "resource": "device",
+                "options": {"$filter": {"$not": {"id": {"$in": ids}}}},
+            },
+            max_url_length=200,
+        )
+    assert "has no $in list that can be split" in str(err)
+
+    with pytest.raises(Exception) as err:
+        # A row with several applications could match several chunks
+        pine.get(
+            {
+                "resource": "device",
+                "options": {"$filter": {"application": {"id": {"$in": ids}}}},
+            },
+            max_url_length=200,
+        )
+    assert "has no $in list that can be split" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get({"url": "device?$filter=id in (" + "1, " * 100 + "2)"}, 200)
+    assert "Cannot split requests that specify a url" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get(in_params(ids, **{"$skip": 10}), max_url_length=200)
+    assert "Cannot split requests that use $skip without $orderby" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get(
+            in_params(ids, **{"$orderby": "app", "$select": "id"}), max_url_length=200
+        )
+    assert "Cannot merge chunked results ordered by ['app']" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get(in_params(ids, **{"$orderby": "a/b"}), max_url_length=200)
+    assert "Cannot merge chunked results ordered by 'a/b'" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.get(in_params(ids), max_url_length=20)
+    assert "cannot be shortened below 20 characters" in str(err)
+
+    assert len(pine.server.requests) == 0
+
+
+def test_split_with_parameter_aliases():
+    pine = FakeClient(FakeServer({}), parameter_alias_min_length=0)
+    urls = []
+    pine._request = lambda method, url, body=None: urls.append(url) or {"d": []}
+    names = [f"device-name-{i:04d}" for i in range(100)]
+
+    pine.get(
+        {"resource": "device", "options": {"$filter": {"name": {"$in": names}}}},
+        max_url_length=300,
+    )
+    # Each value is lifted into an alias, which the chunk sizes must account for
+    assert len(urls) > 1
+    for url in urls:
+        assert len(url) <= 300
+    assert [n for n in names if any(f"'{n}'" in url for url in urls)] == names
@@ -0,0 +1,121 @@
+from functools import partial
+from typing import Any, List, Optional, Tuple
+import asyncio
+import threading
+import time
+
+from .helper import AsyncFakeClient, FakeClient, FakeServer, RequestError, make_server
+
+devices = partial(make_server, 3, name="device{i}")
+
+
+class GatedClient(FakeClient):
+    def __init__(self, server: FakeServer, **kwargs: Any):
+        super().__init__(server, coalesce_requests=True, **kwargs)
+        self.gate = threading.Event()
+        self.fail = False
+
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        self.gate.wait()
+        if self.fail:
+            raise RequestError("Service unavailable", 503)
+        return super()._request(method, url, body)
+
+
+def run_threads(count: int, fn: Any) -> Tuple[List[threading.Thread], List[Any]]:
+    results: List[Any] = [None] * count
+
+    def run(index: int) -> None:
+        try:
+            results[index] = fn()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_coalesce_threads():
+    pine = GatedClient(devices())
+    threads, results = run_threads(10, lambda: pine.get({"resource": "device"}))
+    while pine.single_flight.coalesced < 9:
+        time.sleep(0.001)
+    pine.gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(pine.server.requests) == 1
+    assert all(result == results[0] for result in results)
+    # Each caller gets its own copy
+    assert len({id(result) for result in results}) == 10
+
+
+def test_coalesce_exceptions():
+    pine = GatedClient(devices())
+    pine.fail = True
+    threads, results = run_threads(5, lambda: pine.get({"resource": "device", "id": 1}))
+    while pine.single_flight.coalesced < 4:
+        time.sleep(0.001)
+    pine.gate.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, RequestError) for result in results)
+
+
+def test_coalesce_only_identical_urls():
+    pine = GatedClient(devices())
+    pine.gate.set()
+    pine.get({"resource": "device", "id": 1})
+    pine.get({"resource": "device", "id": 1})
+    pine.get({"resource": "device", "id": 1, "api_prefix": "/v2/"})
+    assert len(pine.server.requests) == 3
+    assert pine.single_flight.coalesced == 0
+
+
+class AsyncGatedClient(AsyncFakeClient):
+    def __init__(self, server: FakeServer):
+        super().__init__(server, coalesce_requests=True)
+        self.gate: Any = None
+
+    async def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        await self.gate.wait()
+        return await super()._request(method, url, body)
+
+
+def test_coalesce_async():
+    pine = AsyncGatedClient(devices())
+
+    async def run() -> Any:
+        pine.gate = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(pine.get({"resource": "device", "id": 2}))
+            for _ in range(20)
+        ]
+        await asyncio.sleep(0)
+        pine.gate.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    assert results == [{"id": 2, "name": "device2"}] * 20
+    assert len(pine.server.requests) == 1
+    assert pine.single_flight.coalesced == 19
+
+
+def test_coalesce_async_leader_cancelled():
+    pine = AsyncGatedClient(devices())
+
+    async def run() -> Any:
+        pine.gate = asyncio.Event()
+        leader = asyncio.ensure_future(pine.get({"resource": "device", "id": 3}))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(pine.get({"resource": "device", "id": 3}))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        pine.gate.set()
+        return await follower
+
+    assert asyncio.run(run()) == {"id": 3, "name": "device3"}
+    assert len(pine.server.requests) == 1
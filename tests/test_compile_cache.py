@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any
+import pytest
+
+from .helper import MyClient
+
+
+def cached_client(size: int = 10) -> Any:
+    return MyClient("balena-test", compile_cache_size=size)
+
+
+def test_cache_hits_and_misses():
+    pine = cached_client()
+    params: Any = {"resource": "test", "options": {"$filter": {"a": "b"}}}
+
+    assert pine.compile(params) == "test?$filter=a eq 'b'"
+    assert pine.compile(params) == "test?$filter=a eq 'b'"
+    assert pine.compile_cache.stats() == {
+        "size": 1,
+        "max_size": 10,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+    }
+
+
+def test_cache_is_opt_in():
+    pine = MyClient("balena-test")
+    assert pine.compile_cache is None
+    assert pine.compile({"resource": "test", "id": 1}) == "test(1)"
+
+
+def test_cache_eviction():
+    pine = cached_client(2)
+    pine.compile({"resource": "a"})
+    pine.compile({"resource": "b"})
+    pine.compile({"resource": "a"})
+    pine.compile({"resource": "c"})
+
+    assert pine.compile_cache.evictions == 1
+    # "b" was the least recently used entry
+    pine.compile({"resource": "a"})
+    assert pine.compile_cache.hits == 2
+    pine.compile({"resource": "b"})
+    assert pine.compile_cache.misses == 4
+
+
+def test_cache_not_stale_after_mutation():
+    pine = cached_client()
+    filter: Any = {"a": "b"}
+    params: Any = {"resource": "test", "options": {"$filter": filter}}
+
+    assert pine.compile(params) == "test?$filter=a eq 'b'"
+    filter["a"] = "c"
+    assert pine.compile(params) == "test?$filter=a eq 'c'"
+    filter["d"] = ["e", "f"]
+    assert pine.compile(params) == "test?$filter=(a eq 'c') and (d eq ('e' or 'f'))"
+
+
+def test_cache_distinguishes_types():
+    pine = cached_client()
+
+    assert pine.compile({"resource": "test", "options": {"$filter": {"a": True}}}) == (
+        "test?$filter=a eq true"
+    )
+    assert pine.compile({"resource": "test", "options": {"$filter": {"a": 1}}}) == (
+        "test?$filter=a eq 1"
+    )
+    assert pine.compile({"resource": "test", "options": {"$filter": {"a": 1.0}}}) == (
+        "test?$filter=a eq 1.0"
+    )
+    assert pine.compile({"resource": "test", "options": {"$filter": {"a": "1"}}}) == (
+        "test?$filter=a eq '1'"
+    )
+    assert pine.compile_cache.hits == 0
+
+
+def test_cache_keeps_key_order():
+    pine = cached_client()
+
+    assert (
+        pine.compile({"resource": "test", "options": {"$filter": {"a": 1, "b": 2}}})
+        == "test?$filter=(a eq 1) and (b eq 2)"
+    )
+    assert (
+        pine.compile({"resource": "test", "options": {"$filter": {"b": 2, "a": 1}}})
+        == "test?$filter=(b eq 2) and (a eq 1)"
+    )
+
+
+def test_cache_datetimes():
+    pine = cached_client()
+    utc = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    shifted = utc.astimezone(timezone(timedelta(hours=2)))
+    assert utc == shifted
+
+    utc_url = pine.compile({"resource": "test", "options": {"$filter": {"a": utc}}})
+    shifted_url = pine.compile(
+        {"resource": "test", "options": {"$filter": {"a": shifted}}}
+    )
+    assert utc_url == MyClient("balena-test").compile(
+        {"resource": "test", "options": {"$filter": {"a": utc}}}
+    )
+    assert shifted_url == MyClient("balena-test").compile(
+        {"resource": "test", "options": {"$filter": {"a": shifted}}}
+    )
+    assert pine.compile_cache.hits == 0
+
+
+def test_cache_does_not_store_errors():
+    pine = cached_client()
+    params: Any = {"resource": "test", "options": {"$filter": {"$foobar": "fails"}}}
+
+    for _ in range(2):
+        with pytest.raises(Exception) as err:
+            pine.compile(params)
+        assert "Unrecognised operator: '$foobar'" in str(err)
+    assert len(pine.compile_cache) == 0
+
+
+def test_cache_bypassed_for_unknown_types():
+    class Unknown:
+        pass
+
+    pine = cached_client()
+    params: Any = {"resource": "test", "options": {"custom": Unknown()}}
+    with pytest.raises(Exception) as err:
+        pine.compile(params)
+    assert "Unknown type for option" in str(err)
+    assert pine.compile_cache.misses == 0
+
+
+def test_cache_deeply_nested_params():
+    pine = cached_client()
+
+    def params() -> Any:
+        filter: Any = {"a": 1}
+        for _ in range(5000):
+            filter = {"$not": filter}
+        return {"resource": "test", "options": {"$filter": filter}}
+
+    url = pine.compile(params())
+    assert pine.compile(params()) == url
+    assert pine.compile_cache.hits == 1
@@ -1,3 +1,4 @@
+from typing import Any
 import pytest
 from .helper import assert_compile
 
@@ -10,6 +11,46 @@ def test_throw_unrecognised_operator():
     assert "Unrecognised operator: '$foobar'" in str(err)
 
 
+def filter_error(filter: Any) -> str:
+    with pytest.raises(Exception) as err:
+        assert_compile({"resource": "test", "options": {"$filter": filter}}, "")
+    return str(err)
+
+
+def test_throw_empty_filter_in_join():
+    # Reported when the empty filter is reached, before the filters after it
+    # are looked at, where this used to fail with an IndexError or with an
+    # error from a later filter
+    assert "Cannot join an empty filter" in filter_error([1, {}])
+    assert "Cannot join an empty filter" in filter_error([{}, {"$foobar": 1}])
+    assert "Cannot join an empty filter" in filter_error({"$and": [{}, {"a": 1}]})
+    assert "Cannot join an empty filter" in filter_error({"a": {}, "$all": 1})
+
+
+def test_throw_raw_primitive():
+    assert "Expected None/str/int/float/dict/list, got: <class 'int'>" in (
+        filter_error({"$raw": 1})
+    )
+
+
+def test_throw_unused_raw_bind():
+    assert "Unrecognised operator: '$foobar'" in filter_error(
+        {"$raw": ["a eq $1", 1, {"$foobar": 1}]}
+    )
+    assert "Unrecognised operator: '$foobar'" in filter_error(
+        {"$raw": {"$string": "a eq 1", "b": {"$foobar": 1}}}
+    )
+
+
+def test_throw_first_invalid_order_by():
+    # Keys are checked in order, where the error used to depend on set order
+    with pytest.raises(Exception) as err:
+        assert_compile(
+            {"resource": "test", "options": {"$orderby": {"a": "up", "b": {}}}}, ""
+        )
+    assert "'$orderby' direction must be 'asc' or 'desc'" in str(err)
+
+
 # TODO: Python has no differentiation from None such as null/undefined
 # # so this test does not translate
 # def test_throw_null_id():
@@ -246,3 +246,11 @@ def test_expand_object():
         },
         "a($expand=b($expand=c/$count;$filter=d eq 'e'))",
     )
+
+
+def test_deeply_nested_expand():
+    depth = 5000
+    expand: Any = "leaf"
+    for _ in range(depth):
+        expand = {"a": {"$expand": expand, "$top": 1}}
+    expand_test(expand, "a($expand=" * depth + "leaf" + ";$top=1)" * depth)
@@ -2,6 +2,8 @@ from typing import Any, Dict
 import pytest
 from .helper import assert_compile
 from datetime import datetime
+from pine_client.client import build_filter
+from pine_client.utils import parse_raw_template
 
 
 def filter_test(input: Any, output: str):
@@ -394,7 +396,7 @@ def test_raw_arrays():
         {
             "$raw": ["a/b eq $1", {"$raw": "$"}],
         },
-        "(a/b eq (($$)))",
+        "(a/b eq (($)))",
     )
 
     filter_test(
@@ -464,7 +466,7 @@ def test_raw_objects():
                 "1": {"$raw": "$"},
             },
         },
-        "(a/b eq (($$)))",
+        "(a/b eq (($)))",
     )
 
     filter_test(
@@ -491,6 +493,50 @@ def test_raw_objects():
     )
 
 
+def test_raw_many_binds():
+    names = [f"p{i}" for i in range(25)]
+    raw: Dict[str, Any] = {
+        "$string": " and ".join(f"{name} eq ${name}" for name in names),
+    }
+    for i, name in enumerate(names):
+        raw[name] = i
+
+    filter_test(
+        {"$raw": raw},
+        "(" + " and ".join(f"{name} eq ({i})" for i, name in enumerate(names)) + ")",
+    )
+
+
+def test_raw_binds_are_not_substituted_twice():
+    filter_test(
+        {
+            "$raw": {
+                "$string": "a eq $a and b eq $b",
+                "a": {"$raw": "$b"},
+                "b": 1,
+            },
+        },
+        "(a eq (($b)) and b eq (1))",
+    )
+
+    filter_test(
+        {"$raw": ["a eq $1", {"b": {"$count": {}}}]},
+        "(a eq (b/$count))",
+    )
+
+    filter_test(
+        {"$raw": ["a eq $1 and b eq $$1 and c eq $9", "d"]},
+        "(a eq ('d') and b eq $('d') and c eq $9)",
+    )
+
+
+def test_raw_template_cache():
+    parse_raw_template.cache_clear()
+    for _ in range(3):
+        filter_test({"$raw": ["a eq $1", "b"]}, "(a eq ('b'))")
+    assert parse_raw_template.cache_info().misses == 1
+
+
 def test_and():
     filter_test(
         {
@@ -612,6 +658,20 @@ def test_in():
     )
 
 
+def test_in_homogeneous_lists():
+    filter_test(
+        {"a": {"$in": list(range(1000))}}, f"a in ({', '.join(map(str, range(1000)))})"
+    )
+    filter_test({"a": {"$in": [1.5, 2.0]}}, "a in (1.5, 2.0)")
+    filter_test({"a": {"$in": ["b", "c-d_e.f"]}}, "a in ('b', 'c-d_e.f')")
+    filter_test(
+        {"a": {"$in": ["b c", "d'e", "f/g%", "é"]}},
+        "a in ('b%20c', 'd''e', 'f%2Fg%25', '%C3%A9')",
+    )
+    filter_test({"a": {"$in": ["b\x00c", "d"]}}, "a in ('b%00c', 'd')")
+    filter_test({"a": {"$in": ["b", 1]}}, "a in ('b', 1)")
+
+
 def test_not():
     filter_test({"$not": "a"}, "not('a')")
 
@@ -826,3 +886,20 @@ def test_lambdas():
 
     test_lambda("$any")
     test_lambda("$all")
+
+
+def test_deeply_nested_filters():
+    depth = 5000
+    filter: Any = {"a": "b"}
+    for i in range(depth):
+        filter = {"$or" if i % 2 else "$and": [{"c": {"$ne": i}}, filter]}
+    filter = {"d": {"$any": {"$alias": "x", "$expr": {"$not": filter}}}}
+
+    filter_string = "".join(build_filter(filter))
+    assert filter_string.startswith("d/any(x:not((c ne 4999) or ((c ne 4998) and (")
+    assert filter_string.endswith("and (a eq 'b')" + ")" * (depth - 1) + "))")
+
+    filter = {"a": 1}
+    for _ in range(depth):
+        filter = {"b": {"$count": {"$filter": filter}}}
+    filter_test(filter, "b/$count($filter=" * depth + "a eq 1" + ")" * depth)
@@ -0,0 +1,179 @@
+from typing import Any
+import pytest
+
+from pine_client import (
+    And,
+    Call,
+    Compare,
+    CustomOption,
+    ExpandItem,
+    ExpandOption,
+    FilterOption,
+    In,
+    Lambda,
+    Not,
+    Or,
+    OrderByItem,
+    OrderByOption,
+    Placeholder,
+    QueryOptions,
+    Raw,
+    SelectOption,
+    TopOption,
+    to_filter_node,
+    to_query_options,
+)
+from pine_client.ir import FilterNode, Option
+from .helper import MyClient, pine
+
+
+def assert_same_url(options: Any, query: QueryOptions):
+    assert pine.compile({"resource": "device", "options": query}) == pine.compile(
+        {"resource": "device", "options": options}
+    )
+
+
+def test_build_ir():
+    query = QueryOptions(
+        SelectOption("id", "uuid"),
+        FilterOption(
+            And(
+                Compare("belongs_to__application", "eq", 5),
+                Or(
+                    Call("startswith", "device_name", "ab'c"),
+                    In(("tag", "value"), ["x", "y"]),
+                    Not(Compare("is_online", "eq", True)),
+                ),
+                Lambda("tag", "any", "t", Compare(("t", "key"), "ne", None)),
+                Raw("a eq b"),
+            )
+        ),
+        ExpandOption(
+            ExpandItem("application", QueryOptions(SelectOption("id"))),
+            ExpandItem("tag", QueryOptions(FilterOption(Compare("k", "eq", 1))), True),
+        ),
+        OrderByOption(OrderByItem("id", "desc"), OrderByItem("uuid")),
+        TopOption(5),
+        CustomOption("$format", "json"),
+    )
+    assert (
+        pine.compile({"resource": "device", "options": query})
+        == "device?$select=id,uuid&$filter=(belongs_to__application eq 5) and "
+        "(startswith(device_name,'ab''c') or (tag/value in ('x', 'y')) or "
+        "not(is_online eq true)) and (tag/any(t:t/key ne null)) and (a eq b)"
+        "&$expand=application($select=id),tag/$count($filter=k eq 1)"
+        "&$orderby=id desc,uuid&$top=5&$format=json"
+    )
+
+
+def test_convert_options():
+    options: Any = {
+        "$select": ["id", "uuid"],
+        "$filter": {
+            "a": 1,
+            "b": {"c": {"$in": [1, 2]}, "$ne": "x", "$startswith": "y"},
+            "$or": [{"d": None}, {"$not": {"e": True}}, {"$raw": "f eq 1"}],
+            "g": {"$any": {"$alias": "x", "$expr": {"x": {"h": {"@": "p"}}}}},
+            "i": {"$duration": {"days": 1}},
+            "$and": {"j": {"$count": {}}, "k": [1, 2]},
+        },
+        "$expand": [
+            "a",
+            {"b": {"$count": {"$filter": {"c": 1}}}, "d": {"$top": 1}},
+        ],
+        "$orderby": ["a desc,b", {"c": {"$count": {}}, "$dir": "asc"}],
+        "$skip": 2,
+        "@p": "value",
+        "custom": ["x", "y"],
+    }
+    assert_same_url(options, to_query_options(options))
+    assert_same_url(
+        {"$count": {"$filter": {"a": 1}}},
+        to_query_options({"$count": {"$filter": {"a": 1}}}),
+    )
+
+
+def test_convert_uses_typed_nodes():
+    assert to_filter_node({"a": {"b": 1, "$in": [2, 3]}}) == And(
+        Compare(("a", "b"), "eq", 1), In("a", [2, 3])
+    )
+    assert to_filter_node([{"a": 1}, {"$not": {"b": {"$contains": "c"}}}]) == Or(
+        Compare("a", "eq", 1), Not(Call("contains", "b", "c"))
+    )
+
+
+def test_equality_and_hashing():
+    def node(value: Any) -> Any:
+        return QueryOptions(FilterOption(And(Compare("a", "eq", value), Raw("b"))))
+
+    assert node(1) == node(1)
+    assert hash(node(1)) == hash(node(1))
+    assert node(1) != node(True)
+    assert node(1) != node(1.0)
+    assert node(Placeholder("x")) == node(Placeholder("x"))
+    assert len({node(1), node(1), node(2)}) == 2
+
+
+def test_compile_cache():
+    client = MyClient("/", compile_cache_size=10)
+    for _ in range(2):
+        query = QueryOptions(FilterOption(Compare("a", "eq", 1)))
+        assert client.compile({"resource": "device", "options": query}) == (
+            "device?$filter=a eq 1"
+        )
+    assert client.compile_cache.hits == 1
+
+
+def test_prepared_ir():
+    query = QueryOptions(FilterOption(Compare("uuid", "eq", Placeholder("uuid"))))
+    prepared = pine.prepare({"resource": "device", "options": query})
+    assert prepared.url(uuid="abc") == "device?$filter=uuid eq 'abc'"
+
+
+def test_deeply_nested_ir():
+    def nested() -> Any:
+        filter: Any = Compare("a", "eq", 1)
+        for _ in range(5000):
+            filter = Not(filter)
+        return QueryOptions(FilterOption(filter))
+
+    assert nested() == nested()
+    assert pine.compile({"resource": "device", "options": nested()}) == (
+        "device?$filter=" + "not(" * 5000 + "a eq 1" + ")" * 5000
+    )
+
+
+def test_validation():
+    with pytest.raises(Exception) as err:
+        Compare("a", "eq", {"b": 1})
+    assert "Expected None/str/int/float/bool/datetime, got: <class 'dict'>" in str(err)
+
+    with pytest.raises(Exception) as err:
+        Compare([], "eq", 1)
+    assert "Property paths must be non empty strings" in str(err)
+
+    with pytest.raises(Exception) as err:
+        In("a", [])
+    assert "In must have at least 1 value" in str(err)
+
+    with pytest.raises(Exception) as err:
+        ExpandItem("a", QueryOptions(TopOption(1)), count=True)
+    assert "Only $filter can be used in the $count of an expand" in str(err)
+
+    with pytest.raises(Exception) as err:
+        QueryOptions(TopOption(1), TopOption(2))
+    assert "The '$top' option is used more than once" in str(err)
+
+    with pytest.raises(Exception) as err:
+        CustomOption("$filter", "a eq 1")
+    assert "Use the dedicated node for the '$filter' option" in str(err)
+
+    with pytest.raises(Exception) as err:
+        to_query_options({"$filter": {"$foobar": 1}})
+    assert "Unrecognised operator: '$foobar'" in str(err)
+
+    # Only the concrete nodes know how to write themselves
+    for base in (FilterNode, Option):
+        with pytest.raises(TypeError) as err:
+            base()
+        assert "abstract method" in str(err)
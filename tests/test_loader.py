@@ -0,0 +1,222 @@
+from functools import partial
+from datetime import datetime
+from typing import Any, List
+import asyncio
+import threading
+
+import pytest
+
+from pine_client.loader import batch_key, batch_params, fan_out, single_result
+from .helper import AsyncFakeClient, FakeClient, RequestError, make_server
+
+devices = partial(make_server, 5, uuid="uuid{i}", name="device{i}", app=lambda i: i % 2)
+
+
+def load_in_threads(loader: Any, params: List[Any]) -> List[Any]:
+    results: List[Any] = [None] * len(params)
+    start = threading.Barrier(len(params))
+
+    def run(index: int) -> None:
+        start.wait()
+        try:
+            results[index] = loader.get(params[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(params))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batch_key():
+    key = batch_key({"resource": "device", "id": 1}, "/")
+    assert key is not None and key[1:] == (("id",), (1,))
+    key = batch_key({"resource": "device", "id": {"uuid": "a"}}, "/")
+    assert key is not None and key[1:] == (("uuid",), ("a",))
+    # Gets that only differ by id share a batch
+    one = batch_key({"resource": "device", "id": 1}, "/")
+    two = batch_key({"resource": "device", "id": 2}, "/")
+    assert one is not None and two is not None and one[0] == two[0]
+    # Gets that cannot be answered by one row of an `$in` request
+    assert batch_key({"resource": "device"}, "/") is None
+    assert batch_key({"resource": "device/$count", "id": 1}, "/") is None
+    assert batch_key({"resource": "device", "id": {"@": "id"}}, "/") is None
+    assert batch_key({"resource": "device", "id": True}, "/") is None
+    assert (
+        batch_key({"resource": "device", "id": 1, "options": {"$top": 1}}, "/") is None
+    )
+
+
+def test_match_ids_of_other_types():
+    by_id = fan_out([{"id": 5, "name": "a"}, {"id": None}], ("id",), [])
+    # Rows are JSON, an id asked for as a string still matches an integer key
+    assert single_result(by_id, ("5",)) == {"id": 5, "name": "a"}
+    assert single_result(by_id, (5.0,)) == {"id": 5, "name": "a"}
+    assert single_result(by_id, (6,)) is None
+
+    # Ids that rows cannot come back with are not batched
+    assert batch_key({"resource": "device", "id": datetime(2020, 1, 1)}, "/") is None
+    assert batch_key({"resource": "device", "id": {"a": datetime.now()}}, "/") is None
+
+
+def test_batch_params():
+    params, added = batch_params(
+        {"resource": "device", "id": 1, "options": {"$select": "name"}},
+        ("id",),
+        [(1,), (2,)],
+    )
+    assert params == {
+        "resource": "device",
+        "options": {"$select": ["name", "id"], "$filter": {"id": {"$in": [1, 2]}}},
+    }
+    assert added == ["id"]
+
+    params, added = batch_params(
+        {"resource": "device", "options": {"$filter": {"app": 1}}},
+        ("a", "b"),
+        [(1, 2), (3, 4)],
+    )
+    assert params["options"]["$filter"] == {
+        "$and": [{"app": 1}, {"$or": [{"a": 1, "b": 2}, {"a": 3, "b": 4}]}]
+    }
+    assert added == []
+
+
+def test_load_threads():
+    pine = FakeClient(devices())
+    loader = pine.loader(window=0.05)
+    results = load_in_threads(
+        loader, [{"resource": "device", "id": i} for i in [3, 1, 9, 3]]
+    )
+    assert [r and r["name"] for r in results] == ["device3", "device1", None, "device3"]
+    assert results[0] is not results[3]
+    assert loader.batches == 1
+    [(_, url, _)] = pine.server.requests
+    # Threads join the batch in whatever order they get the lock
+    prefix, _, ids = url.partition(" in (")
+    assert prefix == "/device?$filter=id"
+    assert sorted(ids.rstrip(")").split(", ")) == ["1", "3", "9"]
+
+
+def test_load_same_id_from_many_threads():
+    pine = FakeClient(devices())
+    loader = pine.loader(window=0.05)
+    results = load_in_threads(loader, [{"resource": "device", "id": 2}] * 20)
+    assert all(result == {**results[0], "id": 2} for result in results)
+    # Every caller gets its own row
+    assert len({id(result) for result in results}) == 20
+    assert loader.batches == 1
+
+
+def test_load_alternate_keys():
+    pine = FakeClient(devices())
+    loader = pine.loader(window=0.05)
+    results = load_in_threads(
+        loader,
+        [
+            {"resource": "device", "id": {"uuid": "uuid2"}},
+            {"resource": "device", "id": {"uuid": "uuid4"}},
+            {"resource": "device", "id": {"uuid": "missing"}},
+        ],
+    )
+    assert [r and r["id"] for r in results] == [2, 4, None]
+    assert len(pine.server.requests) == 1
+
+
+def test_load_groups_by_options():
+    pine = FakeClient(devices())
+    loader = pine.loader(window=0.05)
+    results = load_in_threads(
+        loader,
+        [
+            {"resource": "device", "id": 1, "options": {"$select": "name"}},
+            {"resource": "device", "id": 2, "options": {"$select": "name"}},
+            {"resource": "device", "id": 3, "options": {"$filter": {"app": 0}}},
+            {"resource": "device", "id": 4, "options": {"$filter": {"app": 0}}},
+        ],
+    )
+    # The id that was only added to $select to match rows is not returned
+    assert results[:2] == [{"name": "device1"}, {"name": "device2"}]
+    assert results[2] is None
+    assert results[3]["id"] == 4
+    assert loader.batches == 2
+
+
+def test_load_max_batch_size():
+    pine = FakeClient(devices())
+    loader = pine.loader(window=5, max_batch_size=2)
+    results = load_in_threads(loader, [{"resource": "device", "id": i} for i in [1, 2]])
+    # A full batch is sent without waiting for the window
+    assert [r["id"] for r in results] == [1, 2]
+    assert loader.batches == 1
+
+    with pytest.raises(Exception) as err:
+        pine.loader(max_batch_size=0)
+    assert "max_batch_size must be at least 1" in str(err)
+
+
+def test_load_passes_other_gets_through():
+    pine = FakeClient(devices())
+    loader = pine.loader()
+    assert len(loader.get({"resource": "device"})) == 5
+    assert loader.get({"resource": "device", "options": {"$count": {}}}) == 5
+    assert loader.batches == 0
+
+
+def test_load_errors():
+    class FailingClient(FakeClient):
+        def _request(self, method: str, url: str, body: Any = None) -> Any:
+            raise RequestError("Service unavailable", 503)
+
+    loader = FailingClient(devices()).loader(window=0.05)
+    results = load_in_threads(loader, [{"resource": "device", "id": i} for i in [1, 2]])
+    assert all(isinstance(result, RequestError) for result in results)
+
+
+def test_async_load_tick():
+    pine = AsyncFakeClient(devices())
+    loader = pine.loader()
+
+    async def run() -> List[Any]:
+        return await asyncio.gather(
+            *(loader.get({"resource": "device", "id": i}) for i in [5, 2, 7])
+        )
+
+    results = asyncio.run(run())
+    assert [r and r["name"] for r in results] == ["device5", "device2", None]
+    assert loader.batches == 1
+    assert pine.server.requests == [("GET", "/device?$filter=id in (5, 2, 7)", None)]
+
+
+def test_async_load_max_batch_size():
+    pine = AsyncFakeClient(devices())
+    loader = pine.loader(max_batch_size=2)
+
+    async def run() -> List[Any]:
+        return await asyncio.gather(
+            *(loader.get({"resource": "device", "id": i}) for i in [1, 2, 3, 4, 5])
+        )
+
+    results = asyncio.run(run())
+    assert [r["id"] for r in results] == [1, 2, 3, 4, 5]
+    assert loader.batches == 3
+
+
+def test_async_load_errors():
+    class FailingClient(AsyncFakeClient):
+        async def _request(self, method: str, url: str, body: Any = None) -> Any:
+            raise RequestError("Service unavailable", 503)
+
+    loader = FailingClient(devices()).loader()
+
+    async def run() -> List[Any]:
+        return await asyncio.gather(
+            *(loader.get({"resource": "device", "id": i}) for i in [1, 2]),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RequestError) for result in results)
@@ -0,0 +1,71 @@
+from typing import Any, List, Optional
+import pytest
+
+from pine_client import (
+    register_filter_operator,
+    register_filter_operation,
+    register_filter_function,
+)
+from pine_client import client
+from .test_filter import filter_test
+
+
+@pytest.fixture(autouse=True)
+def restore_operators(monkeypatch: Any):
+    monkeypatch.setattr(client, "filter_operators", dict(client.filter_operators))
+
+
+def test_register_operation():
+    register_filter_operation("$has")
+
+    filter_test({"a": {"$has": "b"}}, "a has 'b'")
+    filter_test({"$has": [{"$": "a"}, "b"]}, "a has 'b'")
+
+    with pytest.raises(Exception) as err:
+        filter_test({"$has": ["a", "b", "c"]}, "")
+    assert "$has expects 2 operands, got 3" in str(err)
+
+
+def test_register_function():
+    register_filter_function("$geo.intersects", 2)
+
+    filter_test({"a": {"$geo.intersects": "b"}}, "geo.intersects(a,'b')")
+    filter_test({"$geo.intersects": [{"$": "a"}, {"$": "b"}]}, "geo.intersects(a,b)")
+
+    with pytest.raises(Exception) as err:
+        filter_test({"$geo.intersects": [{"$": "a"}]}, "")
+    assert "$geo.intersects expects 2 operands, got 1" in str(err)
+
+
+def test_register_custom_handler():
+    def filter_between(
+        out: List[str], filter: Any, operator: str, parent_key: Optional[List[str]]
+    ) -> int:
+        low, high = filter
+        return client.write_filter_object(
+            out, {"$ge": low, "$le": high}, " and ", parent_key
+        )
+
+    register_filter_operator("$between", filter_between, 2, (list,))
+
+    filter_test({"a": {"$between": [1, 5]}}, "(a ge 1) and (a le 5)")
+
+    with pytest.raises(Exception) as err:
+        filter_test({"a": {"$between": 1}}, "")
+    assert "Expected type for $between, got: <class 'int'>" in str(err)
+
+
+def test_register_errors():
+    with pytest.raises(Exception) as err:
+        register_filter_operation("$eq")
+    assert "Filter operator '$eq' is already registered" in str(err)
+
+    with pytest.raises(Exception) as err:
+        register_filter_function("contains")
+    assert "Filter operators must start with '$', got: 'contains'" in str(err)
+
+
+def test_builtin_operators_registered():
+    for operator in ["$eq", "$mod", "$contains", "$cast", "$raw", "$in", "$all"]:
+        assert operator in client.filter_operators
+    assert client.filter_operators["$duration"].value_types == (dict,)
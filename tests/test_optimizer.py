@@ -0,0 +1,160 @@
+import random
+from typing import Any
+
+from pine_client import optimize_filter
+from .helper import FakeClient, FakeServer, FilterParser, MyClient
+
+
+def test_flatten_and_dedupe():
+    assert optimize_filter(
+        {"$and": [{"$and": [{"a": 1}, {"b": 2}]}, {"a": 1}, {"$and": {"c": 3}}]}
+    ) == {"$and": [{"a": 1}, {"b": 2}, {"c": 3}]}
+    assert optimize_filter([[{"a": 1}, {"b": 2}], {"b": 2}]) == {
+        "$or": [{"a": 1}, {"b": 2}]
+    }
+    assert optimize_filter({"$not": {"$not": {"a": 1}}}) == {"a": 1}
+
+
+def test_merge_eq_chains():
+    assert optimize_filter(
+        {
+            "$or": [
+                {"a": 1},
+                {"b": {"c": "x"}},
+                {"a": {"$eq": 2}},
+                {"b": {"c": {"$in": ["y", "x"]}}},
+                {"a": 1},
+                {"a": None},
+                {"a": True},
+            ]
+        }
+    ) == {
+        "$or": [
+            {"a": {"$in": [1, 2]}},
+            {"b": {"c": {"$in": ["x", "y"]}}},
+            {"a": None},
+            {"a": True},
+        ]
+    }
+    # Equalities are only merged inside an $or
+    assert optimize_filter({"a": 1, "$and": [{"a": 2}]}) == {
+        "$and": [{"a": 1}, {"a": 2}]
+    }
+
+
+def test_constant_branches():
+    assert optimize_filter({"$or": [{"a": 1}, True]}) is True
+    assert optimize_filter({"$and": [{"a": 1}, True]}) == {"a": 1}
+    assert optimize_filter({"$and": [{"a": 1}, {"$not": True}]}) == {"$raw": "false"}
+    assert optimize_filter({"$or": [{"a": 1}, False]}) == {"a": 1}
+
+
+def test_lambda_expressions():
+    assert optimize_filter(
+        {
+            "tag": {
+                "$any": {
+                    "$alias": "t",
+                    "$expr": {"$or": [{"t": {"v": 1}}, {"t": {"v": 2}}]},
+                }
+            }
+        }
+    ) == {"tag": {"$any": {"$alias": "t", "$expr": {"t": {"v": {"$in": [1, 2]}}}}}}
+
+
+def test_client_option():
+    pine = MyClient("/", optimize_filters=True)
+    assert (
+        pine.compile(
+            {
+                "resource": "device",
+                "options": {
+                    "$filter": {"$or": [{"id": 1}, {"id": 2}, {"id": 1}]},
+                    "$expand": {"tag": {"$filter": {"$and": [True, {"k": "x"}]}}},
+                },
+            }
+        )
+        == "device?$filter=id in (1, 2)&$expand=tag($filter=k eq 'x')"
+    )
+    assert (
+        pine.compile(
+            {"resource": "device", "options": {"$filter": [True], "$select": "id"}}
+        )
+        == "device?$select=id"
+    )
+    assert (
+        MyClient("/").compile(
+            {"resource": "device", "options": {"$filter": [{"id": 1}, {"id": 2}]}}
+        )
+        == "device?$filter=(id eq 1) or (id eq 2)"
+    )
+
+
+def test_always_false_filter():
+    rows = [{"id": 1}, {"id": 2}]
+    pine = FakeClient(FakeServer({"device": rows}), optimize_filters=True)
+    params: Any = {
+        "resource": "device",
+        "options": {"$filter": {"$and": [{"id": 1}, {"$not": True}]}},
+    }
+    assert pine.compile(params) == "device?$filter=(false)"
+    assert pine.get(params) == []
+
+
+def random_value(rng: random.Random) -> Any:
+    return rng.choice([0, 1, 2, 3, "x", "y", None])
+
+
+def random_filter(rng: random.Random, depth: int) -> Any:
+    property = rng.choice(["a", "b", "c"])
+    choice = rng.randrange(10 if depth > 0 else 4)
+    if choice == 0:
+        return {property: random_value(rng)}
+    elif choice == 1:
+        return {property: {"$eq": random_value(rng)}}
+    elif choice == 2:
+        return {property: {"$in": [rng.randrange(4) for _ in range(rng.randint(1, 3))]}}
+    elif choice == 3:
+        return {"d": {"e": rng.randrange(3)}}
+    elif choice == 4:
+        return {property: {"$ne": random_value(rng), "$gt": rng.randrange(3)}}
+    elif choice == 5:
+        return {"$not": random_filter(rng, depth - 1)}
+    elif choice in (6, 7):
+        key = rng.choice(["$and", "$or"])
+        return {key: [random_filter(rng, depth - 1) for _ in range(rng.randint(2, 4))]}
+    elif choice == 8:
+        return [random_filter(rng, depth - 1) for _ in range(rng.randint(2, 4))]
+    return {
+        property: {"$gt": rng.randrange(3)},
+        "$or": [random_filter(rng, depth - 1), random_filter(rng, depth - 1)],
+    }
+
+
+def evaluate(filter: Any) -> Any:
+    url = MyClient("/").compile({"resource": "device", "options": {"$filter": filter}})
+    return FilterParser(url.split("$filter=", 1)[1]).parse()
+
+
+def test_optimized_filters_are_equivalent():
+    rng = random.Random(1234)
+    values = [0, 1, 2, 3, None]
+    rows = [
+        {
+            "a": rng.choice(values),
+            "b": rng.choice(values),
+            "c": rng.choice(values),
+            "d": {"e": rng.randrange(3)},
+        }
+        for _ in range(60)
+    ]
+    for _ in range(300):
+        filter = random_filter(rng, 4)
+        optimized = optimize_filter(filter)
+        original = evaluate(filter)
+        if optimized is True:
+            assert all(original(row) for row in rows)
+            continue
+        result = evaluate(optimized)
+        for row in rows:
+            assert original(row) == result(row), (filter, optimized, row)
@@ -0,0 +1,369 @@
+from base64 import urlsafe_b64encode
+from datetime import datetime
+from functools import partial
+from typing import Any, Optional
+import asyncio
+import pytest
+import threading
+
+from .helper import AsyncFakeClient, FakeClient, FakeServer, make_server
+
+devices = partial(
+    make_server, count=250, name=lambda i: f"device{i % 7}", app=lambda i: i % 3
+)
+
+
+def test_iter_pages():
+    pine = FakeClient(devices())
+    rows = list(pine.iter({"resource": "device"}, page_size=100))
+    assert [row["id"] for row in rows] == list(range(1, 251))
+    assert [url for _, url, _ in pine.server.requests] == [
+        "/device?$orderby=id&$top=100",
+        "/device?$orderby=id&$top=100&$skip=100",
+        "/device?$orderby=id&$top=100&$skip=200",
+    ]
+
+
+def test_iter_is_lazy():
+    pine = FakeClient(devices())
+    rows = pine.iter({"resource": "device"}, page_size=10)
+    assert next(rows)["id"] == 1
+    assert len(pine.server.requests) == 1
+
+
+def test_iter_reuses_options():
+    pine = FakeClient(devices())
+    params: Any = {
+        "resource": "device",
+        "options": {
+            "$filter": {"app": 1},
+            "$orderby": "name desc",
+            "$select": ["id", "name"],
+        },
+    }
+    assert list(pine.iter(params, page_size=7)) == pine.get(
+        {**params, "options": {**params["options"], "$orderby": "name desc,id"}}
+    )
+    assert pine.server.requests[0][1] == (
+        "/device?$filter=app eq 1&$orderby=name desc,id&$select=id,name&$top=7"
+    )
+
+
+def test_iter_respects_top_and_skip():
+    pine = FakeClient(devices())
+    params: Any = {
+        "resource": "device",
+        "options": {"$orderby": {"id": "desc"}, "$skip": 5, "$top": 23},
+    }
+    rows = list(pine.iter(params, page_size=10))
+    assert [row["id"] for row in rows] == list(range(245, 222, -1))
+    assert [url for _, url, _ in pine.server.requests] == [
+        "/device?$orderby=id desc&$top=10&$skip=5",
+        "/device?$orderby=id desc&$top=10&$skip=15",
+        "/device?$orderby=id desc&$top=3&$skip=25",
+    ]
+
+
+def test_iter_exact_multiple():
+    pine = FakeClient(devices(count=20))
+    assert len(list(pine.iter({"resource": "device"}, page_size=10))) == 20
+    assert len(pine.server.requests) == 3
+
+
+def test_async_iter():
+    pine = AsyncFakeClient(devices())
+
+    async def run() -> Any:
+        return [row["id"] async for row in pine.iter({"resource": "device"}, 100)]
+
+    assert asyncio.run(run()) == list(range(1, 251))
+    assert len(pine.server.requests) == 3
+
+
+def test_iter_refusals():
+    pine = FakeClient(devices())
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, page_size=0)
+    assert "page_size must be a positive integer, got: 0" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device", "id": 1})
+    assert "Cannot paginate requests for a single resource by id" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device", "options": {"$count": {}}})
+    assert "Cannot paginate $count requests" in str(err)
+
+
+def test_keyset_pages():
+    pine = FakeClient(devices())
+    params: Any = {"resource": "device", "options": {"$filter": {"app": 1}}}
+    rows = list(pine.iter(params, page_size=40, keyset=True))
+    assert rows == pine.get(
+        {**params, "options": {"$filter": {"app": 1}, "$orderby": "id"}}
+    )
+    assert [url for _, url, _ in pine.server.requests[:3]] == [
+        "/device?$filter=app eq 1&$orderby=id&$top=40",
+        "/device?$filter=(app eq 1) and (id gt 118)&$orderby=id&$top=40",
+        "/device?$filter=(app eq 1) and (id gt 238)&$orderby=id&$top=40",
+    ]
+
+
+def test_keyset_composite_key():
+    pine = FakeClient(devices())
+    rows = list(
+        pine.iter({"resource": "device"}, page_size=30, key=["name", "id"], keyset=True)
+    )
+    assert [row["id"] for row in rows] == [
+        row["id"]
+        for row in pine.get({"resource": "device", "options": {"$orderby": "name,id"}})
+    ]
+    assert pine.server.requests[1][1] == (
+        "/device?$orderby=name,id&$filter=(name gt 'device0') or "
+        "((name eq 'device0') and (id gt 210))&$top=30"
+    )
+
+
+def test_keyset_cursor():
+    pine = FakeClient(devices())
+    pages = pine.pages({"resource": "device"}, page_size=10, keyset=True)
+    assert pages.cursor is None
+    rows = pine.iter_rows(pages)
+    first = [next(rows) for _ in range(15)]
+    assert [row["id"] for row in first] == list(range(1, 16))
+
+    # Resuming picks up after the last row that was handed out
+    rest = list(pine.iter({"resource": "device"}, page_size=10, cursor=pages.cursor))
+    assert [row["id"] for row in rest] == list(range(16, 251))
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, key="name", cursor=pages.cursor)
+    assert "The cursor was created for the key ['id'], not ['name']" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, cursor="nope")
+    assert "Invalid pagination cursor: 'nope'" in str(err)
+
+
+def test_keyset_cursor_composite_key():
+    pine = FakeClient(devices())
+    pages = pine.pages(
+        {"resource": "device"}, page_size=7, key=["name", "id"], keyset=True
+    )
+    rows = pine.iter_rows(pages)
+    first = [next(rows) for _ in range(10)]
+    rest = list(
+        pine.iter(
+            {"resource": "device"}, page_size=7, key=["name", "id"], cursor=pages.cursor
+        )
+    )
+    everything = pine.iter({"resource": "device"}, key=["name", "id"], keyset=True)
+    assert first + rest == list(everything)
+
+
+def test_keyset_cursor_types():
+    rows = [{"id": i, "seen": datetime(2020, 1, i)} for i in range(1, 6)]
+    pine = FakeClient(FakeServer({"device": rows}))
+    pages = pine.pages({"resource": "device"}, page_size=2, key="seen", keyset=True)
+    next(pine.iter_rows(pages))
+    # A resumed cursor would compare `seen` with a string instead
+    with pytest.raises(Exception) as err:
+        pages.cursor
+    assert "Cannot create a cursor for the keyset key 'seen'" in str(err)
+
+    cursor = urlsafe_b64encode(b'{"k":["id"],"v":[{"a":1}]}').decode()
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, cursor=cursor)
+    assert "Invalid pagination cursor" in str(err)
+
+
+def test_keyset_refusals():
+    pine = FakeClient(devices())
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device", "options": {"$orderby": "name"}}, keyset=True)
+    assert "Keyset pagination orders by its key and cannot use $orderby" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device", "options": {"$skip": 1}}, keyset=True)
+    assert "Keyset pagination cannot be combined with $skip" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device", "options": {"$select": "name"}}, keyset=True)
+    assert "The keyset key 'id' must be in $select" in str(err)
+
+    with pytest.raises(Exception) as err:
+        list(pine.iter({"resource": "device"}, key="missing", keyset=True))
+    assert "The keyset key 'missing' is missing or null in a returned row" in str(err)
+
+
+class GatedClient(FakeClient):
+    # The next `parties` requests wait at a barrier until all of them are in
+    # flight together, which shows requests overlap without timing them
+    def __init__(self, server: FakeServer, parties: int = 1):
+        super().__init__(server)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = 0
+        self.gate(parties)
+
+    def gate(self, parties: int) -> None:
+        self.barrier = threading.Barrier(parties)
+        self.gated = parties
+
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        with self.lock:
+            self.started += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            held = self.gated > 0
+            self.gated -= held
+        try:
+            if held:
+                self.barrier.wait(timeout=5)
+            return super()._request(method, url, body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_prefetch_pages():
+    params: Any = {"resource": "device", "options": {"$filter": {"app": 1}}}
+    pine = GatedClient(devices())
+    expected = list(pine.iter(params, page_size=10))
+    assert pine.max_in_flight == 1
+    assert len(pine.server.requests) == 9
+
+    pine = GatedClient(devices(), parties=4)
+    assert list(pine.iter(params, page_size=10, prefetch=4)) == expected
+    assert pine.max_in_flight == 4
+    # 9 pages plus at most 3 requests past the end
+    assert len(pine.server.requests) <= 9 + 3
+
+
+def test_prefetch_respects_top_and_skip():
+    pine = FakeClient(devices())
+    params: Any = {
+        "resource": "device",
+        "options": {"$orderby": "id", "$skip": 3, "$top": 45},
+    }
+    rows = list(pine.iter(params, page_size=10, prefetch=3))
+    assert [row["id"] for row in rows] == list(range(4, 49))
+    assert len(pine.server.requests) == 5
+
+
+def test_prefetch_stops_early():
+    pine = GatedClient(devices(), parties=3)
+    rows = pine.iter({"resource": "device"}, page_size=10, prefetch=3)
+    assert next(rows)["id"] == 1
+    rows.close()
+    # Only the pages already in flight were requested
+    assert pine.started == 3
+
+
+def test_async_prefetch():
+    pine = AsyncFakeClient(devices())
+
+    async def run() -> Any:
+        rows = pine.iter({"resource": "device"}, page_size=20, prefetch=5)
+        return [row["id"] async for row in rows]
+
+    assert asyncio.run(run()) == list(range(1, 251))
+    assert pine.max_in_flight == 5
+
+
+def test_prefetch_refusals():
+    pine = FakeClient(devices())
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, prefetch=0)
+    assert "prefetch must be a positive integer, got: 0" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.iter({"resource": "device"}, keyset=True, prefetch=2)
+    assert "Keyset pagination cannot prefetch pages" in str(err)
+
+
+def test_partition():
+    pine = FakeClient(devices())
+    params: Any = {"resource": "device", "options": {"$filter": {"app": 1}}}
+    partitions = pine.partition(params, 4)
+    assert [p["options"]["$filter"] for p in partitions] == [
+        {"$and": [{"app": 1}, {"id": {"$lt": 64}}]},
+        {"$and": [{"app": 1}, {"id": {"$ge": 64, "$lt": 127}}]},
+        {"$and": [{"app": 1}, {"id": {"$ge": 127, "$lt": 190}}]},
+        {"$and": [{"app": 1}, {"id": {"$ge": 190}}]},
+    ]
+    assert [len(pine.get(p)) for p in partitions] == [21, 21, 21, 21]
+    assert pine.partition({"resource": "device"}, 1) == [{"resource": "device"}]
+
+
+def test_partition_nullable_field():
+    rows: Any = [{"id": i, "app": None if i % 4 == 0 else i % 5} for i in range(1, 41)]
+    pine = FakeClient(FakeServer({"device": rows}))
+    partitions = pine.partition({"resource": "device"}, 8, by="app")
+    # Repeated bounds collapse and nulls join the last partition
+    assert [p["options"]["$filter"] for p in partitions] == [
+        {"app": {"$lt": 1}},
+        {"app": {"$ge": 1, "$lt": 2}},
+        {"app": {"$ge": 2, "$lt": 3}},
+        {"app": {"$ge": 3, "$lt": 4}},
+        {"$or": [{"app": {"$ge": 4}}, {"app": None}]},
+    ]
+    scanned = list(pine.scan({"resource": "device"}, 8, by="app", page_size=3))
+    assert sorted(row["id"] for row in scanned) == list(range(1, 41))
+
+
+def test_scan():
+    class ScanClient(GatedClient):
+        def partition(self, *args: Any, **kwargs: Any) -> Any:
+            partitions = super().partition(*args, **kwargs)
+            # Holds the first page of every partition
+            self.gate(5)
+            return partitions
+
+    pine = ScanClient(devices())
+    params: Any = {"resource": "device", "options": {"$select": ["id", "name"]}}
+    rows = list(pine.scan(params, partitions=5, page_size=20, concurrency=5))
+    assert sorted(rows, key=lambda row: row["id"]) == pine.get(params)
+    assert pine.max_in_flight == 5
+
+
+def test_scan_stops_early():
+    pine = GatedClient(devices())
+    rows = pine.scan({"resource": "device"}, partitions=4, page_size=5)
+    next(rows)
+    rows.close()
+    # Closing waits for the workers, none of them is still requesting pages
+    assert pine.in_flight == 0
+    # Partitioning, the page read, then per worker at most a queued page, the
+    # page it was queueing and the page it fetched before seeing the stop
+    assert len(pine.server.requests) <= 5 + 1 + 4 * 3
+
+
+def test_async_scan():
+    pine = AsyncFakeClient(devices())
+
+    async def run() -> Any:
+        return [
+            row["id"]
+            async for row in pine.scan({"resource": "device"}, 3, page_size=30)
+        ]
+
+    assert sorted(asyncio.run(run())) == list(range(1, 251))
+    assert pine.max_in_flight == 3
+
+
+def test_scan_refusals():
+    pine = FakeClient(devices())
+
+    with pytest.raises(Exception) as err:
+        pine.scan({"resource": "device", "options": {"$top": 5}})
+    assert "Partitioned scans cannot use $top" in str(err)
+
+    with pytest.raises(Exception) as err:
+        pine.scan({"resource": "device"}, partitions=0)
+    assert "partitions must be a positive integer, got: 0" in str(err)
+    assert len(pine.server.requests) == 0
@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Any
+import pytest
+
+from pine_client import Placeholder
+from .helper import MyClient, pine
+
+
+def assert_bind(params: Any, values: Any, concrete: Any):
+    prepared = pine.prepare(params)
+    assert prepared.url(**values) == pine.compile(concrete)
+
+
+def test_prepare_filter():
+    params: Any = {
+        "resource": "device",
+        "options": {"$filter": {"uuid": Placeholder("uuid")}},
+    }
+    for value in ["abc", "a'b c", 1, 1.5, True, None, datetime(2023, 1, 1)]:
+        assert_bind(
+            params,
+            {"uuid": value},
+            {"resource": "device", "options": {"$filter": {"uuid": value}}},
+        )
+
+
+def test_prepare_multiple_slots():
+    def params(a: Any, b: Any) -> Any:
+        return {
+            "resource": "device",
+            "options": {
+                "$select": ["id", "uuid"],
+                "$filter": {
+                    "$or": [
+                        {"belongs_to__application": a},
+                        {"device_name": {"$startswith": b}},
+                        {"id": {"$in": [a, 3]}},
+                    ]
+                },
+                "$expand": {"device_tag": {"$filter": {"tag_key": b}}},
+                "$orderby": {"id": "asc"},
+            },
+        }
+
+    assert_bind(
+        params(Placeholder("app"), Placeholder("prefix")),
+        {"app": 12, "prefix": "ab'c"},
+        params(12, "ab'c"),
+    )
+
+
+def test_prepare_id():
+    prepared = pine.prepare({"resource": "device", "id": Placeholder("id")})
+    assert prepared.url(id=5) == "device(5)"
+    assert prepared.bind(id=5) == {"resource": "device", "id": 5, "url": "device(5)"}
+
+    prepared = pine.prepare(
+        {"resource": "device", "id": {"uuid": Placeholder("uuid"), "a": 1}}
+    )
+    assert prepared.bind(uuid="x") == {
+        "resource": "device",
+        "id": {"uuid": "x", "a": 1},
+        "url": "device(uuid='x',a=1)",
+    }
+
+
+def test_prepare_bind_request():
+    requests = []
+
+    class RecordingClient(MyClient):
+        def _request(self, method: str, url: str, body: Any = None) -> Any:
+            requests.append((method, url, body))
+            return {"d": [{"id": 1}]}
+
+    client = RecordingClient("/resin/")
+    prepared = client.prepare(
+        {"resource": "device", "options": {"$filter": {"uuid": Placeholder("uuid")}}}
+    )
+    assert client.get(prepared.bind(uuid="abc")) == [{"id": 1}]
+    assert requests == [("GET", "/resin/device?$filter=uuid eq 'abc'", None)]
+
+
+def test_prepare_errors():
+    prepared = pine.prepare(
+        {"resource": "device", "options": {"$filter": {"uuid": Placeholder("uuid")}}}
+    )
+
+    with pytest.raises(Exception) as err:
+        prepared.url()
+    assert "Missing value for placeholder 'uuid'" in str(err)
+
+    with pytest.raises(Exception) as err:
+        prepared.url(uuid=1, other=2)
+    assert "Unknown placeholders: ['other']" in str(err)
+
+    with pytest.raises(Exception) as err:
+        prepared.url(uuid={"a": 1})
+    assert "Placeholder 'uuid' can only be bound to a primitive" in str(err)
+
+    with pytest.raises(Exception) as err:
+        Placeholder("not valid")
+    assert "Placeholder names must be valid identifiers" in str(err)
+
+
+def test_prepare_uses_compile_cache():
+    client = MyClient("balena-test", compile_cache_size=10)
+    params: Any = {"resource": "device", "id": Placeholder("id")}
+    client.prepare(params)
+    client.prepare(params)
+    assert client.compile_cache.hits == 1
@@ -0,0 +1,148 @@
+from typing import Any
+import asyncio
+import pytest
+
+from pine_client.cache import ResponseCache
+from .helper import AsyncFakeClient, FakeClient, FakeServer
+
+
+def make_client(**kwargs: Any) -> Any:
+    server = FakeServer(
+        {
+            "device": [{"id": i, "name": f"device{i}"} for i in range(1, 6)],
+            "application": [{"id": 1, "name": "app"}],
+        }
+    )
+    return FakeClient(server, response_cache_size=10, **kwargs)
+
+
+def test_cache_hits():
+    pine = make_client()
+    params: Any = {"resource": "device", "options": {"$filter": {"id": {"$lt": 3}}}}
+    first = pine.get(params)
+    assert pine.get(params) == first
+    assert pine.get({"resource": "device", "id": 99}) is None
+    assert pine.get({"resource": "device", "id": 99}) is None
+    assert len(pine.server.requests) == 2
+    assert pine.response_cache.stats() == {
+        "size": 2,
+        "max_size": 10,
+        "bytes": 0,
+        "max_bytes": None,
+        "hits": 2,
+        "misses": 2,
+        "evictions": 0,
+        "expirations": 0,
+        "invalidations": 0,
+    }
+
+    # Results are copies, mutating one does not change the cache
+    first[0]["name"] = "changed"
+    assert pine.get(params)[0]["name"] == "device1"
+
+
+def test_cache_is_opt_in():
+    pine = FakeClient(make_client().server)
+    assert pine.response_cache is None
+    pine.get({"resource": "device"})
+    pine.get({"resource": "device"})
+    assert len(pine.server.requests) == 2
+
+
+def test_cache_ttl():
+    pine = make_client(response_cache_ttl=5)
+    now = [0.0]
+    pine.response_cache.clock = lambda: now[0]
+    pine.get({"resource": "device"})
+    now[0] = 4.9
+    pine.get({"resource": "device"})
+    now[0] = 5.0
+    pine.get({"resource": "device"})
+    assert len(pine.server.requests) == 2
+    assert pine.response_cache.expirations == 1
+
+
+def test_cache_lru_eviction():
+    pine = make_client()
+    pine.response_cache.max_size = 2
+    for id in [1, 2, 1, 3, 1, 2]:
+        pine.get({"resource": "device", "id": id})
+    # 2 was the least recently used when 3 was added
+    assert [url for _, url, _ in pine.server.requests] == [
+        "/device(1)",
+        "/device(2)",
+        "/device(3)",
+        "/device(2)",
+    ]
+    assert pine.response_cache.evictions == 2
+
+
+def test_cache_max_bytes():
+    pine = make_client(response_cache_max_bytes=60)
+    pine.get({"resource": "device", "id": 1})
+    pine.get({"resource": "device", "id": 2})
+    assert pine.response_cache.bytes == 56
+    pine.get({"resource": "device", "id": 3})
+    assert pine.response_cache.evictions == 1
+    assert pine.response_cache.bytes == 56
+    # Results larger than the whole cache are not stored
+    pine.get({"resource": "device"})
+    assert len(pine.response_cache) == 2
+
+
+def test_writes_invalidate_resource():
+    pine = make_client()
+    pine.get({"resource": "device", "id": 1})
+    pine.get({"resource": "device/$count"})
+    pine.get({"resource": "application"})
+
+    pine.patch({"resource": "device", "id": 1, "body": {"name": "patched"}})
+    assert pine.get({"resource": "device", "id": 1})["name"] == "patched"
+    assert pine.get({"resource": "device/$count"}) == 5
+    pine.get({"resource": "application"})
+    assert pine.response_cache.invalidations == 2
+    assert pine.response_cache.hits == 1
+
+    pine.post({"resource": "device", "body": {"name": "new"}})
+    assert pine.get({"resource": "device/$count"}) == 6
+
+
+def test_batch_writes_invalidate():
+    pine = make_client()
+    pine.get({"resource": "device", "id": 1})
+    with pine.batch() as batch:
+        batch.delete({"resource": "device", "id": 1})
+    assert pine.get({"resource": "device", "id": 1}) is None
+
+
+def test_stale_results_are_not_cached():
+    cache = ResponseCache(10, 60)
+    generation = cache.generation("device")
+    # A write lands while the GET is in flight
+    cache.invalidate("device")
+    cache.set("/device", "device", [1], generation)
+    assert len(cache) == 0
+
+    generation = cache.generation("device")
+    cache.invalidate()
+    cache.set("/device", "device", [1], generation)
+    assert len(cache) == 0
+
+
+def test_async_cache():
+    pine = AsyncFakeClient(make_client().server, response_cache_size=10)
+
+    async def run() -> Any:
+        await pine.get({"resource": "device", "id": 1})
+        await pine.get({"resource": "device", "id": 1})
+        await pine.patch({"resource": "device", "id": 1, "body": {"name": "x"}})
+        return await pine.get({"resource": "device", "id": 1})
+
+    assert asyncio.run(run())["name"] == "x"
+    assert len(pine.server.requests) == 3
+
+
+def test_cache_validation():
+    with pytest.raises(Exception) as err:
+        ResponseCache(10, 0)
+    assert "Cache ttl must be positive, got: 0" in str(err)
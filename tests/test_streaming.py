@@ -0,0 +1,144 @@
+from functools import partial
+from typing import Any, Iterator, Optional
+import asyncio
+import io
+import json
+import pytest
+
+from .helper import AsyncFakeClient, FakeClient, FakeServer, make_server
+
+devices = partial(make_server, 50, name="dévice {i}", tags=lambda i: [i, None])
+
+
+def chunked(data: Any, size: int) -> Iterator[bytes]:
+    raw = json.dumps(data, ensure_ascii=False).encode()
+    return iter([raw[start:][:size] for start in range(0, len(raw), size)])
+
+
+class StreamingClient(FakeClient):
+    def __init__(self, server: FakeServer, chunk_size: int = 7):
+        super().__init__(server)
+        self.chunk_size = chunk_size
+        self.reads = 0
+
+    def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        result = super()._request(method, url, body)
+        if method != "GET":
+            return result
+
+        def chunks() -> Iterator[bytes]:
+            for chunk in chunked({"__count": 1, "d": result["d"]}, self.chunk_size):
+                self.reads += 1
+                yield chunk
+
+        return chunks()
+
+
+class AsyncStreamingClient(AsyncFakeClient):
+    async def _request(self, method: str, url: str, body: Optional[Any] = None) -> Any:
+        result = await super()._request(method, url, body)
+
+        async def chunks() -> Any:
+            for chunk in chunked(result, 5):
+                await asyncio.sleep(0)
+                yield chunk
+
+        return chunks()
+
+
+def test_stream_rows():
+    pine = StreamingClient(devices())
+    expected = FakeClient(devices()).get({"resource": "device"})
+    for chunk_size in (1, 3, 7, 64 * 1024):
+        pine.chunk_size = chunk_size
+        rows = pine.get({"resource": "device"})
+        assert not isinstance(rows, list)
+        assert list(rows) == expected
+
+
+def test_stream_is_lazy():
+    pine = StreamingClient(devices(), chunk_size=16)
+    rows = pine.get({"resource": "device"})
+    assert next(rows)["id"] == 1
+    reads = pine.reads
+    assert reads < 10
+    assert next(rows)["id"] == 2
+    assert pine.reads < 20
+
+
+def test_stream_singular_and_count():
+    pine = StreamingClient(devices())
+    assert pine.get({"resource": "device", "id": 3})["name"] == "dévice 3"
+    assert pine.get({"resource": "device", "id": 99}) is None
+    assert pine.get({"resource": "device", "options": {"$count": {}}}) == 50
+
+    get = pine.transform_get_result({"resource": "device", "id": 1})
+    with pytest.raises(Exception) as err:
+        get(io.BytesIO(b'{"d": [{"id": 1}, {"id": 1}, "never read"'))
+    assert "Returned multiple results when only one was expected." in str(err)
+
+
+def test_stream_file_objects():
+    pine = FakeClient(devices())
+    get = pine.transform_get_result({"resource": "device"})
+    assert list(get(io.BytesIO(b' {"d" : [ 1, {"a": "\\u00e9"} ] }'))) == [
+        1,
+        {"a": "é"},
+    ]
+    assert list(get(io.StringIO('{"d":[]}'))) == []
+
+
+def test_stream_paginates():
+    pine = StreamingClient(devices())
+    rows = list(pine.iter({"resource": "device"}, page_size=20, prefetch=2))
+    assert [row["id"] for row in rows] == list(range(1, 51))
+
+
+def test_stream_errors():
+    get = FakeClient(devices()).transform_get_result({"resource": "device"})
+
+    with pytest.raises(Exception) as err:
+        get(io.BytesIO(b"[1, 2]"))
+    assert "Response was not a JSON object" in str(err)
+
+    with pytest.raises(Exception) as err:
+        get(io.BytesIO(b'{"a": [1, 2]}'))
+    assert "Invalid response received, the 'd' property is missing." in str(err)
+
+    with pytest.raises(Exception) as err:
+        list(get(io.BytesIO(b'{"d": [1, 2')))
+    assert "Invalid JSON in streamed response, it ended early" in str(err)
+
+
+def test_async_stream():
+    pine = AsyncStreamingClient(devices())
+    expected = FakeClient(devices()).get({"resource": "device"})
+
+    async def run() -> Any:
+        rows = await pine.get({"resource": "device"})
+        single = await pine.get({"resource": "device", "id": 2})
+        pages = [row async for row in pine.iter({"resource": "device"}, page_size=15)]
+        return [row async for row in rows], single, pages
+
+    rows, single, pages = asyncio.run(run())
+    assert rows == expected
+    assert pages == expected
+    assert single == expected[1]
+
+
+def test_async_stream_lookup_first_upsert():
+    rows = [{"id": i, "name": f"device{i}"} for i in range(1, 21)]
+    pine = AsyncStreamingClient(
+        FakeServer({"device": rows}, {"device": ["name"]}), adaptive_upsert=True
+    )
+
+    async def run() -> None:
+        for i in range(1, 21):
+            await pine.upsert(
+                {"resource": "device", "id": {"name": f"device{i}"}, "body": {"a": 1}}
+            )
+
+    asyncio.run(run())
+    assert pine.upsert_strategy.stats("device")["lookups"] > 0
+    assert [r[0] for r in pine.server.requests[-2:]] == ["GET", "PATCH"]
+    assert all(row["a"] == 1 for row in pine.server.resources["device"])
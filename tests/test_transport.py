@@ -0,0 +1,200 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List
+from urllib.parse import unquote
+import gzip
+import json
+import threading
+
+import pytest
+
+from pine_client import HTTPPinejsClient, HTTPRequestError, MultipartBody
+from pine_client.client import is_unique_violation
+from .helper import FakeServer, RequestError
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, which Nagle would delay
+    disable_nagle_algorithm = True
+    server: Any
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def handle_request(self, method: str) -> None:
+        self.server.headers.append(dict(self.headers))
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode() if length else None
+        content_type = self.headers.get("Content-Type", "")
+        url = unquote(self.path)
+        try:
+            if content_type.startswith("multipart/"):
+                result: Any = self.server.fake.handle_batch(
+                    MultipartBody(content_type, raw or "")
+                )
+                data = result.encode()
+                response_type = "multipart/mixed; boundary=response_batch"
+            else:
+                body = json.loads(raw) if raw else None
+                result = self.server.fake.handle(method, url, body)
+                data = json.dumps(result).encode()
+                response_type = "application/json"
+            status = 200
+        except RequestError as e:
+            status, data, response_type = (
+                e.status_code,
+                e.message.encode(),
+                "text/plain",
+            )
+        if self.server.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data)
+            self.send_response(status)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(status)
+        self.send_header("Content-Type", response_type)
+        self.send_header("Content-Length", str(len(data)))
+        # Closes the connection without telling the client it would
+        self.close_connection = self.server.drop
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self.handle_request("GET")
+
+    def do_POST(self) -> None:
+        self.handle_request("POST")
+
+    def do_PATCH(self) -> None:
+        self.handle_request("PATCH")
+
+    def do_DELETE(self) -> None:
+        self.handle_request("DELETE")
+
+
+@pytest.fixture
+def server() -> Iterator[Any]:
+    httpd: Any = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.fake = FakeServer(
+        {"device": [{"id": i, "name": f"device {i}"} for i in range(1, 4)]},
+        {"device": ["name"]},
+    )
+    httpd.connections = 0
+    httpd.headers = []
+    httpd.gzip = False
+    httpd.drop = False
+    httpd.daemon_threads = True
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_client(server: Any, **kwargs: Any) -> HTTPPinejsClient:
+    host, port = server.server_address
+    return HTTPPinejsClient(f"http://{host}:{port}/", **kwargs)
+
+
+def test_keep_alive(server: Any):
+    with make_client(server, headers={"Authorization": "Bearer token"}) as pine:
+        for _ in range(5):
+            assert pine.get({"resource": "device", "id": 2}) == {
+                "id": 2,
+                "name": "device 2",
+            }
+        assert server.connections == 1
+        assert pine.pool(pine.origin).opened == 1
+    assert server.headers[0]["Authorization"] == "Bearer token"
+    assert server.headers[0]["Accept-Encoding"] == "gzip, deflate"
+
+
+def test_quotes_compiled_urls(server: Any):
+    with make_client(server) as pine:
+        result = pine.get(
+            {"resource": "device", "options": {"$filter": {"name": "device 3"}}}
+        )
+    assert [row["id"] for row in result] == [3]
+
+
+def test_gzip(server: Any):
+    server.gzip = True
+    with make_client(server) as pine:
+        assert len(pine.get({"resource": "device"})) == 3
+
+
+def test_json_bodies_and_errors(server: Any):
+    with make_client(server) as pine:
+        created = pine.post({"resource": "device", "body": {"name": "new"}})
+        assert created == {"id": 4, "name": "new"}
+        assert server.headers[-1]["Content-Type"] == "application/json"
+
+        with pytest.raises(HTTPRequestError) as err:
+            pine.post({"resource": "device", "body": {"name": "new"}})
+        assert err.value.status_code == 409
+        assert is_unique_violation(err.value)
+
+        # The connection is still reused after an error response
+        assert server.connections == 1
+
+
+def test_batch(server: Any):
+    with make_client(server) as pine:
+        with pine.batch() as batch:
+            one = batch.get({"resource": "device", "id": 1})
+            with batch.change_set():
+                batch.patch({"resource": "device", "id": 2, "body": {"name": "b"}})
+    assert one.result()["name"] == "device 1"
+    assert server.fake.resources["device"][1]["name"] == "b"
+
+
+def test_pool_is_bounded(server: Any):
+    results: List[Any] = []
+    with make_client(server, pool_size=2) as pine:
+
+        def run() -> None:
+            for _ in range(5):
+                results.append(pine.get({"resource": "device", "id": 1}))
+
+        threads = [threading.Thread(target=run) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert pine.pool(pine.origin).opened <= 2
+    assert len(results) == 30
+    assert server.connections <= 2
+
+
+def test_reconnects_when_the_server_closed_the_connection(server: Any):
+    with make_client(server) as pine:
+        server.drop = True
+        pine.get({"resource": "device", "id": 1})
+        server.drop = False
+        assert pine.get({"resource": "device", "id": 1})["id"] == 1
+        assert server.connections == 2
+
+        # Writes are not retried as the server may have applied them
+        server.drop = True
+        pine.get({"resource": "device", "id": 1})
+        with pytest.raises(ConnectionError):
+            pine.patch({"resource": "device", "id": 1, "body": {"name": "x"}})
+
+
+def test_invalid_arguments():
+    with pytest.raises(Exception) as err:
+        HTTPPinejsClient("ftp://example.com")
+    assert "api_url must be an http(s) url" in str(err)
+    with pytest.raises(Exception) as err:
+        HTTPPinejsClient("http://example.com", pool_size=0)
+    assert "pool_size must be at least 1" in str(err)
+
+    pine = HTTPPinejsClient("https://example.com/v6")
+    assert pine.api_prefix == "/v6/"
+    assert pine.origin == ("https", "example.com", 443)